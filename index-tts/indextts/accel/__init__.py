@@ -7,3 +7,4 @@ from .attention import (  # noqa: F401
 )
 from .gpt2_accel import GPT2AccelAttention, GPT2AccelModel  # noqa: F401
 from .kv_manager import KVCacheManager, Seq  # noqa: F401
+from .scheduler import ContinuousBatchScheduler, TTSRequest  # noqa: F401
@@ -11,21 +11,43 @@ from .attention import (
     set_forward_context,
 )
 from .kv_manager import KVCacheManager, Seq
+from indextts.utils.fused_sampling import FusedSampler
 
 
 class Sampler(nn.Module):
     def __init__(self):
         super().__init__()
+        self.fused = FusedSampler()
+
+    def forward(
+        self,
+        logits: torch.Tensor,
+        temperatures: torch.Tensor,
+        noise: torch.Tensor,
+        seen: Optional[torch.Tensor] = None,
+        top_k: int = 0,
+        top_p: float = 1.0,
+        repetition_penalty: float = 1.0,
+    ):
+        if top_k or top_p < 1.0 or (seen is not None and repetition_penalty != 1.0):
+            # 惩罚 / top-k / top-p 与温度在同一次处理中完成，再用同样的 noise 采样
+            return self.fused(logits, seen, temperature=temperatures, top_k=top_k, top_p=top_p,
+                              repetition_penalty=repetition_penalty, noise=noise)
+        return self._sample(logits, temperatures, noise)
 
     @torch.compile
-    def forward(self, logits: torch.Tensor, temperatures: torch.Tensor):
+    def _sample(self, logits: torch.Tensor, temperatures: torch.Tensor, noise: torch.Tensor):
+        # Gumbel-max style sampling: argmax(p / e) with e ~ Exp(1) draws from p
         logits = logits.float().div_(temperatures.unsqueeze(dim=1))
         probs = torch.softmax(logits, dim=-1)
-        sample_tokens = probs.div_(
-            torch.empty_like(probs).exponential_(1).clamp_min_(1e-10)
-        ).argmax(dim=-1)
+        sample_tokens = probs.div_(noise.clamp_min_(1e-10)).argmax(dim=-1)
         return sample_tokens
 
+    @staticmethod
+    def noise(logits: torch.Tensor, generator: Optional[torch.Generator] = None):
+        """Exp(1) noise for `forward`, drawn outside the compiled graph so a seeded generator can be used."""
+        return torch.empty(logits.shape, dtype=torch.float32, device=logits.device).exponential_(1, generator=generator)
+
 
 class AccelInferenceEngine:
     def __init__(
@@ -54,8 +76,10 @@ class AccelInferenceEngine:
         self.lm_head = lm_head
         self.block_size = block_size
         self.num_blocks = num_blocks
-        self.use_cuda_graph = use_cuda_graph and torch.cuda.is_available()
         model_dtype = next(model.parameters()).dtype
+        # 模型在 CPU 上时使用 attention.py 中纯 PyTorch 的分页注意力，不用 CUDA Graph
+        self.device = next(model.parameters()).device
+        self.use_cuda_graph = use_cuda_graph and self.device.type == "cuda"
         self.hidden_size = (
             model.config.hidden_size
             if hasattr(model, "config")
@@ -67,7 +91,8 @@ class AccelInferenceEngine:
             head_dim=head_dim,
             block_size=block_size,
             num_blocks=num_blocks,
-            dtype=torch.float16,  # Force fp16 for FlashAttention
+            dtype=model_dtype,  # the CUDA cache is always fp16 for FlashAttention
+            device=self.device,
         )
         self.kv_manager.wire_kv_cache_to_model(model)
         self.sampler = Sampler()
@@ -77,6 +102,11 @@ class AccelInferenceEngine:
         self.graph_pool = None
         self.graph_captured = False
 
+    def _to_device(self, values: list, dtype: torch.dtype) -> torch.Tensor:
+        if self.device.type != "cuda":
+            return torch.tensor(values, dtype=dtype, device=self.device)
+        return torch.tensor(values, dtype=dtype, pin_memory=True).cuda(non_blocking=True)
+
     def _prepare_prefill(self, requests: List[Seq]):
         input_ids = []
         positions = []
@@ -98,30 +128,23 @@ class AccelInferenceEngine:
             max_seqlen_k = max(seqlen_k, max_seqlen_k)
 
             if req.block_table:
+                # cached tokens may end inside a block (a reused conditioning prefix), start at the first uncached one
                 for i in range(req.num_cached_blocks, req.num_blocks):
                     block_id = req.block_table[i]
                     start = block_id * self.block_size
+                    if i == req.num_cached_blocks:
+                        start += req.num_cached_tokens - i * self.block_size
                     if i != req.num_blocks - 1:
-                        end = start + self.block_size
+                        end = block_id * self.block_size + self.block_size
                     else:
-                        end = start + req.last_block_num_tokens
+                        end = block_id * self.block_size + req.last_block_num_tokens
                     slot_mapping.extend(list(range(start, end)))
 
-        input_ids = torch.tensor(input_ids, dtype=torch.int64, pin_memory=True).cuda(
-            non_blocking=True
-        )
-        positions = torch.tensor(positions, dtype=torch.int64, pin_memory=True).cuda(
-            non_blocking=True
-        )
-        cu_seqlens_q = torch.tensor(
-            cu_seqlens_q, dtype=torch.int32, pin_memory=True
-        ).cuda(non_blocking=True)
-        cu_seqlens_k = torch.tensor(
-            cu_seqlens_k, dtype=torch.int32, pin_memory=True
-        ).cuda(non_blocking=True)
-        slot_mapping = torch.tensor(
-            slot_mapping, dtype=torch.int32, pin_memory=True
-        ).cuda(non_blocking=True)
+        input_ids = self._to_device(input_ids, torch.int64)
+        positions = self._to_device(positions, torch.int64)
+        cu_seqlens_q = self._to_device(cu_seqlens_q, torch.int32)
+        cu_seqlens_k = self._to_device(cu_seqlens_k, torch.int32)
+        slot_mapping = self._to_device(slot_mapping, torch.int32)
 
         block_tables = None
         if cu_seqlens_k[-1] > cu_seqlens_q[-1]:
@@ -130,9 +153,7 @@ class AccelInferenceEngine:
             for req in requests:
                 table = req.block_table + [-1] * (max_len - len(req.block_table))
                 block_tables_list.append(table)
-            block_tables = torch.tensor(
-                block_tables_list, dtype=torch.int32, pin_memory=True
-            ).cuda(non_blocking=True)
+            block_tables = self._to_device(block_tables_list, torch.int32)
 
         set_forward_context(
             True,
@@ -169,27 +190,17 @@ class AccelInferenceEngine:
                 req.block_table[-1] * self.block_size + req.last_block_num_tokens - 1
             )
 
-        input_ids = torch.tensor(input_ids, dtype=torch.int64, pin_memory=True).cuda(
-            non_blocking=True
-        )
-        positions = torch.tensor(positions, dtype=torch.int64, pin_memory=True).cuda(
-            non_blocking=True
-        )
-        slot_mapping = torch.tensor(
-            slot_mapping, dtype=torch.int32, pin_memory=True
-        ).cuda(non_blocking=True)
-        context_lens = torch.tensor(
-            context_lens, dtype=torch.int32, pin_memory=True
-        ).cuda(non_blocking=True)
+        input_ids = self._to_device(input_ids, torch.int64)
+        positions = self._to_device(positions, torch.int64)
+        slot_mapping = self._to_device(slot_mapping, torch.int32)
+        context_lens = self._to_device(context_lens, torch.int32)
 
         max_len = max(len(req.block_table) for req in requests)
         block_tables_list = []
         for req in requests:
             table = req.block_table + [-1] * (max_len - len(req.block_table))
             block_tables_list.append(table)
-        block_tables = torch.tensor(
-            block_tables_list, dtype=torch.int32, pin_memory=True
-        ).cuda(non_blocking=True)
+        block_tables = self._to_device(block_tables_list, torch.int32)
 
         assert block_tables.dim() == 2, (
             f"block_tables must be 2D, got shape {block_tables.shape}"
@@ -209,11 +220,22 @@ class AccelInferenceEngine:
 
     def _prepare_sample(self, requests: List[Seq], temperature: float):
         temperatures = [temperature] * len(requests)
-        temperatures = torch.tensor(
-            temperatures, dtype=torch.float32, pin_memory=True
-        ).cuda(non_blocking=True)
+        temperatures = self._to_device(temperatures, torch.float32)
         return temperatures
 
+    def _sample_tokens(self, logits, temperature, temperatures, seen, top_k, top_p, repetition_penalty, generator):
+        """Next token of every sequence; temperature 0 is greedy. `seen` (if any) is updated with the tokens."""
+        if temperature > 0:
+            tokens = self.sampler(logits, temperatures, self.sampler.noise(logits, generator),
+                                  seen=seen, top_k=top_k, top_p=top_p, repetition_penalty=repetition_penalty)
+        elif seen is not None:
+            tokens = self.sampler.fused(logits, seen, do_sample=False, repetition_penalty=repetition_penalty)
+        else:
+            tokens = torch.argmax(logits, dim=-1)
+        if seen is not None:
+            seen.scatter_(1, tokens.unsqueeze(1), True)
+        return tokens
+
     @torch.inference_mode()
     def _capture_cuda_graphs(self, tts_mel_embedding=None, tts_text_pos_embedding=None):
         print("Capturing CUDA graphs for decode optimization...")
@@ -387,15 +409,20 @@ class AccelInferenceEngine:
         temperature: float = 1.0,
         top_k: int = 50,
         top_p: float = 1.0,
+        repetition_penalty: float = 1.0,
         stop_tokens: Optional[List[int]] = None,
         attention_mask: Optional[torch.Tensor] = None,
         tts_embeddings: Optional[
             torch.Tensor
-        ] = None,  # TTS: [pad][cond][text] embeddings (87 tokens, NO start_mel)
+        ] = None,  # TTS: [cond][pad][text] embeddings (87 tokens, NO start_mel)
+        tts_prefix_len: int = 0,  # TTS: length of the [cond] prefix
+        tts_prefix_hash: Optional[str] = None,  # TTS: hash of the [cond] prefix embeddings
         tts_mel_embedding: Optional[torch.nn.Module] = None,  # TTS: mel_embedding layer
         tts_text_pos_embedding: Optional[
             torch.nn.Module
         ] = None,  # TTS: text_pos_embedding layer
+        return_hidden_states: bool = False,
+        generator: Optional[torch.Generator] = None,
     ) -> torch.Tensor:
         """
         Generate tokens.
@@ -406,10 +433,17 @@ class AccelInferenceEngine:
             temperature: Sampling temperature
             top_k: Top-k sampling
             top_p: Nucleus sampling threshold
+            repetition_penalty: HF-style penalty on the logits of the input_ids and the generated tokens
             stop_tokens: List of token IDs that stop generation
+            return_hidden_states: Also return the last hidden state of every decoding step
+            tts_prefix_len / tts_prefix_hash: the leading conditioning prefix of tts_embeddings and its hash.
+                Its KV is kept by the KV manager and copied into later sequences with the same hash,
+                whose prefill then only runs the tokens after the prefix.
+            generator: Optional random generator for reproducible (seeded) sampling
 
         Returns:
             Generated token IDs [batch_size, total_len]
+            (and hidden states [batch_size, num_steps, hidden_size] if return_hidden_states)
         """
         batch_size = input_ids.size(0)
         device = input_ids.device
@@ -447,8 +481,11 @@ class AccelInferenceEngine:
                 token_ids[-1] = input_ids[i, -1].item() if input_ids.size(1) > 0 else 1
             else:
                 token_ids = input_ids[i].tolist()
-            req = Seq(token_ids)
-            self.kv_manager.allocate(req)
+            req = Seq(token_ids, block_size=self.block_size)
+            # TTS 的 token id 只是占位符，按 token 计算的块哈希没有意义，不参与块复用；前缀复用按前缀嵌入的哈希
+            self.kv_manager.allocate(req, reuse_blocks=not self._tts_mode)
+            if self._tts_mode and tts_prefix_hash is not None and tts_prefix_len > 0:
+                self.kv_manager.load_prefix(tts_prefix_hash, req, tts_prefix_len)
             sequences.append(req)
 
         self.current_sequences = sequences
@@ -473,7 +510,7 @@ class AccelInferenceEngine:
             start_token_id = input_ids[0, -1] if input_ids.size(1) > 0 else 8192
 
             start_emb = tts_mel_embedding(
-                torch.tensor([[start_token_id]], device="cuda")
+                torch.tensor([[start_token_id]], device=self.device)
             )  # [1, 1, hidden_dim]
 
             start_emb = start_emb + tts_text_pos_embedding(start_emb)
@@ -486,9 +523,13 @@ class AccelInferenceEngine:
             if full_embeddings.dtype != model_dtype:
                 full_embeddings = full_embeddings.to(model_dtype)
 
+            # 前缀命中时只计算前缀之后的位置，注意力通过 block_tables 读取已拷贝的前缀 KV
+            num_cached_tokens = sequences[0].num_cached_tokens
             hidden_states = self.model(
-                inputs_embeds=full_embeddings, return_dict=True
+                inputs_embeds=full_embeddings[:, num_cached_tokens:], return_dict=True
             ).last_hidden_state
+            if tts_prefix_hash is not None and tts_prefix_len > 0 and num_cached_tokens == 0:
+                self.kv_manager.save_prefix(tts_prefix_hash, sequences[0], tts_prefix_len)
 
         else:
             hidden_states = self.model(
@@ -498,6 +539,7 @@ class AccelInferenceEngine:
         reset_forward_context()
 
         last_hidden = hidden_states[:, -1, :]  # [batch_size, hidden_size]
+        step_hiddens = [last_hidden] if return_hidden_states else None
 
         if self.lm_head is not None:
             if last_hidden.dtype != next(self.lm_head.parameters()).dtype:
@@ -506,11 +548,14 @@ class AccelInferenceEngine:
         else:
             logits = self.model.compute_logits(last_hidden)  # [batch_size, vocab_size]
 
+        seen = None
+        if repetition_penalty != 1.0:
+            # 与 HF 一致，重复惩罚也计入（占位的）input_ids
+            seen = torch.zeros(logits.shape, dtype=torch.bool, device=logits.device)
+            seen.scatter_(1, input_ids.to(logits.device), True)
         temperatures = self._prepare_sample(sequences, temperature)
-        if temperature > 0:
-            first_token = self.sampler(logits, temperatures)
-        else:
-            first_token = torch.argmax(logits, dim=-1)
+        first_token = self._sample_tokens(logits, temperature, temperatures, seen, top_k, top_p,
+                                          repetition_penalty, generator)
 
         first_token_list = first_token.tolist()
 
@@ -534,6 +579,8 @@ class AccelInferenceEngine:
                 output_ids.append(full_sequence)
 
             output = torch.tensor(output_ids, dtype=torch.long, device=device)
+            if return_hidden_states:
+                return output, torch.stack(step_hiddens, dim=1)
             return output
 
         if not hit_stop_on_first:
@@ -560,6 +607,9 @@ class AccelInferenceEngine:
                 tts_mel_embedding=tts_mel_embedding,
                 tts_text_pos_embedding=tts_text_pos_embedding,
             )
+            if return_hidden_states:
+                # CUDA graph outputs live in a reused buffer
+                step_hiddens.append(hidden_states.clone())
 
             # Get logits
             if self.lm_head is not None:
@@ -572,10 +622,8 @@ class AccelInferenceEngine:
             reset_forward_context()
 
             temperatures = self._prepare_sample(sequences, temperature)
-            if temperature > 0:
-                next_token = self.sampler(logits, temperatures)
-            else:
-                next_token = torch.argmax(logits, dim=-1)
+            next_token = self._sample_tokens(logits, temperature, temperatures, seen, top_k, top_p,
+                                             repetition_penalty, generator)
             next_token_list = next_token.tolist()
 
             should_stop = False
@@ -606,4 +654,6 @@ class AccelInferenceEngine:
             f"Output batch size mismatch: {output.size(0)} != {batch_size}"
         )
 
+        if return_hidden_states:
+            return output, torch.stack(step_hiddens, dim=1)
         return output
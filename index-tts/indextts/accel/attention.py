@@ -1,11 +1,19 @@
 from dataclasses import dataclass
 
 import torch
-import triton
-import triton.language as tl
-from flash_attn import flash_attn_varlen_func, flash_attn_with_kvcache
+import torch.nn.functional as F
 from torch import nn
 
+try:
+    import triton
+    import triton.language as tl
+    from flash_attn import flash_attn_varlen_func, flash_attn_with_kvcache
+
+    HAS_CUDA_KERNELS = True
+except ImportError:
+    # CPU 节点：没有 triton / flash-attn，走下方纯 PyTorch 的分页注意力
+    HAS_CUDA_KERNELS = False
+
 
 @dataclass
 class ForwardContext:
@@ -54,54 +62,135 @@ def reset_forward_context():
     _FORWARD_CONTEXT = ForwardContext()
 
 
-@triton.jit
-def store_kvcache_kernel(
-    key_ptr,
-    key_stride,
-    value_ptr,
-    value_stride,
-    k_cache_ptr,
-    v_cache_ptr,
-    slot_mapping_ptr,
-    D: tl.constexpr,
-):
-    BLOCK_SIZE: tl.constexpr = 2048
-    idx = tl.program_id(0)
-    slot = tl.load(slot_mapping_ptr + idx)
-    if slot == -1:
-        return
-    d_offset = 0
-    while d_offset < D:
-        cur_block_size = min(BLOCK_SIZE, D - d_offset)
-        key_offsets = idx * key_stride + d_offset + tl.arange(0, BLOCK_SIZE)
-        value_offsets = idx * value_stride + d_offset + tl.arange(0, BLOCK_SIZE)
-        cache_offsets = slot * D + d_offset + tl.arange(0, BLOCK_SIZE)
-
-        mask = tl.arange(0, BLOCK_SIZE) < cur_block_size
-        key = tl.load(key_ptr + key_offsets, mask=mask, other=0.0)
-        value = tl.load(value_ptr + value_offsets, mask=mask, other=0.0)
-        tl.store(k_cache_ptr + cache_offsets, key, mask=mask)
-        tl.store(v_cache_ptr + cache_offsets, value, mask=mask)
-
-        d_offset += BLOCK_SIZE
-
-
-def store_kvcache(
+if HAS_CUDA_KERNELS:
+
+    @triton.jit
+    def store_kvcache_kernel(
+        key_ptr,
+        key_stride,
+        value_ptr,
+        value_stride,
+        k_cache_ptr,
+        v_cache_ptr,
+        slot_mapping_ptr,
+        D: tl.constexpr,
+    ):
+        BLOCK_SIZE: tl.constexpr = 2048
+        idx = tl.program_id(0)
+        slot = tl.load(slot_mapping_ptr + idx)
+        if slot == -1:
+            return
+        d_offset = 0
+        while d_offset < D:
+            cur_block_size = min(BLOCK_SIZE, D - d_offset)
+            key_offsets = idx * key_stride + d_offset + tl.arange(0, BLOCK_SIZE)
+            value_offsets = idx * value_stride + d_offset + tl.arange(0, BLOCK_SIZE)
+            cache_offsets = slot * D + d_offset + tl.arange(0, BLOCK_SIZE)
+
+            mask = tl.arange(0, BLOCK_SIZE) < cur_block_size
+            key = tl.load(key_ptr + key_offsets, mask=mask, other=0.0)
+            value = tl.load(value_ptr + value_offsets, mask=mask, other=0.0)
+            tl.store(k_cache_ptr + cache_offsets, key, mask=mask)
+            tl.store(v_cache_ptr + cache_offsets, value, mask=mask)
+
+            d_offset += BLOCK_SIZE
+
+
+    def store_kvcache(
+        key: torch.Tensor,
+        value: torch.Tensor,
+        k_cache: torch.Tensor,
+        v_cache: torch.Tensor,
+        slot_mapping: torch.Tensor,
+    ):
+        N, num_heads, head_dim = key.shape
+        D = num_heads * head_dim
+        assert key.stride(-1) == 1 and value.stride(-1) == 1
+        assert key.stride(1) == head_dim and value.stride(1) == head_dim
+        assert k_cache.stride(1) == D and v_cache.stride(1) == D
+        assert slot_mapping.numel() == N
+        store_kvcache_kernel[(N,)](
+            key, key.stride(0), value, value.stride(0), k_cache, v_cache, slot_mapping, D
+        )
+
+
+def store_kvcache_torch(
     key: torch.Tensor,
     value: torch.Tensor,
     k_cache: torch.Tensor,
     v_cache: torch.Tensor,
     slot_mapping: torch.Tensor,
 ):
-    N, num_heads, head_dim = key.shape
-    D = num_heads * head_dim
-    assert key.stride(-1) == 1 and value.stride(-1) == 1
-    assert key.stride(1) == head_dim and value.stride(1) == head_dim
-    assert k_cache.stride(1) == D and v_cache.stride(1) == D
-    assert slot_mapping.numel() == N
-    store_kvcache_kernel[(N,)](
-        key, key.stride(0), value, value.stride(0), k_cache, v_cache, slot_mapping, D
+    """`store_kvcache` in plain PyTorch: scatter [N, H, D] key / value rows into their cache slots (-1 skips)."""
+    num_heads, head_dim = key.shape[1:]
+    valid = slot_mapping >= 0
+    slots = slot_mapping[valid].long()
+    k_cache.view(-1, num_heads, head_dim).index_copy_(0, slots, key[valid].to(k_cache.dtype))
+    v_cache.view(-1, num_heads, head_dim).index_copy_(0, slots, value[valid].to(v_cache.dtype))
+
+
+def gather_kvcache(cache: torch.Tensor, block_tables: torch.Tensor, length: int) -> torch.Tensor:
+    """
+    Read back the first `length` tokens of every sequence from a paged cache.
+    Args:
+        cache: [num_blocks, block_size, H, D]
+        block_tables: [B, max_blocks] block ids, -1 padded
+    Returns:
+        [B, length, H, D] (slots past a sequence's own length hold stale data, mask them)
+    """
+    block_size = cache.shape[1]
+    num_blocks = (length + block_size - 1) // block_size
+    blocks = cache[block_tables[:, :num_blocks].clamp(min=0).long()]  # [B, n, block_size, H, D]
+    return blocks.flatten(1, 2)[:, :length]
+
+
+def paged_attention_prefill_torch(q, k, v, k_cache, v_cache, context: ForwardContext, scale: float):
+    """
+    Causal varlen attention over packed [N, H, D] queries, the reference of `flash_attn_varlen_func`.
+    With block tables the keys / values come from the paged cache, so cached prefix tokens are attended too.
+    """
+    cu_seqlens_q = context.cu_seqlens_q.tolist()
+    cu_seqlens_k = context.cu_seqlens_k.tolist()
+    o = torch.empty_like(q)
+    for i in range(len(cu_seqlens_q) - 1):
+        q_start, q_end = cu_seqlens_q[i], cu_seqlens_q[i + 1]
+        len_q, len_k = q_end - q_start, cu_seqlens_k[i + 1] - cu_seqlens_k[i]
+        if context.block_tables is not None:
+            k_i = gather_kvcache(k_cache, context.block_tables[i:i + 1], len_k)[0]
+            v_i = gather_kvcache(v_cache, context.block_tables[i:i + 1], len_k)[0]
+        else:
+            k_i = k[cu_seqlens_k[i]:cu_seqlens_k[i + 1]]
+            v_i = v[cu_seqlens_k[i]:cu_seqlens_k[i + 1]]
+        # query j 位于绝对位置 len_k - len_q + j，只能看到它之前（含）的 key
+        mask = torch.ones(len_q, len_k, dtype=torch.bool, device=q.device).tril(len_k - len_q)
+        o[q_start:q_end] = F.scaled_dot_product_attention(
+            q[q_start:q_end].transpose(0, 1),
+            k_i.to(q.dtype).transpose(0, 1),
+            v_i.to(q.dtype).transpose(0, 1),
+            attn_mask=mask,
+            scale=scale,
+        ).transpose(0, 1)
+    return o
+
+
+def paged_attention_decode_torch(q, k_cache, v_cache, context: ForwardContext, scale: float):
+    """
+    One query token per sequence against its paged cache, the reference of `flash_attn_with_kvcache`.
+    The batch is padded to the longest context and the padding masked, so the whole step is one SDPA call.
+    """
+    context_lens = context.context_lens.long()
+    max_len = int(context_lens.max())
+    k = gather_kvcache(k_cache, context.block_tables, max_len).to(q.dtype)  # [B, L, H, D]
+    v = gather_kvcache(v_cache, context.block_tables, max_len).to(q.dtype)
+    mask = torch.arange(max_len, device=q.device)[None, :] < context_lens[:, None]  # [B, L]
+    o = F.scaled_dot_product_attention(
+        q.unsqueeze(2),  # [B, H, 1, D]
+        k.transpose(1, 2),
+        v.transpose(1, 2),
+        attn_mask=mask[:, None, None, :],
+        scale=scale,
     )
+    return o.squeeze(2)
 
 
 class Attention(nn.Module):
@@ -123,6 +212,9 @@ class Attention(nn.Module):
         context = get_forward_context()
         k_cache, v_cache = self.k_cache, self.v_cache
 
+        if not q.is_cuda:
+            return self._forward_torch(q, k, v, context)
+
         if k_cache.numel() and v_cache.numel() and context.slot_mapping is not None:
             store_kvcache(k, v, k_cache, v_cache, context.slot_mapping)
 
@@ -152,3 +244,13 @@ class Attention(nn.Module):
                 causal=True,
             )
         return o
+
+    def _forward_torch(self, q: torch.Tensor, k: torch.Tensor, v: torch.Tensor, context: ForwardContext):
+        """Same block-table KV storage and paged attention in plain PyTorch, used when the model runs on CPU."""
+        k_cache, v_cache = self.k_cache, self.v_cache
+        if k_cache.numel() and v_cache.numel() and context.slot_mapping is not None:
+            store_kvcache_torch(k, v, k_cache, v_cache, context.slot_mapping)
+
+        if context.is_prefill:
+            return paged_attention_prefill_torch(q, k, v, k_cache, v_cache, context, self.scale)
+        return paged_attention_decode_torch(q, k_cache, v_cache, context, self.scale)
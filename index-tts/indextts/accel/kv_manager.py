@@ -1,6 +1,6 @@
 import hashlib
 import pickle
-from collections import deque
+from collections import OrderedDict, deque
 from copy import copy
 from typing import Dict, List, Optional, Set
 
@@ -77,6 +77,8 @@ class KVCacheManager:
         block_size: int,
         num_blocks: int,
         dtype: torch.dtype,
+        max_prefixes: int = 16,
+        device: Optional[torch.device] = None,
     ):
         self.num_layers = num_layers
         self.num_heads = num_heads
@@ -89,9 +91,19 @@ class KVCacheManager:
         self.block_hash_to_id: Dict[bytes, int] = {}
         self.free_block_ids: deque = deque(range(num_blocks))
         self.used_block_ids: Set[int] = set()
-
-        device = "cuda" if torch.cuda.is_available() else "cpu"
-        cache_dtype = torch.float16 if device == "cuda" else dtype
+        # Conditioning prefix KV keyed by the hash of the prefix embeddings, [2, num_layers, P, num_heads, head_dim]
+        # each. A prefix is shorter than a block and shares its last block with the text, so it is copied into
+        # the slots of a new sequence instead of sharing blocks.
+        self.max_prefixes = max_prefixes
+        self.prefix_kv: "OrderedDict[str, torch.Tensor]" = OrderedDict()
+        self.prefix_hits = 0
+        self.prefix_misses = 0
+
+        if device is None:
+            device = "cuda" if torch.cuda.is_available() else "cpu"
+        device = torch.device(device)
+        # FlashAttention 需要 fp16 的缓存；CPU 上保持模型精度
+        cache_dtype = torch.float16 if device.type == "cuda" else dtype
         self.kv_cache = torch.empty(
             2,
             num_layers,
@@ -127,11 +139,15 @@ class KVCacheManager:
         self.used_block_ids.remove(block_id)
         self.free_block_ids.append(block_id)
 
-    def allocate(self, sequence: Seq):
+    def allocate(self, sequence: Seq, reuse_blocks: bool = True):
+        """
+        Allocate the blocks of a new sequence. With reuse_blocks, full blocks whose token hash is cached are
+        shared; without it (placeholder token ids, e.g. the TTS prompt) every block is fresh.
+        """
         assert not sequence.block_table, "Sequence already has allocated blocks"
 
         parent_hash = None
-        cache_miss = False
+        cache_miss = not reuse_blocks
 
         for i in range(sequence.num_blocks):
             token_ids = sequence.get_block_tokens(i)
@@ -159,7 +175,8 @@ class KVCacheManager:
 
             if block_hash is not None:
                 block.update(block_hash, token_ids)
-                self.block_hash_to_id[block_hash] = block_id
+                if reuse_blocks:
+                    self.block_hash_to_id[block_hash] = block_id
                 parent_hash = block_hash
 
             sequence.block_table.append(block_id)
@@ -200,6 +217,39 @@ class KVCacheManager:
     def remove_seq(self, sequence: Seq):
         self.deallocate(sequence)
 
+    def _slots(self, sequence: Seq, start: int, end: int) -> torch.Tensor:
+        slots = [
+            sequence.block_table[i // self.block_size] * self.block_size + i % self.block_size
+            for i in range(start, end)
+        ]
+        return torch.tensor(slots, dtype=torch.long, device=self.kv_cache.device)
+
+    def _flat_kv_cache(self) -> torch.Tensor:
+        # [2, num_layers, num_blocks * block_size, num_heads, head_dim] view of the cache
+        return self.kv_cache.view(2, self.num_layers, -1, self.num_heads, self.head_dim)
+
+    def load_prefix(self, prefix_hash: str, sequence: Seq, prefix_len: int) -> bool:
+        """
+        Copy a cached prefix KV into the first prefix_len slots of a freshly allocated sequence.
+        On a hit the sequence's num_cached_tokens is set to prefix_len, so prefill only runs the rest.
+        """
+        kv = self.prefix_kv.get(prefix_hash)
+        if kv is None or kv.shape[2] != prefix_len or sequence.num_cached_tokens:
+            self.prefix_misses += 1
+            return False
+        self.prefix_kv.move_to_end(prefix_hash)
+        self._flat_kv_cache()[:, :, self._slots(sequence, 0, prefix_len)] = kv
+        sequence.num_cached_tokens = prefix_len
+        self.prefix_hits += 1
+        return True
+
+    def save_prefix(self, prefix_hash: str, sequence: Seq, prefix_len: int):
+        """Keep a copy of the first prefix_len slots of a prefilled sequence, evicting the least recently used."""
+        self.prefix_kv[prefix_hash] = self._flat_kv_cache()[:, :, self._slots(sequence, 0, prefix_len)].clone()
+        self.prefix_kv.move_to_end(prefix_hash)
+        while len(self.prefix_kv) > self.max_prefixes:
+            self.prefix_kv.popitem(last=False)
+
     def wire_kv_cache_to_model(self, model):
         layer_id = 0
         for module in model.modules():
@@ -0,0 +1,383 @@
+import asyncio
+import threading
+from collections import deque
+from concurrent.futures import Future
+from typing import List, Optional
+
+import torch
+
+from .accel_engine import AccelInferenceEngine, Sampler
+from .attention import reset_forward_context
+from .kv_manager import Seq
+
+
+class TTSRequest:
+    """A queued TTS segment: its prompt embeddings, sampling settings and the tokens generated so far."""
+
+    def __init__(
+        self,
+        embeddings: torch.Tensor,
+        start_token: int,
+        max_new_tokens: int,
+        temperature: float,
+        stop_tokens: Optional[List[int]],
+        prefix_len: int = 0,
+        prefix_hash: Optional[str] = None,
+        generator: Optional[torch.Generator] = None,
+        return_hidden_states: bool = False,
+        top_k: int = 0,
+        top_p: float = 1.0,
+        repetition_penalty: float = 1.0,
+    ):
+        self.embeddings = embeddings  # [T, hidden]: [cond][text], without start_mel
+        self.start_token = start_token
+        self.max_new_tokens = max_new_tokens
+        self.temperature = temperature
+        self.stop_tokens = set(stop_tokens or [])
+        self.prefix_len = prefix_len
+        self.prefix_hash = prefix_hash
+        self.generator = generator
+        self.return_hidden_states = return_hidden_states
+        self.top_k = top_k
+        self.top_p = top_p
+        self.repetition_penalty = repetition_penalty
+        self.seen: Optional[torch.Tensor] = None  # [vocab] tokens the repetition penalty applies to
+        self.generated: List[int] = []
+        self.hiddens: List[torch.Tensor] = []
+        self.seq: Optional[Seq] = None
+        self.num_preemptions = 0
+        self.future: Future = Future()
+
+    @property
+    def prompt_len(self) -> int:
+        # [cond][text][start_mel]
+        return self.embeddings.shape[0] + 1
+
+    def result(self):
+        codes = torch.tensor(self.generated, dtype=torch.long)
+        if self.return_hidden_states:
+            return codes, torch.stack(self.hiddens, dim=0)
+        return codes
+
+
+class ContinuousBatchScheduler:
+    """
+    Continuous batching of TTS segments on one AccelInferenceEngine.
+
+    Segments are submitted from any thread (`submit_nowait`, or `submit` from asyncio) and decoded by one
+    background thread. Every iteration admits waiting segments into the running batch as long as the
+    KV manager has blocks for them (their prompts are prefilled together in one varlen pass), runs one
+    batched decode step for all running segments and retires each segment at its own stop token or token
+    budget, so a short segment never holds the batch and a new one never waits for the batch to drain.
+
+    When a running segment needs a new KV block and none is free, the most recently admitted segments are
+    preempted: their blocks are released and they go back to the front of the queue, keeping the tokens
+    generated so far, which are recomputed by the prefill when they are re-admitted.
+
+    The scheduler owns the engine's KV cache while it runs: do not call `engine.generate` concurrently.
+    """
+
+    def __init__(
+        self,
+        engine: AccelInferenceEngine,
+        mel_embedding: torch.nn.Module,
+        text_pos_embedding: torch.nn.Module,
+        max_batch_size: int = 8,
+    ):
+        self.engine = engine
+        self.kv_manager = engine.kv_manager
+        self.block_size = engine.block_size
+        self.mel_embedding = mel_embedding
+        self.text_pos_embedding = text_pos_embedding
+        self.max_batch_size = max_batch_size
+        self.model_dtype = next(engine.model.parameters()).dtype
+        self.device = engine.device
+
+        self.waiting: deque = deque()
+        self.running: List[TTSRequest] = []
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self._stopped = False
+
+        self.num_steps = 0
+        self.num_prefills = 0
+        self.num_finished = 0
+        self.num_preemptions = 0
+        self.num_generated_tokens = 0
+        self._batch_size_sum = 0
+
+    def start(self):
+        with self._cond:
+            if self._thread is not None:
+                return
+            self._stopped = False
+            self._thread = threading.Thread(target=self._loop, name="accel-scheduler", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """Stop the decode thread, failing the segments that did not finish."""
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        pending = list(self.waiting) + self.running
+        self.waiting.clear()
+        self._release(self.running)
+        self.running = []
+        for request in pending:
+            if not request.future.done():
+                request.future.set_exception(RuntimeError("scheduler stopped"))
+
+    def submit_nowait(
+        self,
+        embeddings: torch.Tensor,
+        start_token: int,
+        max_new_tokens: int = 100,
+        temperature: float = 1.0,
+        stop_tokens: Optional[List[int]] = None,
+        prefix_len: int = 0,
+        prefix_hash: Optional[str] = None,
+        generator: Optional[torch.Generator] = None,
+        return_hidden_states: bool = False,
+        top_k: int = 0,
+        top_p: float = 1.0,
+        repetition_penalty: float = 1.0,
+    ) -> Future:
+        """
+        Queue one segment.
+        Args:
+            embeddings: [T, hidden] or [1, T, hidden] prompt embeddings without padding and without start_mel
+            start_token: start_mel token, its embedding at position 0 closes the prompt
+            max_new_tokens: token budget of the segment
+            temperature: sampling temperature, 0 for greedy decoding
+            stop_tokens: token ids that end the segment (not included in the output)
+            prefix_len / prefix_hash: the conditioning prefix of the embeddings and its hash, see `KVCacheManager.load_prefix`
+            generator: random generator of the segment, each segment draws its own noise so sampling does not
+                depend on which segments share a batch
+            return_hidden_states: also return the last hidden state of every decoding step
+            top_k / top_p / repetition_penalty: applied like `AccelInferenceEngine.generate` (and HF generate),
+                the penalty also counts the placeholder prompt ids (1 and start_token)
+        Returns:
+            a Future of codes [num_tokens] (and hidden states [num_steps, hidden] with return_hidden_states)
+        """
+        if embeddings.ndim == 3:
+            embeddings = embeddings.squeeze(0)
+        request = TTSRequest(
+            embeddings.detach(), start_token, max_new_tokens, temperature, stop_tokens,
+            prefix_len, prefix_hash, generator, return_hidden_states, top_k, top_p, repetition_penalty,
+        )
+        if self._blocks_needed(request.prompt_len + max_new_tokens) > self.kv_manager.num_blocks:
+            request.future.set_exception(ValueError(
+                f"segment of {request.prompt_len} + {max_new_tokens} tokens exceeds the KV cache "
+                f"({self.kv_manager.num_blocks} blocks of {self.block_size})"
+            ))
+            return request.future
+        with self._cond:
+            if self._stopped:
+                raise RuntimeError("scheduler stopped")
+            self.waiting.append(request)
+            self._cond.notify()
+        self.start()
+        return request.future
+
+    async def submit(self, embeddings: torch.Tensor, start_token: int, **kwargs):
+        """`submit_nowait` for asyncio callers, awaits the result."""
+        return await asyncio.wrap_future(self.submit_nowait(embeddings, start_token, **kwargs))
+
+    def generate(self, embeddings: torch.Tensor, start_token: int, **kwargs):
+        """Blocking `submit_nowait`."""
+        return self.submit_nowait(embeddings, start_token, **kwargs).result()
+
+    def stats(self):
+        return {
+            "steps": self.num_steps,
+            "prefills": self.num_prefills,
+            "finished": self.num_finished,
+            "preemptions": self.num_preemptions,
+            "generated_tokens": self.num_generated_tokens,
+            "mean_batch_size": self._batch_size_sum / self.num_steps if self.num_steps else 0.0,
+            "waiting": len(self.waiting),
+            "running": len(self.running),
+        }
+
+    def _blocks_needed(self, num_tokens: int) -> int:
+        return (num_tokens + self.block_size - 1) // self.block_size
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                while not self._stopped and not self.waiting and not self.running:
+                    self._cond.wait()
+                if self._stopped:
+                    return
+            try:
+                with torch.inference_mode():
+                    self.step()
+            except Exception as e:
+                print(f">> scheduler step failed: {e!r}")
+                reset_forward_context()
+                failed, self.running = self.running, []
+                self._release(failed)
+                for request in failed:
+                    if not request.future.done():
+                        request.future.set_exception(e)
+
+    def step(self):
+        """One iteration: admit and prefill waiting segments, then one decode step over the running batch."""
+        admitted = self._admit()
+        if admitted:
+            self._prefill(admitted)
+        if self.running:
+            self._decode()
+
+    def _admit(self) -> List[TTSRequest]:
+        admitted = []
+        free_blocks = len(self.kv_manager.free_block_ids)
+        with self._cond:
+            while self.waiting and len(self.running) + len(admitted) < self.max_batch_size:
+                request = self.waiting[0]
+                # prompt + generated tokens, and room for the token sampled by the prefill
+                needed = self._blocks_needed(request.prompt_len + len(request.generated) + 1)
+                if needed > free_blocks:
+                    break
+                free_blocks -= needed
+                admitted.append(self.waiting.popleft())
+        return admitted
+
+    def _prompt_embeddings(self, request: TTSRequest) -> torch.Tensor:
+        """[cond][text][start_mel][generated] embeddings, the generated part only after a preemption."""
+        tokens = torch.tensor([request.start_token] + request.generated, dtype=torch.long, device=self.device)
+        positions = torch.arange(tokens.shape[0], device=self.device)
+        mel_emb = self.mel_embedding(tokens) + self.text_pos_embedding.emb(positions)
+        return torch.cat([request.embeddings.to(mel_emb.dtype), mel_emb], dim=0).to(self.model_dtype)
+
+    def _prefill(self, requests: List[TTSRequest]):
+        self.running.extend(requests)
+        chunks = []
+        for request in requests:
+            num_tokens = request.prompt_len + len(request.generated)
+            request.seq = Seq([1] * num_tokens, block_size=self.block_size)
+            self.kv_manager.allocate(request.seq, reuse_blocks=False)
+            if request.prefix_hash is not None and request.prefix_len > 0:
+                self.kv_manager.load_prefix(request.prefix_hash, request.seq, request.prefix_len)
+            chunks.append(self._prompt_embeddings(request)[request.seq.num_cached_tokens:])
+
+        self.engine._prepare_prefill([request.seq for request in requests])
+        hidden_states = self.engine.model(
+            inputs_embeds=torch.cat(chunks, dim=0).unsqueeze(0), return_dict=True
+        ).last_hidden_state[0]
+        reset_forward_context()
+        self.num_prefills += 1
+
+        for request in requests:
+            if request.prefix_hash is not None and request.prefix_len > 0 and request.seq.num_cached_tokens == 0:
+                self.kv_manager.save_prefix(request.prefix_hash, request.seq, request.prefix_len)
+        last = torch.tensor([len(chunk) for chunk in chunks], device=self.device).cumsum(0) - 1
+        self._advance(requests, hidden_states[last])
+
+    def _decode(self):
+        requests = list(self.running)
+        tokens = torch.tensor([request.generated[-1] for request in requests], dtype=torch.long, device=self.device)
+        positions = torch.tensor([len(request.generated) for request in requests], device=self.device)
+        inputs_embeds = self.mel_embedding(tokens) + self.text_pos_embedding.emb(positions)
+
+        self.engine._prepare_decode([request.seq for request in requests])
+        hidden_states = self.engine.model(
+            inputs_embeds=inputs_embeds.to(self.model_dtype).unsqueeze(1), return_dict=True
+        ).last_hidden_state[:, -1]
+        reset_forward_context()
+        self.num_steps += 1
+        self._batch_size_sum += len(requests)
+        self._advance(requests, hidden_states)
+
+    def _seen(self, request: TTSRequest, vocab_size: int) -> torch.Tensor:
+        if request.seen is None:
+            # 与 AccelInferenceEngine.generate 一致，重复惩罚也计入占位的 prompt ids（1 与 start_mel）
+            request.seen = torch.zeros(vocab_size, dtype=torch.bool, device=self.device)
+            request.seen[[1, request.start_token] + request.generated] = True
+        return request.seen
+
+    def _sample(self, requests: List[TTSRequest], hidden_states: torch.Tensor) -> List[int]:
+        lm_head = self.engine.lm_head
+        if hidden_states.dtype != next(lm_head.parameters()).dtype:
+            hidden_states = hidden_states.to(next(lm_head.parameters()).dtype)
+        logits = lm_head(hidden_states)
+        tokens = logits.argmax(dim=-1)
+        # 同一组采样参数的请求一起经过 FusedSampler，每个请求仍使用自己的 noise 与 seen
+        groups = {}
+        for i, request in enumerate(requests):
+            if request.temperature > 0 or request.repetition_penalty != 1.0:
+                key = (request.temperature > 0, request.top_k, request.top_p, request.repetition_penalty)
+                groups.setdefault(key, []).append(i)
+        for (do_sample, top_k, top_p, repetition_penalty), rows in groups.items():
+            group = [requests[i] for i in rows]
+            rows_logits = logits[rows]
+            seen = None
+            if repetition_penalty != 1.0:
+                seen = torch.stack([self._seen(request, logits.shape[-1]) for request in group])
+            if do_sample:
+                noise = torch.cat([Sampler.noise(rows_logits[j:j + 1], request.generator) for j, request in enumerate(group)])
+                temperatures = torch.tensor([request.temperature for request in group], dtype=torch.float32, device=self.device)
+                tokens[rows] = self.engine.sampler(rows_logits, temperatures, noise, seen=seen, top_k=top_k,
+                                                   top_p=top_p, repetition_penalty=repetition_penalty)
+            else:
+                tokens[rows] = self.engine.sampler.fused(rows_logits, seen, do_sample=False,
+                                                         repetition_penalty=repetition_penalty)
+        tokens = tokens.tolist()
+        for request, token in zip(requests, tokens):
+            if request.seen is not None:
+                request.seen[token] = True
+        return tokens
+
+    def _advance(self, requests: List[TTSRequest], hidden_states: torch.Tensor):
+        """Sample the next token of every request, retire the finished ones and append the others."""
+        tokens = self._sample(requests, hidden_states)
+        continuing = []
+        for request, token, hidden in zip(requests, tokens, hidden_states):
+            if request.return_hidden_states:
+                request.hiddens.append(hidden.clone())
+            if token in request.stop_tokens:
+                self._finish(request)
+                continue
+            request.generated.append(token)
+            self.num_generated_tokens += 1
+            if len(request.generated) >= request.max_new_tokens:
+                self._finish(request)
+                continue
+            continuing.append(request)
+
+        # the new token opens a block when the sequence fills its last one
+        needed = sum(1 for request in continuing if len(request.seq) % self.block_size == 0)
+        while needed > len(self.kv_manager.free_block_ids):
+            victim = self.running[-1]
+            if victim in continuing:
+                continuing.remove(victim)
+                if len(victim.seq) % self.block_size == 0:
+                    needed -= 1
+            self._preempt(victim)
+        for request in continuing:
+            request.seq.append_token(request.generated[-1])
+            self.kv_manager.append_to_seq(request.seq)
+
+    def _finish(self, request: TTSRequest):
+        self.running.remove(request)
+        self._release([request])
+        self.num_finished += 1
+        request.future.set_result(request.result())
+
+    def _preempt(self, request: TTSRequest):
+        # 释放 KV，保留已生成的 token，重新调度时由 prefill 重新计算
+        self.running.remove(request)
+        self._release([request])
+        request.num_preemptions += 1
+        self.num_preemptions += 1
+        with self._cond:
+            self.waiting.appendleft(request)
+
+    def _release(self, requests: List[TTSRequest]):
+        for request in requests:
+            if request.seq is not None:
+                self.kv_manager.remove_seq(request.seq)
+                request.seq = None
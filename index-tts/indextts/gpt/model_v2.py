@@ -1,4 +1,5 @@
 import functools
+import hashlib
 
 import torch
 import torch.nn as nn
@@ -6,6 +7,7 @@ import torch.nn.functional as F
 
 import transformers
 from transformers import GPT2Config, LogitsProcessorList
+from transformers.cache_utils import Cache, DynamicCache
 from indextts.gpt.transformers_gpt2 import GPT2PreTrainedModel, GPT2Model
 
 # from transformers import GPT2Config, GPT2PreTrainedModel, LogitsProcessorList
@@ -15,7 +17,10 @@ from transformers.utils.model_parallel_utils import (assert_device_map,
 
 from indextts.gpt.conformer_encoder import ConformerEncoder
 from indextts.gpt.perceiver import PerceiverResampler
+from indextts.gpt.static_decode import STATIC_DECODE_KWARGS, StaticCacheDecoder
 from indextts.utils.arch_util import AttentionBlock
+from indextts.utils.cond_cache import ConditioningCache
+from indextts.utils.fused_sampling import FusedLogitsProcessor
 from indextts.utils.typical_sampling import TypicalLogitsWarper
 
 
@@ -57,6 +62,7 @@ class GPT2InferenceModel(GPT2PreTrainedModel):
         self.model_parallel = False
         self.device_map = None
         self.cached_mel_emb = None
+        self.cached_prefix_past = None
 
     def parallelize(self, device_map=None):
         self.device_map = (
@@ -87,6 +93,13 @@ class GPT2InferenceModel(GPT2PreTrainedModel):
     def store_mel_emb(self, mel_emb):
         self.cached_mel_emb = mel_emb
 
+    def store_prefix_past(self, prefix_past):
+        """
+        Per-layer (key, value) of the conditioning prefix, (b, heads, P, head_dim) each, or None.
+        The first forward then only runs the positions after the prefix.
+        """
+        self.cached_prefix_past = prefix_past
+
     def prepare_inputs_for_generation(self, input_ids, past_key_values=None, **kwargs):
         token_type_ids = kwargs.get("token_type_ids", None)  # usually None
         if not self.kv_cache:
@@ -153,10 +166,31 @@ class GPT2InferenceModel(GPT2PreTrainedModel):
             else:  # this outcome only occurs once per loop in most cases
                 mel_emb = self.cached_mel_emb
             emb = torch.cat([mel_emb, text_emb], dim=1)
+            if self.cached_prefix_past is not None and (
+                    past_key_values is None
+                    or (isinstance(past_key_values, Cache) and past_key_values.get_seq_length() == 0)):
+                # 条件前缀的 KV 已缓存：只计算前缀之后的位置（beam / num_return_sequences 展开与 mel_emb 一致）；
+                # generate 可能传入空的 Cache 而不是 None，此时以同样的 Cache 类型传入前缀
+                prefix_len = self.cached_prefix_past[0][0].shape[-2]
+                prefix_past = tuple(
+                    tuple(
+                        state if state.shape[0] == emb.shape[0]
+                        else state.repeat_interleave(emb.shape[0] // state.shape[0], 0)
+                        for state in layer_past
+                    )
+                    for layer_past in self.cached_prefix_past
+                )
+                past_key_values = prefix_past if past_key_values is None else DynamicCache.from_legacy_cache(prefix_past)
+                emb = emb[:, prefix_len:]
+                if position_ids is not None:
+                    position_ids = position_ids[:, prefix_len:]
+                if token_type_ids is not None:
+                    token_type_ids = token_type_ids[:, prefix_len:]
         else:
             emb = self.embeddings(input_ids)
+            # attention_mask 已包含 start_mel_token 与当前 token，位置与训练时的 forward（及 accel 引擎）一致
             emb = emb + self.text_pos_embedding.get_fixed_embedding(
-                attention_mask.shape[1] - mel_len, attention_mask.device
+                attention_mask.shape[1] - mel_len - 1, attention_mask.device
             )
         transformer_outputs = self.transformer(
             inputs_embeds=emb,
@@ -411,8 +445,12 @@ class UnifiedVoice(nn.Module):
 
         self.use_accel = use_accel
         self.accel_engine = None  # Will be initialized in post_init_gpt2_config
+        self.accel_scheduler = None  # Will be initialized in post_init_gpt2_config
+        self.prefix_kv_cache = None  # Will be initialized in post_init_gpt2_config
+        self.static_decoder = None  # Will be initialized in post_init_gpt2_config
 
-    def post_init_gpt2_config(self, use_deepspeed=False, kv_cache=False, half=False):
+    def post_init_gpt2_config(self, use_deepspeed=False, kv_cache=False, half=False, prefix_cache_mb=256,
+                              accel_max_batch_size=1, static_decode=True):
         seq_length = self.max_mel_tokens + self.max_text_tokens + 2
         gpt_config = GPT2Config(
             vocab_size=self.number_mel_codes,
@@ -425,12 +463,15 @@ class UnifiedVoice(nn.Module):
             use_cache=True,
         )
 
-        if self.use_accel and torch.cuda.is_available():
-            # Check if flash attention is available
-            try:
-                import flash_attn
-            except ImportError:
-                raise ImportError("flash_attn is required for acceleration but not installed. Please install from https://github.com/Dao-AILab/flash-attention/releases/")
+        if self.use_accel:
+            device = next(self.gpt.parameters()).device
+            if device.type == "cuda":
+                # Check if flash attention is available
+                try:
+                    import flash_attn
+                except ImportError:
+                    raise ImportError("flash_attn is required for acceleration but not installed. Please install from https://github.com/Dao-AILab/flash-attention/releases/")
+            # 没有 GPU 时 accel 引擎使用纯 PyTorch 的分页 KV 存储与注意力
 
             from indextts.accel import GPT2AccelModel, AccelInferenceEngine
 
@@ -438,10 +479,9 @@ class UnifiedVoice(nn.Module):
             accel_gpt = GPT2AccelModel(gpt_config)
             accel_gpt.load_state_dict(self.gpt.state_dict(), strict=False)
 
-            if half:
-                accel_gpt = accel_gpt.half().cuda()
-            else:
-                accel_gpt = accel_gpt.cuda()
+            if half and device.type == "cuda":
+                accel_gpt = accel_gpt.half()
+            accel_gpt = accel_gpt.to(device)
             accel_gpt.eval()
 
             lm_head_with_norm = nn.Sequential(self.final_norm, self.mel_head)
@@ -482,6 +522,29 @@ class UnifiedVoice(nn.Module):
         else:
             self.inference_model = self.inference_model.eval()
 
+        if self.accel_engine is not None and accel_max_batch_size > 1:
+            from indextts.accel import ContinuousBatchScheduler
+
+            # 连续批处理：并发请求与批量文本的各个段共享 decode 步，各自在 stop token 处退出
+            self.accel_scheduler = ContinuousBatchScheduler(
+                self.accel_engine, self.mel_embedding, self.mel_pos_embedding, max_batch_size=accel_max_batch_size
+            )
+            self.accel_scheduler.start()
+            print(f"continuous batching scheduler started (max batch size {accel_max_batch_size})")
+
+        # 条件前缀（说话人 + 情感 + 时长嵌入）的 KV 缓存，按前缀嵌入内容的哈希索引；
+        # deepspeed 注入的 kernel 自行管理 KV，不支持外部传入的 past
+        self.prefix_kv_cache = None
+        if prefix_cache_mb and not (use_deepspeed and torch.cuda.is_available()):
+            self.prefix_kv_cache = ConditioningCache(max_bytes=prefix_cache_mb * 1024 * 1024)
+
+        # 非 beam search 的 HF 路径改用预分配 KV 的解码循环；deepspeed 注入的 kernel 不走 self.gpt 的 block
+        self.static_decoder = None
+        if static_decode and kv_cache and not (use_deepspeed and torch.cuda.is_available()):
+            self.static_decoder = StaticCacheDecoder(
+                self.gpt, self.mel_embedding, self.mel_pos_embedding, self.final_norm, self.mel_head
+            )
+
         # self.inference_model = PrunedGPT2InferenceModel(gpt_config, self.gpt, self.mel_pos_embedding, self.mel_embedding, self.final_norm, self.mel_head)
         self.gpt.wte = self.mel_embedding
 
@@ -643,6 +706,8 @@ class UnifiedVoice(nn.Module):
             text_inputs: (b, L)
         Returns:
             input_ids: (b, s+1) the input ids for the GPT2InferenceModel.generate()
+            The rows are laid out as [cond][pad][text]: the conditioning prefix sits at the same positions in
+            every row, so its KV can be computed once and shared (the GPT has no learned position embedding).
             inputs_embeds: (b, s+1, dim) the input embeddings for the GPT2InferenceModel.forward()
             attention_mask: (b, s+1) the attention mask for the GPT2InferenceModel.generate()
         """
@@ -670,11 +735,12 @@ class UnifiedVoice(nn.Module):
             attention_mask = torch.ones(target_len+1, dtype=torch.long, device=device)
             # check this text input is padded
             padding: int = L + 2 - text_input.size(-1)
-            # pad left of [cond][text] -> [pad][cond][text]
+            # pad between [cond][text] -> [cond][pad][text]
             if padding > 0:
                 pad = torch.zeros((padding, conditional_latents.size(-1)), dtype=text_emb.dtype, device=device) # [p, dim]
-                conds_text_emb.insert(0, pad)
-                attention_mask[:padding] = 0
+                conds_text_emb.insert(1, pad)
+                cond_len = conds_text_emb[0].shape[0]
+                attention_mask[cond_len:cond_len + padding] = 0
             mel_emb = torch.cat(conds_text_emb) #[s, dim]
             assert mel_emb.shape[0] == target_len, f"mel_emb.shape: {mel_emb.shape}, target_len: {target_len}"
             batched_mel_emb.append(mel_emb)
@@ -696,7 +762,7 @@ class UnifiedVoice(nn.Module):
         return fake_inputs, batched_mel_emb, attention_mask
 
     def inference_speech(self, speech_condition, text_inputs, emo_speech_condition=None, cond_lengths=None, emo_cond_lengths=None, emo_vec=None, use_speed=False, input_tokens=None, num_return_sequences=1,
-                         max_generate_length=None, typical_sampling=False, typical_mass=.9, **hf_generate_kwargs):
+                         max_generate_length=None, typical_sampling=False, typical_mass=.9, return_latent=False, **hf_generate_kwargs):
         """
         Args:
             speech_condition: (b, d, frames) or (d, frames)
@@ -704,7 +770,12 @@ class UnifiedVoice(nn.Module):
             cond_mel_lengths: lengths of the conditioning mel spectrograms in shape (b,) or (1,)
             input_tokens: additional tokens for generation in shape (b, s) or (s,)
             max_generate_length: limit the number of generated tokens
-            hf_generate_kwargs: kwargs for `GPT2InferenceModel.generate(**hf_generate_kwargs)`
+            return_latent: also return the final-layer hidden states that produced the generated codes,
+                the same latent as `forward(...)` over the generated codes, without a second GPT pass.
+            hf_generate_kwargs: kwargs for `GPT2InferenceModel.generate(**hf_generate_kwargs)`,
+                `generators` (one torch.Generator per text row) makes sampling reproducible
+        Returns:
+            codes, speech_conditioning_latent (, latent: (b, codes_len, dim) if return_latent)
         """
 
         if speech_condition.ndim == 2:
@@ -731,6 +802,14 @@ class UnifiedVoice(nn.Module):
         conds_latent = torch.cat((speech_conditioning_latent + emo_vec.unsqueeze(1), duration_emb_half.unsqueeze(1), duration_emb.unsqueeze(1)), 1)
         input_ids, inputs_embeds, attention_mask = self.prepare_gpt_inputs(conds_latent, text_inputs)
         self.inference_model.store_mel_emb(inputs_embeds)
+        use_scheduler = self.accel_scheduler is not None and input_tokens is None
+        use_accel = use_scheduler or (
+            self.accel_engine is not None and num_return_sequences == 1 and text_inputs.size(0) == 1
+        )
+        prefix_keys = [self.prefix_digest(c) for c in conds_latent] if self.prefix_kv_cache is not None else None
+        self.inference_model.store_prefix_past(
+            self._prefix_past(conds_latent, prefix_keys) if prefix_keys and not use_accel else None
+        )
         if input_tokens is None:
             inputs = input_ids
         else:
@@ -756,19 +835,65 @@ class UnifiedVoice(nn.Module):
             min_tokens_to_keep = 2 if hf_generate_kwargs.get("num_beams", 1) > 1 else 1
             logits_processor.append(TypicalLogitsWarper(mass=typical_mass, min_tokens_to_keep=min_tokens_to_keep))
         max_length = (trunc_index + self.max_mel_tokens - 1) if max_generate_length is None else trunc_index + max_generate_length
+        use_static = (
+            self.static_decoder is not None and not use_accel and input_tokens is None and not typical_sampling
+            and hf_generate_kwargs.get("num_beams", 1) == 1 and set(hf_generate_kwargs) <= STATIC_DECODE_KWARGS
+        )
+        if not (use_accel or use_static or typical_sampling) and hf_generate_kwargs.get("do_sample", False):
+            # HF generate（beam search）：惩罚、温度、top-k、top-p 合并为一个处理器，替代逐个执行的 processor / warper
+            logits_processor.append(self._fused_logits_processor(hf_generate_kwargs))
         
+        if use_scheduler:
+            return self._generate_with_scheduler(
+                inputs_embeds, attention_mask, conds_latent.shape[1], prefix_keys, num_return_sequences,
+                max_length - trunc_index, hf_generate_kwargs, return_latent, speech_conditioning_latent,
+            )
         # Use accel engine if available (single sequence only)
-        if self.accel_engine is not None and num_return_sequences == 1:
+        # 批量文本不走 accel：accel 引擎在任一序列遇到 stop token 时会停止整个 batch
+        if use_accel:
             output = self.accel_engine.generate(
                 inputs,  # fake input_ids (all 1s + start_mel_token)
                 max_new_tokens=max_length - trunc_index,
                 attention_mask=attention_mask,
                 temperature=hf_generate_kwargs.get('temperature', 1),
+                top_k=hf_generate_kwargs.get('top_k', 50),
+                top_p=hf_generate_kwargs.get('top_p', 1.0),
+                repetition_penalty=hf_generate_kwargs.get('repetition_penalty', 1.0),
                 stop_tokens=[self.stop_mel_token],
-                tts_embeddings=inputs_embeds,  # [pad][cond][text] embeddings (87 tokens, NO start_mel_token)
+                tts_embeddings=inputs_embeds,  # [cond][pad][text] embeddings (87 tokens, NO start_mel_token)
+                tts_prefix_len=conds_latent.shape[1] if prefix_keys else 0,
+                tts_prefix_hash=prefix_keys[0] if prefix_keys else None,
                 tts_mel_embedding=self.inference_model.embeddings,  # mel_embedding layer
                 tts_text_pos_embedding=self.inference_model.text_pos_embedding,  # text_pos_embedding layer
+                return_hidden_states=return_latent,
+                generator=hf_generate_kwargs["generators"][0] if hf_generate_kwargs.get("generators") else None,
+            )
+            if return_latent:
+                output, step_hiddens = output
+                codes = output[:, trunc_index:]
+                return codes, speech_conditioning_latent, self.final_norm(step_hiddens[:, :codes.shape[1]])
+        elif use_static:
+            if num_return_sequences > 1:
+                inputs_embeds = inputs_embeds.repeat_interleave(num_return_sequences, dim=0)
+                attention_mask = attention_mask.repeat_interleave(num_return_sequences, dim=0)
+            output = self.static_decoder.generate(
+                inputs_embeds, attention_mask,
+                max_new_tokens=max_length - trunc_index,
+                start_token=self.start_mel_token,
+                stop_token=self.stop_mel_token,
+                prompt_token_ids=(1, self.start_mel_token),  # HF 的重复惩罚也作用于占位 input_ids
+                prefix_past=self.inference_model.cached_prefix_past,
+                return_hidden_states=return_latent,
+                **hf_generate_kwargs,
             )
+            if return_latent:
+                codes, hidden = output
+                return codes, speech_conditioning_latent, self.final_norm(hidden)
+            return output, speech_conditioning_latent
+        elif return_latent:
+            return self._generate_with_latent(inputs, attention_mask, max_length, logits_processor,
+                                              num_return_sequences, trunc_index, speech_conditioning_latent,
+                                              **hf_generate_kwargs)
         else:
             output = self.inference_model.generate(inputs, 
                                                 bos_token_id=self.start_mel_token, pad_token_id=self.stop_mel_token,
@@ -782,6 +907,142 @@ class UnifiedVoice(nn.Module):
         output.sequences = output.sequences[:, trunc_index:]
         return output, speech_conditioning_latent
 
+    def _generate_with_scheduler(self, inputs_embeds, attention_mask, prefix_len, prefix_keys, num_return_sequences,
+                                 max_new_tokens, hf_generate_kwargs, return_latent, speech_conditioning_latent):
+        """
+        Submit every text row (num_return_sequences times) to the continuous batching scheduler as its own segment
+        and wait for all of them. The codes are right padded with stop_mel_token like the HF generate output.
+        """
+        generators = hf_generate_kwargs.get("generators")
+        futures = []
+        for i in range(inputs_embeds.shape[0]):
+            # [cond][pad][text] -> [cond][text]
+            embeddings = inputs_embeds[i][attention_mask[i, :-1].bool()]
+            for _ in range(num_return_sequences):
+                futures.append(self.accel_scheduler.submit_nowait(
+                    embeddings,
+                    start_token=self.start_mel_token,
+                    max_new_tokens=max_new_tokens,
+                    temperature=hf_generate_kwargs.get('temperature', 1),
+                    top_k=hf_generate_kwargs.get('top_k', 50),
+                    top_p=hf_generate_kwargs.get('top_p', 1.0),
+                    repetition_penalty=hf_generate_kwargs.get('repetition_penalty', 1.0),
+                    stop_tokens=[self.stop_mel_token],
+                    prefix_len=prefix_len if prefix_keys else 0,
+                    prefix_hash=prefix_keys[i] if prefix_keys else None,
+                    generator=generators[i] if generators else None,
+                    return_hidden_states=return_latent,
+                ))
+        results = [future.result() for future in futures]
+        codes = [result[0] if return_latent else result for result in results]
+        device = inputs_embeds.device
+        padded = torch.nn.utils.rnn.pad_sequence(
+            [c.to(device) for c in codes], batch_first=True, padding_value=self.stop_mel_token
+        )
+        if not return_latent:
+            return padded, speech_conditioning_latent
+        hiddens = torch.nn.utils.rnn.pad_sequence(
+            [hidden[:len(c)].to(device) for c, (_, hidden) in zip(codes, results)], batch_first=True
+        )
+        return padded, speech_conditioning_latent, self.final_norm(hiddens)
+
+    @staticmethod
+    def _fused_logits_processor(hf_generate_kwargs):
+        """
+        Move repetition_penalty / temperature / top_k / top_p of hf_generate_kwargs (HF defaults if missing)
+        into one `FusedLogitsProcessor`, and neutralize them so HF generate builds no processor of its own.
+        """
+        defaults = {"temperature": 1.0, "top_k": 50, "top_p": 1.0, "repetition_penalty": 1.0}
+        values = {
+            name: default if hf_generate_kwargs.get(name) is None else hf_generate_kwargs[name]
+            for name, default in defaults.items()
+        }
+        hf_generate_kwargs.update(temperature=1.0, top_k=0, top_p=1.0, repetition_penalty=1.0)
+        # HF 的 beam search 至少保留 2 个 token（eos 之外还有可扩展的候选）
+        min_tokens_to_keep = 2 if hf_generate_kwargs.get("num_beams", 1) > 1 else 1
+        return FusedLogitsProcessor(min_tokens_to_keep=min_tokens_to_keep, **values)
+
+    @staticmethod
+    def prefix_digest(cond_latent):
+        """sha256 of a (P, dim) conditioning prefix: shape, dtype and raw bytes."""
+        data = cond_latent.detach().contiguous().cpu()
+        sha = hashlib.sha256(f"{tuple(data.shape)}|{data.dtype}".encode())
+        sha.update(data.view(torch.uint8).numpy().tobytes())
+        return sha.hexdigest()
+
+    def _prefix_past(self, conds_latent, prefix_keys):
+        """
+        KV of the conditioning prefix of every row, from `prefix_kv_cache` or one GPT pass over the missing prefixes.
+        Args:
+            conds_latent: (b, P, dim) [speaker + emotion][duration embeddings] prefix
+            prefix_keys: `prefix_digest` of every row
+        Returns:
+            per-layer (key, value) tuples, (b, heads, P, head_dim) each
+        """
+        pasts = {}
+        missing = []
+        for i, key in enumerate(prefix_keys):
+            if key in pasts:
+                continue
+            pasts[key] = self.prefix_kv_cache.get(("gpt_prefix", key))
+            if pasts[key] is None:
+                missing.append(i)
+        if missing:
+            # 各行独立计算（因果注意力，前缀之间互不影响）
+            outputs = self.gpt(inputs_embeds=conds_latent[missing], use_cache=True, return_dict=True)
+            for j, i in enumerate(missing):
+                past = tuple(
+                    tuple(state[j:j + 1].clone() for state in layer_past)
+                    for layer_past in outputs.past_key_values
+                )
+                pasts[prefix_keys[i]] = self.prefix_kv_cache.put(("gpt_prefix", prefix_keys[i]), past)
+            print(">> prefix kv cache miss:", self.prefix_kv_cache.stats())
+        rows = [pasts[key] for key in prefix_keys]
+        if len(set(prefix_keys)) == 1:
+            return tuple(tuple(state.expand(len(rows), -1, -1, -1) for state in layer_past) for layer_past in rows[0])
+        return tuple(
+            tuple(torch.cat([row[layer][k] for row in rows], dim=0) for k in range(2))
+            for layer in range(len(rows[0]))
+        )
+
+    def _generate_with_latent(self, inputs, attention_mask, max_length, logits_processor, num_return_sequences,
+                              trunc_index, speech_conditioning_latent, **hf_generate_kwargs):
+        """
+        HF generate that records the last hidden state of every decoding step.
+        The hidden state of step k is the one that predicted code k, i.e. the latent `forward(...)` computes
+        for the input [start_mel, c_1, ..., c_{k-1}]. For beam search the rows are re-gathered with `beam_indices`.
+        """
+        step_hiddens = []
+
+        def record_hidden(module, args, output):
+            # 第一步是整个 prompt，只保留最后一个位置（start_mel_token）
+            step_hiddens.append(output[0][:, -1:])
+
+        num_beams = hf_generate_kwargs.get("num_beams", 1)
+        if num_beams > 1:
+            hf_generate_kwargs.update(return_dict_in_generate=True, output_scores=True)
+        handle = self.gpt.register_forward_hook(record_hidden)
+        try:
+            output = self.inference_model.generate(inputs,
+                                                   bos_token_id=self.start_mel_token, pad_token_id=self.stop_mel_token,
+                                                   eos_token_id=self.stop_mel_token, attention_mask=attention_mask,
+                                                   max_length=max_length, logits_processor=logits_processor,
+                                                   num_return_sequences=num_return_sequences,
+                                                   **hf_generate_kwargs)
+        finally:
+            handle.remove()
+        if isinstance(output, torch.Tensor):
+            codes = output[:, trunc_index:]
+            hidden = torch.cat(step_hiddens, dim=1)[:, :codes.shape[1]]
+        else:
+            codes = output.sequences[:, trunc_index:]
+            hiddens = torch.cat(step_hiddens, dim=1)  # (b * num_beams, steps, dim)
+            # beam_indices: (b * num_return_sequences, len) 每一步产生该 token 的 beam 行号，结束后为 -1
+            beam_indices = output.beam_indices[:, :codes.shape[1]].clamp(min=0)
+            steps = torch.arange(beam_indices.shape[1], device=hiddens.device)
+            hidden = hiddens[beam_indices, steps]
+        return codes, speech_conditioning_latent, self.final_norm(hidden)
+
     def get_emovec(self, emo_speech_conditioning_latent, emo_cond_lengths):
         emo_vec_syn_ori = self.get_emo_conditioning(emo_speech_conditioning_latent.transpose(1,2), emo_cond_lengths)
         emo_vec_syn = self.emovec_layer(emo_vec_syn_ori)
@@ -0,0 +1,145 @@
+import torch
+import torch.nn.functional as F
+
+from indextts.utils.fused_sampling import FusedSampler
+
+# generate kwargs the static decode loop implements, anything else goes through HF generate
+STATIC_DECODE_KWARGS = {
+    "do_sample", "temperature", "top_k", "top_p", "repetition_penalty", "num_beams", "length_penalty", "generators",
+}
+
+
+class StaticCacheDecoder:
+    """
+    Decode loop of UnifiedVoice's HF GPT2 for non-beam generation, without the HF generate machinery.
+
+    The key / value buffers of every layer are allocated once per call for the whole token budget
+    (prompt + max_new_tokens) and filled in place, the attention mask is a prefix view of one preallocated
+    key mask, and repetition penalty / temperature / top-k / top-p run in one `FusedSampler` pass over the batch.
+    There is no cache growth, no `prepare_inputs_for_generation` and no processor list dispatch per token.
+
+    The GPT2 blocks are run directly (ln_1 -> attention -> ln_2 -> mlp); positions need no handling because
+    the GPT's learned position embedding is nulled and the mel position embedding is added to the inputs.
+    Sampling follows the HF processors (same order, same float32 logits, same per-row generators), so a
+    seeded run samples the same codes as `GPT2InferenceModel.generate`.
+    """
+
+    def __init__(self, gpt, mel_embedding, mel_pos_embedding, final_norm, mel_head):
+        self.gpt = gpt
+        self.mel_embedding = mel_embedding
+        self.mel_pos_embedding = mel_pos_embedding
+        self.final_norm = final_norm
+        self.mel_head = mel_head
+        attn = gpt.h[0].attn
+        self.num_heads = attn.num_heads
+        self.head_dim = attn.head_dim
+        self.embed_dim = attn.embed_dim
+        self.scales = []
+        for layer_idx, block in enumerate(gpt.h):
+            scale = block.attn.head_dim ** -0.5 if block.attn.scale_attn_weights else 1.0
+            if block.attn.scale_attn_by_inverse_layer_idx:
+                scale /= layer_idx + 1
+            self.scales.append(scale)
+        self.key = self.value = None
+        self.sampler = FusedSampler()
+
+    def _allocate(self, batch, max_len, device):
+        # 缓冲区的 dtype 跟随 autocast 下 attention 的实际精度
+        if torch.is_autocast_enabled(device.type):
+            dtype = torch.get_autocast_dtype(device.type)
+        else:
+            dtype = next(self.gpt.parameters()).dtype
+        shape = (len(self.gpt.h), batch, self.num_heads, max_len, self.head_dim)
+        self.key = torch.empty(shape, dtype=dtype, device=device)
+        self.value = torch.empty(shape, dtype=dtype, device=device)
+
+    def _attention(self, layer_idx, attn, h, start, mask):
+        b, t = h.shape[:2]
+        query, key, value = attn.c_attn(h).split(self.embed_dim, dim=2)
+        query = query.view(b, t, self.num_heads, self.head_dim).transpose(1, 2)
+        end = start + t
+        self.key[layer_idx, :, :, start:end] = key.view(b, t, self.num_heads, self.head_dim).transpose(1, 2)
+        self.value[layer_idx, :, :, start:end] = value.view(b, t, self.num_heads, self.head_dim).transpose(1, 2)
+        out = F.scaled_dot_product_attention(
+            query, self.key[layer_idx, :, :, :end], self.value[layer_idx, :, :, :end],
+            attn_mask=mask, scale=self.scales[layer_idx],
+        )
+        return attn.c_proj(out.transpose(1, 2).reshape(b, t, self.embed_dim))
+
+    def _forward(self, h, start, mask):
+        """Run h ([b, t, dim] at positions start..start+t) through the GPT, storing its keys / values."""
+        for layer_idx, block in enumerate(self.gpt.h):
+            h = h + self._attention(layer_idx, block.attn, block.ln_1(h), start, mask)
+            h = h + block.mlp(block.ln_2(h))
+        return self.gpt.ln_f(h)
+
+    @torch.no_grad()
+    def generate(self, inputs_embeds, attention_mask, max_new_tokens, start_token, stop_token, prompt_token_ids=(),
+                 prefix_past=None, do_sample=False, temperature=1.0, top_k=50, top_p=1.0, repetition_penalty=1.0,
+                 generators=None, return_hidden_states=False, **unused):
+        """
+        Args:
+            inputs_embeds: (b, s, dim) [cond][pad][text] embeddings, without start_mel
+            attention_mask: (b, s + 1) 0 on the padding, the last column is start_mel
+            max_new_tokens: token budget
+            prompt_token_ids: token ids of the prompt counted by the repetition penalty
+                (HF penalizes the placeholder input ids, i.e. 1 and start_mel)
+            prefix_past: per-layer (key, value) of the first P positions, from `UnifiedVoice._prefix_past`
+            generators: one torch.Generator per row for reproducible sampling
+            return_hidden_states: also return the GPT output that predicted every code
+        Returns:
+            codes (b, n) with the stop token included and finished rows padded with it, like HF generate
+            (, hidden states (b, n, dim) if return_hidden_states)
+        """
+        b, s, _ = inputs_embeds.shape
+        device = inputs_embeds.device
+        max_len = s + 1 + max_new_tokens
+        key_mask = torch.ones(b, max_len, dtype=torch.bool, device=device)
+        key_mask[:, :s + 1] = attention_mask.bool()
+        seen = torch.zeros(b, self.mel_head.out_features, dtype=torch.bool, device=device)
+        if prompt_token_ids:
+            seen[:, list(prompt_token_ids)] = True
+        codes = torch.full((b, max_new_tokens), stop_token, dtype=torch.long, device=device)
+        finished = torch.zeros(b, dtype=torch.bool, device=device)
+        hiddens = None
+        pos_weight = self.mel_pos_embedding.emb.weight
+
+        start_emb = self.mel_embedding(torch.tensor([start_token], device=device)) + pos_weight[0]
+        emb = torch.cat([inputs_embeds, start_emb.to(inputs_embeds.dtype).expand(b, 1, -1)], dim=1)
+        start = 0
+        self._allocate(b, max_len, device)
+        if prefix_past is not None:
+            start = prefix_past[0][0].shape[-2]
+            for layer_idx, (key, value) in enumerate(prefix_past):
+                self.key[layer_idx, :, :, :start] = key.repeat_interleave(b // key.shape[0], 0)
+                self.value[layer_idx, :, :, :start] = value.repeat_interleave(b // value.shape[0], 0)
+            emb = emb[:, start:]
+        # prefill: causal over the prompt and masked on the padding
+        causal = torch.ones(s + 1 - start, s + 1, dtype=torch.bool, device=device).tril(start)
+        prefill_mask = causal[None, None] & key_mask[:, None, None, :s + 1]
+        try:
+            hidden = self._forward(emb, start, prefill_mask)[:, -1]
+            for step in range(max_new_tokens):
+                if return_hidden_states:
+                    if hiddens is None:
+                        hiddens = hidden.new_zeros(b, max_new_tokens, hidden.shape[-1])
+                    hiddens[:, step] = hidden
+                logits = self.mel_head(self.final_norm(hidden)).float()
+                tokens = self.sampler(logits, seen, do_sample, temperature, top_k, top_p, repetition_penalty,
+                                      generators)
+                tokens = tokens.masked_fill(finished, stop_token)
+                codes[:, step] = tokens
+                seen.scatter_(1, tokens[:, None], True)
+                finished |= tokens == stop_token
+                if step == max_new_tokens - 1 or bool(finished.all()):
+                    break
+                pos = s + 1 + step
+                emb = (self.mel_embedding(tokens) + pos_weight[step + 1])[:, None].to(emb.dtype)
+                hidden = self._forward(emb, pos, key_mask[:, None, None, :pos + 1])[:, -1]
+        finally:
+            # 不在两次调用之间持有整段预算的 KV
+            self.key = self.value = None
+        n = step + 1 if max_new_tokens > 0 else 0
+        if return_hidden_states:
+            return codes[:, :n], hiddens[:, :n] if hiddens is not None else hidden.new_zeros(b, 0, hidden.shape[-1])
+        return codes[:, :n]
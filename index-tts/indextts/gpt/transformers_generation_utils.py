@@ -1968,6 +1968,8 @@ class GenerationMixin:
         self._validate_model_class()
         tokenizer = kwargs.pop("tokenizer", None)  # Pull this out first, we only use it for stopping criteria
         assistant_tokenizer = kwargs.pop("assistant_tokenizer", None)  # only used for assisted generation
+        # 每个 batch 行一个 torch.Generator（种子化生成），采样结果与 batch 组成无关
+        generators = kwargs.pop("generators", None)
 
         generation_config, model_kwargs = self._prepare_generation_config(generation_config, **kwargs)
         self._validate_model_kwargs(model_kwargs.copy())
@@ -2220,6 +2222,7 @@ class GenerationMixin:
                 generation_config=generation_config,
                 synced_gpus=synced_gpus,
                 streamer=streamer,
+                generators=generators,
                 **model_kwargs,
             )
 
@@ -2251,6 +2254,7 @@ class GenerationMixin:
                 stopping_criteria=prepared_stopping_criteria,
                 generation_config=generation_config,
                 synced_gpus=synced_gpus,
+                generators=generators,
                 **model_kwargs,
             )
 
@@ -3128,6 +3132,7 @@ class GenerationMixin:
         generation_config: GenerationConfig,
         synced_gpus: bool,
         streamer: Optional["BaseStreamer"],
+        generators: Optional[List[torch.Generator]] = None,
         **model_kwargs,
     ) -> Union[GenerateNonBeamOutput, torch.LongTensor]:
         r"""
@@ -3151,6 +3156,8 @@ class GenerationMixin:
             streamer (`BaseStreamer`, *optional*):
                 Streamer object that will be used to stream the generated sequences. Generated tokens are passed
                 through `streamer.put(token_ids)` and the streamer is responsible for any further processing.
+            generators (`List[torch.Generator]`, *optional*):
+                One random generator per sequence, see `_multinomial`.
             model_kwargs:
                 Additional model specific kwargs will be forwarded to the `forward` function of the model. If model is
                 an encoder-decoder model the kwargs should include `encoder_outputs`.
@@ -3247,7 +3254,7 @@ class GenerationMixin:
             if do_sample:
                 probs = nn.functional.softmax(next_token_scores, dim=-1)
                 # TODO (joao): this OP throws "skipping cudagraphs due to ['incompatible ops']", find solution
-                next_tokens = torch.multinomial(probs, num_samples=1).squeeze(1)
+                next_tokens = _multinomial(probs, 1, generators).squeeze(1)
             else:
                 next_tokens = torch.argmax(next_token_scores, dim=-1)
 
@@ -3330,6 +3337,7 @@ class GenerationMixin:
         stopping_criteria: StoppingCriteriaList,
         generation_config: GenerationConfig,
         synced_gpus: bool,
+        generators: Optional[List[torch.Generator]] = None,
         **model_kwargs,
     ) -> Union[GenerateBeamOutput, torch.LongTensor]:
         r"""
@@ -3353,6 +3361,8 @@ class GenerationMixin:
             synced_gpus (`bool`):
                 Whether to continue running the while loop until max_length (needed to avoid deadlocking with
                 `FullyShardedDataParallel` and DeepSpeed ZeRO Stage 3).
+            generators (`List[torch.Generator]`, *optional*):
+                One random generator per batch item (shared by its beams), see `_multinomial`.
             model_kwargs:
                 Additional model specific kwargs will be forwarded to the `forward` function of the model. If model is
                 an encoder-decoder model the kwargs should include `encoder_outputs`.
@@ -3512,7 +3522,7 @@ class GenerationMixin:
                 # import time
                 # start = time.time()
                 probs = nn.functional.softmax(next_token_scores, dim=-1)
-                next_tokens = torch.multinomial(probs, num_samples=n_tokens_to_keep)
+                next_tokens = _multinomial(probs, n_tokens_to_keep, generators)
                 next_token_scores = torch.gather(next_token_scores, -1, next_tokens)
                 next_token_scores, _indices = torch.sort(next_token_scores, descending=True, dim=1)
                 next_tokens = torch.gather(next_tokens, -1, _indices)
@@ -4405,6 +4415,21 @@ class GenerationMixin:
             return input_ids
 
 
+def _multinomial(probs, num_samples, generators=None):
+    """
+    torch.multinomial over the rows of probs. With generators, row i draws from generators[i], so a sequence
+    samples the same tokens whether it is generated alone or in a batch.
+    """
+    if generators is None:
+        return torch.multinomial(probs, num_samples=num_samples)
+    if len(generators) != probs.shape[0]:
+        raise ValueError(f"got {len(generators)} generators for {probs.shape[0]} sampled rows")
+    return torch.cat([
+        torch.multinomial(row.unsqueeze(0), num_samples=num_samples, generator=generator)
+        for row, generator in zip(probs, generators)
+    ])
+
+
 def _speculative_sampling(
     candidate_input_ids,
     candidate_logits,
@@ -2,7 +2,9 @@ import os
 from subprocess import CalledProcessError
 
 os.environ['HF_HUB_CACHE'] = './checkpoints/hf_cache'
+import hashlib
 import json
+import math
 import re
 import time
 import librosa
@@ -21,6 +23,9 @@ from indextts.gpt.model_v2 import UnifiedVoice
 from indextts.utils.maskgct_utils import build_semantic_model, build_semantic_codec
 from indextts.utils.checkpoint import load_checkpoint
 from indextts.utils.front import TextNormalizer, TextTokenizer
+from indextts.utils.cond_cache import ConditioningCache
+from indextts.utils.synthesis_cache import SynthesisCache
+from indextts.utils.voice_registry import VoiceRegistry, SPK_TENSORS, EMO_TENSORS, is_voice_id
 
 from indextts.s2mel.modules.commons import load_checkpoint2, MyModel
 from indextts.s2mel.modules.bigvgan import bigvgan
@@ -33,12 +38,15 @@ from huggingface_hub import hf_hub_download
 import safetensors
 from transformers import SeamlessM4TFeatureExtractor
 import random
+from typing import Dict, List
 import torch.nn.functional as F
 
 class IndexTTS2:
     def __init__(
             self, cfg_path="checkpoints/config.yaml", model_dir="checkpoints", use_fp16=False, device=None,
-            use_cuda_kernel=None,use_deepspeed=False, use_accel=False, use_torch_compile=False
+            use_cuda_kernel=None,use_deepspeed=False, use_accel=False, use_torch_compile=False,
+            cond_cache_mb=512, voice_dir=None, synthesis_cache_dir=None, synthesis_cache_mb=1024,
+            accel_max_batch_size=1
     ):
         """
         Args:
@@ -48,8 +56,14 @@ class IndexTTS2:
             device (str): device to use (e.g., 'cuda:0', 'cpu'). If None, it will be set automatically based on the availability of CUDA or MPS.
             use_cuda_kernel (None | bool): whether to use BigVGan custom fused activation CUDA kernel, only for CUDA device.
             use_deepspeed (bool): whether to use DeepSpeed or not.
-            use_accel (bool): whether to use acceleration engine for GPT2 or not.
+            use_accel (bool): whether to use acceleration engine for GPT2 or not (flash-attn on CUDA, paged attention in PyTorch on CPU).
             use_torch_compile (bool): whether to use torch.compile for optimization or not.
+            cond_cache_mb (int): memory budget of the reference audio conditioning cache in MB.
+            voice_dir (str): directory of the voice registry, defaults to `<model_dir>/voices`.
+            synthesis_cache_dir (str): directory of the on-disk synthesis cache, None disables it.
+            synthesis_cache_mb (int): size cap of the synthesis cache directory in MB.
+            accel_max_batch_size (int): with use_accel, values > 1 decode through a continuous batching scheduler:
+                the segments of batched and concurrent requests share decode steps, up to this many at once.
         """
         if device is not None:
             self.device = device
@@ -99,7 +113,8 @@ class IndexTTS2:
                 use_deepspeed = False
                 print(f">> Failed to load DeepSpeed. Falling back to normal inference. Error: {e}")
 
-        self.gpt.post_init_gpt2_config(use_deepspeed=use_deepspeed, kv_cache=True, half=self.use_fp16)
+        self.gpt.post_init_gpt2_config(use_deepspeed=use_deepspeed, kv_cache=True, half=self.use_fp16,
+                                       accel_max_batch_size=accel_max_batch_size)
 
         if self.use_cuda_kernel:
             # preload the CUDA kernel for BigVGAN
@@ -194,15 +209,16 @@ class IndexTTS2:
             "center": False
         }
         self.mel_fn = lambda x: mel_spectrogram(x, **mel_fn_args)
+        # 每个语义 token 对应的 mel 帧数（22050 / 256 / 50Hz ≈ 1.72），语义 token 长度 -> s2mel 目标长度
+        self.mel_frames_per_code = 1.72
 
-        # 缓存参考音频：
-        self.cache_spk_cond = None
-        self.cache_s2mel_style = None
-        self.cache_s2mel_prompt = None
-        self.cache_spk_audio_prompt = None
-        self.cache_emo_cond = None
-        self.cache_emo_audio_prompt = None
-        self.cache_mel = None
+        # 缓存参考音频（按音频内容哈希的 LRU，多说话人交替时无需重复计算）：
+        self.cond_cache = ConditioningCache(max_bytes=cond_cache_mb * 1024 * 1024)
+        # 预先计算好的音色条件（register_voice 注册后，可用 voice id 代替参考音频路径）
+        self.voices = VoiceRegistry(voice_dir or os.path.join(self.model_dir, "voices"))
+        # 合成结果缓存（按音色、规范化文本与生成参数寻址），相同请求直接返回已合成的音频
+        self.synthesis_cache = SynthesisCache(synthesis_cache_dir, max_bytes=synthesis_cache_mb * 1024 * 1024) \
+            if synthesis_cache_dir else None
 
         # 进度引用显示（可选）
         self.gr_progress = None
@@ -347,6 +363,260 @@ class IndexTTS2:
 
         return emo_vector
 
+    def _prepare_emo_vector(self, text, emo_vector=None, use_emo_text=False, emo_text=None, emo_alpha=1.0):
+        """
+        Resolve the emotion vector of a request: detect it from emo_text (or text) if use_emo_text,
+        and pre-scale it by emo_alpha. Returns None if no emotion vector is used.
+        """
+        if use_emo_text:
+            # automatically generate emotion vectors from text prompt
+            if emo_text is None:
+                emo_text = text  # use main text prompt
+            emo_dict = self.qwen_emo.inference(emo_text)
+            print(f"detected emotion vectors from text: {emo_dict}")
+            # convert ordered dict to list of vectors; the order is VERY important!
+            emo_vector = list(emo_dict.values())
+
+        if emo_vector is not None:
+            # we have emotion vectors; they can't be blended via alpha mixing
+            # in the main inference process later, so we must pre-calculate
+            # their new strengths here based on the alpha instead!
+            emo_vector_scale = max(0.0, min(1.0, emo_alpha))
+            if emo_vector_scale != 1.0:
+                # scale each vector and truncate to 4 decimals (for nicer printing)
+                emo_vector = [int(x * emo_vector_scale * 10000) / 10000 for x in emo_vector]
+                print(f"scaled emotion vectors to {emo_vector_scale}x: {emo_vector}")
+        return emo_vector
+
+    def _get_spk_condition(self, spk_audio_prompt, verbose=False):
+        """
+        Speaker conditioning of a reference audio.
+        Returns:
+            spk_cond_emb, style, prompt_condition, ref_mel
+        """
+        if is_voice_id(spk_audio_prompt):
+            return self._get_registered_condition(spk_audio_prompt, "spk", SPK_TENSORS)
+        # 只有缓存中没有相同内容的参考音频时，才需要重新生成, 提升速度
+        key = self.cond_cache.audio_key("spk", spk_audio_prompt, 15)
+        cached = self.cond_cache.get(key)
+        if cached is not None:
+            return cached
+        if verbose:
+            print(">> conditioning cache miss:", self.cond_cache.stats())
+        audio,sr = self._load_and_cut_audio(spk_audio_prompt,15,verbose)
+        audio_22k = torchaudio.transforms.Resample(sr, 22050)(audio)
+        audio_16k = torchaudio.transforms.Resample(sr, 16000)(audio)
+
+        inputs = self.extract_features(audio_16k, sampling_rate=16000, return_tensors="pt")
+        input_features = inputs["input_features"]
+        attention_mask = inputs["attention_mask"]
+        input_features = input_features.to(self.device)
+        attention_mask = attention_mask.to(self.device)
+        spk_cond_emb = self.get_emb(input_features, attention_mask)
+
+        _, S_ref = self.semantic_codec.quantize(spk_cond_emb)
+        ref_mel = self.mel_fn(audio_22k.to(spk_cond_emb.device).float())
+        ref_target_lengths = torch.LongTensor([ref_mel.size(2)]).to(ref_mel.device)
+        feat = torchaudio.compliance.kaldi.fbank(audio_16k.to(ref_mel.device),
+                                                 num_mel_bins=80,
+                                                 dither=0,
+                                                 sample_frequency=16000)
+        feat = feat - feat.mean(dim=0, keepdim=True)  # feat2另外一个滤波器能量组特征[922, 80]
+        style = self.campplus_model(feat.unsqueeze(0))  # 参考音频的全局style2[1,192]
+
+        prompt_condition = self.s2mel.models['length_regulator'](S_ref,
+                                                                 ylens=ref_target_lengths,
+                                                                 n_quantizers=3,
+                                                                 f0=None)[0]
+
+        return self.cond_cache.put(key, (spk_cond_emb, style, prompt_condition, ref_mel))
+
+    def _get_emo_vector_mat(self, emo_vector, style, use_random=False, rng=None):
+        """
+        Mix the emotion matrix rows selected for `style` with the weights in emo_vector.
+        With use_random the rows are drawn from rng (a seeded `random.Random`), or the `random` module.
+        Returns:
+            weight_vector, emovec_mat
+        """
+        weight_vector = torch.tensor(emo_vector, device=self.device)
+        if use_random:
+            rng = rng or random
+            random_index = [rng.randint(0, x - 1) for x in self.emo_num]
+        else:
+            random_index = [find_most_similar_cosine(style, tmp) for tmp in self.spk_matrix]
+
+        emo_matrix = [tmp[index].unsqueeze(0) for index, tmp in zip(random_index, self.emo_matrix)]
+        emo_matrix = torch.cat(emo_matrix, 0)
+        emovec_mat = weight_vector.unsqueeze(1) * emo_matrix
+        emovec_mat = torch.sum(emovec_mat, 0)
+        emovec_mat = emovec_mat.unsqueeze(0)
+        return weight_vector, emovec_mat
+
+    def _get_emo_condition(self, emo_audio_prompt, verbose=False):
+        if is_voice_id(emo_audio_prompt):
+            return self._get_registered_condition(emo_audio_prompt, "emo", EMO_TENSORS)[0]
+        key = self.cond_cache.audio_key("emo", emo_audio_prompt, 15)
+        cached = self.cond_cache.get(key)
+        if cached is not None:
+            return cached
+        emo_audio, _ = self._load_and_cut_audio(emo_audio_prompt,15,verbose,sr=16000)
+        emo_inputs = self.extract_features(emo_audio, sampling_rate=16000, return_tensors="pt")
+        emo_input_features = emo_inputs["input_features"]
+        emo_attention_mask = emo_inputs["attention_mask"]
+        emo_input_features = emo_input_features.to(self.device)
+        emo_attention_mask = emo_attention_mask.to(self.device)
+        emo_cond_emb = self.get_emb(emo_input_features, emo_attention_mask)
+        return self.cond_cache.put(key, emo_cond_emb)
+
+    def _get_registered_condition(self, voice_id, kind, names):
+        key = (kind, voice_id)
+        cached = self.cond_cache.get(key)
+        if cached is not None:
+            return cached
+        tensors = self.voices.load(voice_id, device=self.device)
+        return self.cond_cache.put(key, tuple(tensors[name] for name in names))
+
+    def register_voice(self, spk_audio_prompt, name=None, verbose=False):
+        """
+        Precompute the conditioning of a reference audio and store it in the voice registry.
+        Args:
+            spk_audio_prompt (str): reference audio of the voice.
+            name (str): optional display name.
+        Returns:
+            voice id accepted by `infer` / `infer_batch` in place of `spk_audio_prompt` (and `emo_audio_prompt`).
+        """
+        voice_id = self.voices.voice_id_for(spk_audio_prompt)
+        if self.voices.exists(voice_id):
+            return voice_id
+        spk_condition = self._get_spk_condition(spk_audio_prompt, verbose)
+        emo_condition = (self._get_emo_condition(spk_audio_prompt, verbose),)
+        tensors = dict(zip(SPK_TENSORS, spk_condition))
+        tensors.update(zip(EMO_TENSORS, emo_condition))
+        self.voices.save(voice_id, tensors, name=name, source=os.path.abspath(spk_audio_prompt))
+        print(f">> registered voice {voice_id} from {spk_audio_prompt}")
+        return voice_id
+
+    def _trim_codes(self, codes):
+        """
+        Cut every row of generated codes at its first stop_mel_token.
+        Returns:
+            codes: [B, max_code_len], code_lens: [B]
+        """
+        code_lens = []
+        max_code_len = 0
+        for code in codes:
+            if self.stop_mel_token not in code:
+                code_len = len(code)
+            else:
+                len_ = (code == self.stop_mel_token).nonzero(as_tuple=False)[0]
+                code_len = len_[0].item() if len_.numel() > 0 else len(code)
+            code_lens.append(code_len)
+            max_code_len = max(max_code_len, code_len)
+        codes = codes[:, :max_code_len]
+        code_lens = torch.LongTensor(code_lens)
+        code_lens = code_lens.to(self.device)
+        return codes, code_lens
+
+    def _duration_plan(self, segment_token_counts, target_duration, max_mel_tokens,
+                       sampling_rate=22050, interval_silence=200, duration_max_rate=2.0):
+        """
+        Plan the segments of one text so that its output (segments + interval silences) lasts `target_duration` seconds.
+        The speech time is split proportional to the text tokens of every segment, the s2mel length regulator then
+        renders every segment with exactly its planned number of mel frames, instead of `code_lens * 1.72`.
+        Args:
+            segment_token_counts: text token count of every segment.
+            target_duration (float): target length in seconds.
+            duration_max_rate (float): GPT first generates at most this many times the semantic tokens the target
+                length needs. A segment that reaches this budget before its stop token is regenerated with
+                `max_mel_tokens`, so no speech is cut, and the length regulator compresses it into its frames.
+        Returns:
+            list of (target mel frames, mel token budget) per segment
+        Raises:
+            ValueError: if target_duration is not positive, which would silently plan an empty output
+        """
+        if not target_duration > 0:
+            raise ValueError(f"target_duration must be positive, got {target_duration}")
+        hop_length = self.cfg.s2mel['preprocess_params']['spect_params']['hop_length']
+        silence_samples = 0
+        if interval_silence > 0:
+            silence_samples = int(sampling_rate * interval_silence / 1000.0) * (len(segment_token_counts) - 1)
+        speech_samples = max(round(target_duration * sampling_rate) - silence_samples, 0)
+        total_frames = round(speech_samples / hop_length)
+        total_tokens = sum(segment_token_counts) or 1
+
+        plan = []
+        seen_tokens, planned_frames = 0, 0
+        for count in segment_token_counts:
+            # 按累计比例取整，各段帧数之和等于总帧数
+            seen_tokens += count
+            frames = max(round(total_frames * seen_tokens / total_tokens) - planned_frames, 1)
+            planned_frames += frames
+            budget = min(max_mel_tokens, math.ceil(frames / self.mel_frames_per_code * duration_max_rate) + 1)
+            plan.append((frames, budget))
+        return plan
+
+    def _warn_duration_rate(self, code_len, target_frames):
+        rate = code_len * self.mel_frames_per_code / target_frames
+        if not 0.5 <= rate <= 2.0:
+            print(f">> WARN: duration target needs speech rate {rate:.2f}x "
+                  f"({code_len} semantic tokens into {target_frames} mel frames), output may sound unnatural")
+
+    @staticmethod
+    def _stream_seed(seed, *stream):
+        # 每个随机流（如 ("gpt", 段序号, 段 token)）由请求种子派生独立的种子，与 batch 组成和执行顺序无关；
+        # 混入文本后，同一种子下不同文本（如不同字幕块）的首段不会得到相同的噪声
+        digest = hashlib.sha256(repr((seed,) + stream).encode("utf-8")).digest()
+        return int.from_bytes(digest[:8], "little") >> 1
+
+    def _seeded_generators(self, seed, kind, seg_streams):
+        """
+        One torch.Generator per segment, seeded from its (position inside its text, text tokens) stream.
+        None without a seed.
+        """
+        if seed is None:
+            return None
+        return [torch.Generator(device=self.device).manual_seed(self._stream_seed(seed, kind, pos, tuple(sent)))
+                for pos, sent in seg_streams]
+
+    def _seeded_random(self, seed, text):
+        """random.Random for the `use_random` emotion selection of one text, None without a seed."""
+        return random.Random(self._stream_seed(seed, "emo", text)) if seed is not None else None
+
+    def _prompt_digest(self, audio_prompt):
+        # voice id 本身由音频内容导出，路径则按文件内容哈希（复用条件缓存的摘要）
+        if audio_prompt is None or is_voice_id(audio_prompt):
+            return audio_prompt
+        return self.cond_cache.audio_key("audio", audio_prompt)[1]
+
+    def _synthesis_key(self, spk_audio_prompt, emo_audio_prompt, text, params):
+        """Synthesis cache key of one text, None when the cache is disabled."""
+        if self.synthesis_cache is None:
+            return None
+        # 以分词结果作为规范化文本，写法不同但读法相同的文本（全角标点、数字等）命中同一条目
+        normalized_text = " ".join(self.tokenizer.tokenize(text))
+        params = dict(params, model_version=self.model_version, model_dir=os.path.abspath(self.model_dir))
+        return self.synthesis_cache.key([self._prompt_digest(spk_audio_prompt), self._prompt_digest(emo_audio_prompt)],
+                                        normalized_text, params)
+
+    def _cached_synthesis(self, key):
+        cached = self.synthesis_cache.get(key) if key is not None else None
+        if cached is not None:
+            stats = self.synthesis_cache.stats()
+            print(f">> synthesis cache hit {key[:12]}, hit rate {stats['hit_rate']:.1%} "
+                  f"({stats['hits']}/{stats['hits'] + stats['misses']})")
+        return cached
+
+    def _synthesis_output(self, result, output_path):
+        """Return (sampling_rate, wav_data) like `infer`: saved to output_path and returned as path if given."""
+        if not output_path:
+            return result
+        sampling_rate, wav_data = result
+        if os.path.dirname(output_path) != "":
+            os.makedirs(os.path.dirname(output_path), exist_ok=True)
+        torchaudio.save(output_path, torch.from_numpy(wav_data.T.copy()), sampling_rate)
+        print(">> wav file saved to:", output_path)
+        return output_path
+
     # 原始推理模式
     def infer(self, spk_audio_prompt, text, output_path,
               emo_audio_prompt=None, emo_alpha=1.0,
@@ -362,9 +632,18 @@ class IndexTTS2:
                 verbose, max_text_tokens_per_segment, stream_return, more_segment_before, **generation_kwargs
             )
         else:
+            # 流式输出不经过合成缓存
+            key = self._synthesis_key(spk_audio_prompt, emo_audio_prompt, text, dict(
+                emo_alpha=emo_alpha, emo_vector=emo_vector, use_emo_text=use_emo_text, emo_text=emo_text,
+                use_random=use_random, interval_silence=interval_silence,
+                max_text_tokens_per_segment=max_text_tokens_per_segment, more_segment_before=more_segment_before,
+                **generation_kwargs))
+            cached = self._cached_synthesis(key)
+            if cached is not None:
+                return self._synthesis_output(cached, output_path)
             try:
-                return list(self.infer_generator(
-                    spk_audio_prompt, text, output_path,
+                result = list(self.infer_generator(
+                    spk_audio_prompt, text, output_path if key is None else None,
                     emo_audio_prompt, emo_alpha,
                     emo_vector,
                     use_emo_text, emo_text, use_random, interval_silence,
@@ -372,6 +651,10 @@ class IndexTTS2:
                 ))[0]
             except IndexError:
                 return None
+            if key is None:
+                return result
+            self.synthesis_cache.put(key, *result)
+            return self._synthesis_output(result, output_path)
 
     def infer_generator(self, spk_audio_prompt, text, output_path,
               emo_audio_prompt=None, emo_alpha=1.0,
@@ -386,30 +669,15 @@ class IndexTTS2:
                   f"emo_vector:{emo_vector}, use_emo_text:{use_emo_text}, "
                   f"emo_text:{emo_text}")
         start_time = time.perf_counter()
+        # 种子化生成：GPT 采样、CFM 噪声与 use_random 的情感选择均可复现
+        seed = generation_kwargs.pop("seed", None)
 
         if use_emo_text or emo_vector is not None:
             # we're using a text or emotion vector guidance; so we must remove
             # "emotion reference voice", to ensure we use correct emotion mixing!
             emo_audio_prompt = None
 
-        if use_emo_text:
-            # automatically generate emotion vectors from text prompt
-            if emo_text is None:
-                emo_text = text  # use main text prompt
-            emo_dict = self.qwen_emo.inference(emo_text)
-            print(f"detected emotion vectors from text: {emo_dict}")
-            # convert ordered dict to list of vectors; the order is VERY important!
-            emo_vector = list(emo_dict.values())
-
-        if emo_vector is not None:
-            # we have emotion vectors; they can't be blended via alpha mixing
-            # in the main inference process later, so we must pre-calculate
-            # their new strengths here based on the alpha instead!
-            emo_vector_scale = max(0.0, min(1.0, emo_alpha))
-            if emo_vector_scale != 1.0:
-                # scale each vector and truncate to 4 decimals (for nicer printing)
-                emo_vector = [int(x * emo_vector_scale * 10000) / 10000 for x in emo_vector]
-                print(f"scaled emotion vectors to {emo_vector_scale}x: {emo_vector}")
+        emo_vector = self._prepare_emo_vector(text, emo_vector, use_emo_text, emo_text, emo_alpha)
 
         if emo_audio_prompt is None:
             # we are not using any external "emotion reference voice"; use
@@ -418,80 +686,12 @@ class IndexTTS2:
             # must always use alpha=1.0 when we don't have an external reference voice
             emo_alpha = 1.0
 
-        # 如果参考音频改变了，才需要重新生成, 提升速度
-        if self.cache_spk_cond is None or self.cache_spk_audio_prompt != spk_audio_prompt:
-            if self.cache_spk_cond is not None:
-                self.cache_spk_cond = None
-                self.cache_s2mel_style = None
-                self.cache_s2mel_prompt = None
-                self.cache_mel = None
-                torch.cuda.empty_cache()
-            audio,sr = self._load_and_cut_audio(spk_audio_prompt,15,verbose)
-            audio_22k = torchaudio.transforms.Resample(sr, 22050)(audio)
-            audio_16k = torchaudio.transforms.Resample(sr, 16000)(audio)
-
-            inputs = self.extract_features(audio_16k, sampling_rate=16000, return_tensors="pt")
-            input_features = inputs["input_features"]
-            attention_mask = inputs["attention_mask"]
-            input_features = input_features.to(self.device)
-            attention_mask = attention_mask.to(self.device)
-            spk_cond_emb = self.get_emb(input_features, attention_mask)
-
-            _, S_ref = self.semantic_codec.quantize(spk_cond_emb)
-            ref_mel = self.mel_fn(audio_22k.to(spk_cond_emb.device).float())
-            ref_target_lengths = torch.LongTensor([ref_mel.size(2)]).to(ref_mel.device)
-            feat = torchaudio.compliance.kaldi.fbank(audio_16k.to(ref_mel.device),
-                                                     num_mel_bins=80,
-                                                     dither=0,
-                                                     sample_frequency=16000)
-            feat = feat - feat.mean(dim=0, keepdim=True)  # feat2另外一个滤波器能量组特征[922, 80]
-            style = self.campplus_model(feat.unsqueeze(0))  # 参考音频的全局style2[1,192]
-
-            prompt_condition = self.s2mel.models['length_regulator'](S_ref,
-                                                                     ylens=ref_target_lengths,
-                                                                     n_quantizers=3,
-                                                                     f0=None)[0]
-
-            self.cache_spk_cond = spk_cond_emb
-            self.cache_s2mel_style = style
-            self.cache_s2mel_prompt = prompt_condition
-            self.cache_spk_audio_prompt = spk_audio_prompt
-            self.cache_mel = ref_mel
-        else:
-            style = self.cache_s2mel_style
-            prompt_condition = self.cache_s2mel_prompt
-            spk_cond_emb = self.cache_spk_cond
-            ref_mel = self.cache_mel
+        spk_cond_emb, style, prompt_condition, ref_mel = self._get_spk_condition(spk_audio_prompt, verbose)
 
         if emo_vector is not None:
-            weight_vector = torch.tensor(emo_vector, device=self.device)
-            if use_random:
-                random_index = [random.randint(0, x - 1) for x in self.emo_num]
-            else:
-                random_index = [find_most_similar_cosine(style, tmp) for tmp in self.spk_matrix]
-
-            emo_matrix = [tmp[index].unsqueeze(0) for index, tmp in zip(random_index, self.emo_matrix)]
-            emo_matrix = torch.cat(emo_matrix, 0)
-            emovec_mat = weight_vector.unsqueeze(1) * emo_matrix
-            emovec_mat = torch.sum(emovec_mat, 0)
-            emovec_mat = emovec_mat.unsqueeze(0)
-
-        if self.cache_emo_cond is None or self.cache_emo_audio_prompt != emo_audio_prompt:
-            if self.cache_emo_cond is not None:
-                self.cache_emo_cond = None
-                torch.cuda.empty_cache()
-            emo_audio, _ = self._load_and_cut_audio(emo_audio_prompt,15,verbose,sr=16000)
-            emo_inputs = self.extract_features(emo_audio, sampling_rate=16000, return_tensors="pt")
-            emo_input_features = emo_inputs["input_features"]
-            emo_attention_mask = emo_inputs["attention_mask"]
-            emo_input_features = emo_input_features.to(self.device)
-            emo_attention_mask = emo_attention_mask.to(self.device)
-            emo_cond_emb = self.get_emb(emo_input_features, emo_attention_mask)
-
-            self.cache_emo_cond = emo_cond_emb
-            self.cache_emo_audio_prompt = emo_audio_prompt
-        else:
-            emo_cond_emb = self.cache_emo_cond
+            weight_vector, emovec_mat = self._get_emo_vector_mat(emo_vector, style, use_random, self._seeded_random(seed, text))
+
+        emo_cond_emb = self._get_emo_condition(emo_audio_prompt, verbose)
 
         self._set_gr_progress(0.1, "text processing...")
         text_tokens_list = self.tokenizer.tokenize(text)
@@ -518,7 +718,20 @@ class IndexTTS2:
         num_beams = generation_kwargs.pop("num_beams", 3)
         repetition_penalty = generation_kwargs.pop("repetition_penalty", 10.0)
         max_mel_tokens = generation_kwargs.pop("max_mel_tokens", 1500)
+        # 复用生成时最后一层的隐状态作为 s2mel 的 latent，省去第二次 GPT 前向
+        reuse_gpt_latent = generation_kwargs.pop("reuse_gpt_latent", True)
+        # 时长控制：目标时长（秒），按段规划 mel 帧数与 GPT 的 token 预算
+        target_duration = generation_kwargs.pop("target_duration", None)
+        duration_max_rate = generation_kwargs.pop("duration_max_rate", 2.0)
+        s2mel_kwargs = self._pop_s2mel_kwargs(generation_kwargs)
         sampling_rate = 22050
+        duration_plan = None
+        if target_duration is not None:
+            duration_plan = self._duration_plan([len(sent) for sent in segments], target_duration, max_mel_tokens,
+                                                sampling_rate=sampling_rate, interval_silence=interval_silence,
+                                                duration_max_rate=duration_max_rate)
+            if verbose:
+                print(f">> target duration {target_duration:.2f}s, (mel frames, token budget) per segment:", duration_plan)
 
         wavs = []
         gpt_gen_time = 0
@@ -555,24 +768,35 @@ class IndexTTS2:
                         emovec = emovec_mat + (1 - torch.sum(weight_vector)) * emovec
                         # emovec = emovec_mat
 
-                    codes, speech_conditioning_latent = self.gpt.inference_speech(
-                        spk_cond_emb,
-                        text_tokens,
-                        emo_cond_emb,
-                        cond_lengths=torch.tensor([spk_cond_emb.shape[-1]], device=text_tokens.device),
-                        emo_cond_lengths=torch.tensor([emo_cond_emb.shape[-1]], device=text_tokens.device),
-                        emo_vec=emovec,
-                        do_sample=True,
-                        top_p=top_p,
-                        top_k=top_k,
-                        temperature=temperature,
-                        num_return_sequences=autoregressive_batch_size,
-                        length_penalty=length_penalty,
-                        num_beams=num_beams,
-                        repetition_penalty=repetition_penalty,
-                        max_generate_length=max_mel_tokens,
-                        **generation_kwargs
-                    )
+                    max_generate_length = max_mel_tokens if duration_plan is None else duration_plan[seg_idx][1]
+                    while True:
+                        gpt_outputs = self.gpt.inference_speech(
+                            spk_cond_emb,
+                            text_tokens,
+                            emo_cond_emb,
+                            cond_lengths=torch.tensor([spk_cond_emb.shape[-1]], device=text_tokens.device),
+                            emo_cond_lengths=torch.tensor([emo_cond_emb.shape[-1]], device=text_tokens.device),
+                            emo_vec=emovec,
+                            do_sample=True,
+                            top_p=top_p,
+                            top_k=top_k,
+                            temperature=temperature,
+                            num_return_sequences=autoregressive_batch_size,
+                            length_penalty=length_penalty,
+                            num_beams=num_beams,
+                            repetition_penalty=repetition_penalty,
+                            max_generate_length=max_generate_length,
+                            return_latent=reuse_gpt_latent,
+                            generators=self._seeded_generators(seed, "gpt", [(seg_idx, sent)]),
+                            **generation_kwargs
+                        )
+                        codes, speech_conditioning_latent = gpt_outputs[:2]
+                        if max_generate_length >= max_mel_tokens or (codes[:, -1] == self.stop_mel_token).all():
+                            break
+                        # 时长预算在停止符之前用尽：丢弃会截掉句尾的结果，以完整预算重新生成，由 length regulator 压缩
+                        print(f">> WARN: segment {seg_idx} reached its duration token budget ({max_generate_length}) "
+                              f"before the stop token, regenerating with max_mel_tokens ({max_mel_tokens})")
+                        max_generate_length = max_mel_tokens
 
                 gpt_gen_time += time.perf_counter() - m_start_time
                 if not has_warned and (codes[:, -1] != self.stop_mel_token).any():
@@ -590,51 +814,44 @@ class IndexTTS2:
                 #                     print(f"codes shape: {codes.shape}, codes type: {codes.dtype}")
                 #                     print(f"code len: {code_lens}")
 
-                code_lens = []
-                max_code_len = 0
-                for code in codes:
-                    if self.stop_mel_token not in code:
-                        code_len = len(code)
-                    else:
-                        len_ = (code == self.stop_mel_token).nonzero(as_tuple=False)[0]
-                        code_len = len_[0].item() if len_.numel() > 0 else len(code)
-                    code_lens.append(code_len)
-                    max_code_len = max(max_code_len, code_len)
-                codes = codes[:, :max_code_len]
-                code_lens = torch.LongTensor(code_lens)
-                code_lens = code_lens.to(self.device)
+                codes, code_lens = self._trim_codes(codes)
                 if verbose:
                     print(codes, type(codes))
                     print(f"fix codes shape: {codes.shape}, codes type: {codes.dtype}")
                     print(f"code len: {code_lens}")
 
                 m_start_time = time.perf_counter()
-                use_speed = torch.zeros(spk_cond_emb.size(0)).to(spk_cond_emb.device).long()
-                with torch.amp.autocast(text_tokens.device.type, enabled=self.dtype is not None, dtype=self.dtype):
-                    latent = self.gpt(
-                        speech_conditioning_latent,
-                        text_tokens,
-                        torch.tensor([text_tokens.shape[-1]], device=text_tokens.device),
-                        codes,
-                        torch.tensor([codes.shape[-1]], device=text_tokens.device),
-                        emo_cond_emb,
-                        cond_mel_lengths=torch.tensor([spk_cond_emb.shape[-1]], device=text_tokens.device),
-                        emo_cond_mel_lengths=torch.tensor([emo_cond_emb.shape[-1]], device=text_tokens.device),
-                        emo_vec=emovec,
-                        use_speed=use_speed,
-                    )
-                    gpt_forward_time += time.perf_counter() - m_start_time
+                if reuse_gpt_latent:
+                    latent = gpt_outputs[2][:, :codes.shape[-1]]
+                else:
+                    use_speed = torch.zeros(spk_cond_emb.size(0)).to(spk_cond_emb.device).long()
+                    with torch.amp.autocast(text_tokens.device.type, enabled=self.dtype is not None, dtype=self.dtype):
+                        latent = self.gpt(
+                            speech_conditioning_latent,
+                            text_tokens,
+                            torch.tensor([text_tokens.shape[-1]], device=text_tokens.device),
+                            codes,
+                            torch.tensor([codes.shape[-1]], device=text_tokens.device),
+                            emo_cond_emb,
+                            cond_mel_lengths=torch.tensor([spk_cond_emb.shape[-1]], device=text_tokens.device),
+                            emo_cond_mel_lengths=torch.tensor([emo_cond_emb.shape[-1]], device=text_tokens.device),
+                            emo_vec=emovec,
+                            use_speed=use_speed,
+                        )
+                gpt_forward_time += time.perf_counter() - m_start_time
 
                 dtype = None
                 with torch.amp.autocast(text_tokens.device.type, enabled=dtype is not None, dtype=dtype):
                     m_start_time = time.perf_counter()
-                    diffusion_steps = 25
-                    inference_cfg_rate = 0.7
                     latent = self.s2mel.models['gpt_layer'](latent)
                     S_infer = self.semantic_codec.quantizer.vq2emb(codes.unsqueeze(1))
                     S_infer = S_infer.transpose(1, 2)
                     S_infer = S_infer + latent
-                    target_lengths = (code_lens * 1.72).long()
+                    if duration_plan is None:
+                        target_lengths = (code_lens * self.mel_frames_per_code).long()
+                    else:
+                        target_lengths = torch.LongTensor([duration_plan[seg_idx][0]]).to(code_lens.device)
+                        self._warn_duration_rate(code_lens[0].item(), duration_plan[seg_idx][0])
 
                     cond = self.s2mel.models['length_regulator'](S_infer,
                                                                  ylens=target_lengths,
@@ -644,8 +861,8 @@ class IndexTTS2:
                     vc_target = self.s2mel.models['cfm'].inference(cat_condition,
                                                                    torch.LongTensor([cat_condition.size(1)]).to(
                                                                        cond.device),
-                                                                   ref_mel, style, None, diffusion_steps,
-                                                                   inference_cfg_rate=inference_cfg_rate)
+                                                                   ref_mel, style, None, **s2mel_kwargs,
+                                                                   generators=self._seeded_generators(seed, "cfm", [(seg_idx, sent)]))
                     vc_target = vc_target[:, :, ref_mel.size(-1):]
                     s2mel_time += time.perf_counter() - m_start_time
 
@@ -701,6 +918,406 @@ class IndexTTS2:
             wav_data = wav_data.numpy().T
             yield (sampling_rate, wav_data)
 
+    def bucket_segments(self, segments, bucket_max_size=4) -> List[List[Dict]]:
+        """
+        Segment data bucketing (same as `IndexTTS.bucket_segments`).
+        if ``bucket_max_size=1``, return all segments in one bucket.
+        """
+        outputs: List[Dict] = []
+        for idx, sent in enumerate(segments):
+            outputs.append({"idx": idx, "sent": sent, "len": len(sent)})
+
+        if len(outputs) > bucket_max_size:
+            # split segments into buckets by segment length
+            buckets: List[List[Dict]] = []
+            factor = 1.5
+            last_bucket = None
+            last_bucket_sent_len_median = 0
+
+            for sent in sorted(outputs, key=lambda x: x["len"]):
+                current_sent_len = sent["len"]
+                if current_sent_len == 0:
+                    print(">> skip empty segment")
+                    continue
+                if last_bucket is None \
+                        or current_sent_len >= int(last_bucket_sent_len_median * factor) \
+                        or len(last_bucket) >= bucket_max_size:
+                    # new bucket
+                    buckets.append([sent])
+                    last_bucket = buckets[-1]
+                    last_bucket_sent_len_median = current_sent_len
+                else:
+                    # current bucket can hold more segments
+                    last_bucket.append(sent)  # sorted
+                    mid = len(last_bucket) // 2
+                    last_bucket_sent_len_median = last_bucket[mid]["len"]
+            last_bucket = None
+            # merge all buckets with size 1
+            out_buckets: List[List[Dict]] = []
+            only_ones: List[Dict] = []
+            for b in buckets:
+                if len(b) == 1:
+                    only_ones.append(b[0])
+                else:
+                    out_buckets.append(b)
+            if len(only_ones) > 0:
+                # merge into previous buckets if possible
+                for i in range(len(out_buckets)):
+                    b = out_buckets[i]
+                    if len(b) < bucket_max_size:
+                        b.append(only_ones.pop(0))
+                        if len(only_ones) == 0:
+                            break
+                # combined all remaining sized 1 buckets
+                if len(only_ones) > 0:
+                    out_buckets.extend(
+                        [only_ones[i:i + bucket_max_size] for i in range(0, len(only_ones), bucket_max_size)])
+            return out_buckets
+        return [outputs]
+
+    def pad_tokens_cat(self, tokens: List[torch.Tensor]) -> torch.Tensor:
+        """
+        Right pad [1, N] text tokens with stop_text_token to one [B, max_N] batch,
+        `UnifiedVoice.prepare_gpt_inputs` strips the padding and pads between the conditioning and the text instead.
+        """
+        # [1, N] -> [N,]
+        tokens = [t.squeeze(0) for t in tokens]
+        return pad_sequence(tokens, batch_first=True, padding_value=self.cfg.gpt.stop_text_token)
+
+    def _pop_s2mel_kwargs(self, generation_kwargs):
+        """
+        s2mel CFM settings of a request, popped from the generation kwargs:
+            diffusion_steps (int): number of ODE steps, default 25.
+            inference_cfg_rate (float): classifier-free guidance strength, default 0.7.
+            diffusion_solver (str): euler, heun, midpoint or multistep, default euler.
+            diffusion_schedule (str): uniform, cosine or quadratic time steps, default uniform.
+            cfg_interval (tuple): (t_start, t_end), apply guidance only inside this time interval.
+            cfg_reuse_steps (int): evaluate the unconditional branch every k calls and reuse it in between.
+            cfg_stop_threshold (float): stop guidance once its relative strength falls below this value.
+        Returns:
+            kwargs for `CFM.inference`
+        """
+        return {
+            "n_timesteps": generation_kwargs.pop("diffusion_steps", 25),
+            "inference_cfg_rate": generation_kwargs.pop("inference_cfg_rate", 0.7),
+            "solver": generation_kwargs.pop("diffusion_solver", "euler"),
+            "schedule": generation_kwargs.pop("diffusion_schedule", "uniform"),
+            "cfg_interval": generation_kwargs.pop("cfg_interval", None),
+            "cfg_reuse_steps": generation_kwargs.pop("cfg_reuse_steps", 1),
+            "cfg_stop_threshold": generation_kwargs.pop("cfg_stop_threshold", 0.0),
+        }
+
+    def _s2mel_conditions(self, items, prompt_condition, target_frames=None):
+        """
+        Build the CFM conditions of several segments, zero padded to the longest one.
+        Args:
+            items: list of (codes [1, T], code_lens [1], latent [1, T, D])
+            target_frames: optional list with the planned mel frames of every item (duration control),
+                None entries use `code_lens * mel_frames_per_code`.
+        Returns:
+            cat_condition [B, T_max, C] ([prompt][segment] per row), x_lens [B]
+        """
+        conds = []
+        for i, (codes, code_lens, latent) in enumerate(items):
+            latent = self.s2mel.models['gpt_layer'](latent)
+            S_infer = self.semantic_codec.quantizer.vq2emb(codes.unsqueeze(1))
+            S_infer = S_infer.transpose(1, 2)
+            S_infer = S_infer + latent
+            if target_frames is None or target_frames[i] is None:
+                target_lengths = (code_lens * self.mel_frames_per_code).long()
+            else:
+                target_lengths = torch.LongTensor([target_frames[i]]).to(code_lens.device)
+                self._warn_duration_rate(code_lens[0].item(), target_frames[i])
+
+            cond = self.s2mel.models['length_regulator'](S_infer,
+                                                         ylens=target_lengths,
+                                                         n_quantizers=3,
+                                                         f0=None)[0]
+            conds.append(torch.cat([prompt_condition, cond], dim=1).squeeze(0))
+        x_lens = torch.LongTensor([c.size(0) for c in conds]).to(self.device)
+        return pad_sequence(conds, batch_first=True), x_lens
+
+    def _s2mel_batch(self, items, prompt_condition, ref_mel, style, target_frames=None, **s2mel_kwargs):
+        """
+        Run the s2mel CFM once for several segments of the same speaker.
+        The conditions are zero padded to the longest one and the CFM masks every row with its own length.
+        Args:
+            items: list of (codes [1, T], code_lens [1], latent [1, T, D])
+            target_frames: optional planned mel frames of every item, see `_s2mel_conditions`
+            s2mel_kwargs: CFM settings from `_pop_s2mel_kwargs`
+        Returns:
+            list of mel spectrograms [1, 80, frames], one per item, prompt removed
+        """
+        cat_condition, x_lens = self._s2mel_conditions(items, prompt_condition, target_frames)
+        batch_size = len(items)
+        vc_target = self.s2mel.models['cfm'].inference(cat_condition,
+                                                       x_lens,
+                                                       ref_mel.expand(batch_size, -1, -1),
+                                                       style.expand(batch_size, -1),
+                                                       None, **s2mel_kwargs)
+        return [vc_target[i:i + 1, :, ref_mel.size(-1):x_lens[i]] for i in range(batch_size)]
+
+    def infer_batch(self, spk_audio_prompt, texts, output_paths=None,
+                    emo_audio_prompt=None, emo_alpha=1.0,
+                    emo_vector=None,
+                    use_emo_text=False, emo_text=None, use_random=False, interval_silence=200,
+                    verbose=False, max_text_tokens_per_segment=120, segments_bucket_max_size=4,
+                    target_durations=None, **generation_kwargs):
+        """
+        Batched inference of many texts with the same speaker prompt, e.g. all chunks of a dubbing run.
+        The segments of all texts are bucketed by token length, GPT generation and the s2mel CFM run on
+        padded batches of up to `segments_bucket_max_size` segments, and the audio of every text is
+        reassembled in the original segment order.
+        Args:
+            texts (List[str] | str): texts to synthesize.
+            output_paths (List[str] | None): wav path for every text, if None the audio is returned.
+            segments_bucket_max_size (int): maximum number of segments generated together.
+            target_durations (List[float | None] | None): target length in seconds of every text, see
+                `_duration_plan`. None entries are synthesized at their natural length.
+            seed (int, generation kwarg): makes GPT sampling, CFM noise and the `use_random` emotion selection
+                reproducible. Random streams are derived from the segment position inside its text and the segment
+                tokens, so a text gets the same audio here as from `infer` with the same seed, and different texts
+                get different noise.
+            The other arguments are the same as `infer`, emotion settings apply to every text.
+        Returns:
+            list with one entry per text: its output path, or (sampling_rate, int16 wav data) without output_paths.
+        """
+        print(">> starting batch inference...")
+        self._set_gr_progress(0, "starting inference...")
+        if isinstance(texts, str):
+            texts = [texts]
+        if output_paths is not None and len(output_paths) != len(texts):
+            raise ValueError(f"got {len(output_paths)} output paths for {len(texts)} texts")
+        if target_durations is not None and len(target_durations) != len(texts):
+            raise ValueError(f"got {len(target_durations)} target durations for {len(texts)} texts")
+        if target_durations is not None:
+            for target_duration in target_durations:
+                if target_duration is not None and not target_duration > 0:
+                    raise ValueError(f"target durations must be positive, got {target_duration}")
+
+        # 合成缓存命中的文本不再参与批量生成
+        params = dict(emo_alpha=emo_alpha, emo_vector=emo_vector, use_emo_text=use_emo_text, emo_text=emo_text,
+                      use_random=use_random, interval_silence=interval_silence,
+                      max_text_tokens_per_segment=max_text_tokens_per_segment, **generation_kwargs)
+        keys = [self._synthesis_key(spk_audio_prompt, emo_audio_prompt, text,
+                                    dict(params, target_duration=target_durations[i] if target_durations else None))
+                for i, text in enumerate(texts)]
+        results = [self._cached_synthesis(key) for key in keys]
+        misses = [i for i, result in enumerate(results) if result is None]
+        if misses:
+            generated = self._infer_batch(
+                spk_audio_prompt, [texts[i] for i in misses],
+                emo_audio_prompt, emo_alpha, emo_vector, use_emo_text, emo_text, use_random, interval_silence,
+                verbose, max_text_tokens_per_segment, segments_bucket_max_size,
+                [target_durations[i] for i in misses] if target_durations is not None else None,
+                **generation_kwargs)
+            for i, result in zip(misses, generated):
+                results[i] = result
+                if keys[i] is not None:
+                    self.synthesis_cache.put(keys[i], *result)
+        return [self._synthesis_output(result, output_paths[i] if output_paths is not None else None)
+                for i, result in enumerate(results)]
+
+    def _infer_batch(self, spk_audio_prompt, texts,
+                     emo_audio_prompt, emo_alpha, emo_vector, use_emo_text, emo_text, use_random, interval_silence,
+                     verbose, max_text_tokens_per_segment, segments_bucket_max_size, target_durations,
+                     **generation_kwargs):
+        """Synthesize texts in bucketed batches, returns (sampling_rate, int16 wav data) per text."""
+        start_time = time.perf_counter()
+        # 随机流按 (文本内段序号) 派生，同一种子下批量与逐条推理得到相同的采样
+        seed = generation_kwargs.pop("seed", None)
+
+        if use_emo_text or emo_vector is not None:
+            # same rule as `infer_generator`: vector guidance replaces the emotion reference voice
+            emo_audio_prompt = None
+        if use_emo_text and emo_text is not None:
+            # a shared emotion text only needs to be analysed once
+            emo_vector = self._prepare_emo_vector(emo_text, emo_vector, use_emo_text, emo_text, emo_alpha)
+            emo_vectors = [emo_vector] * len(texts)
+        else:
+            emo_vectors = [self._prepare_emo_vector(text, emo_vector, use_emo_text, None, emo_alpha) for text in texts]
+        if emo_audio_prompt is None:
+            emo_audio_prompt = spk_audio_prompt
+            emo_alpha = 1.0
+
+        spk_cond_emb, style, prompt_condition, ref_mel = self._get_spk_condition(spk_audio_prompt, verbose)
+        emo_cond_emb = self._get_emo_condition(emo_audio_prompt, verbose)
+        cond_lengths = torch.tensor([spk_cond_emb.shape[-1]], device=self.device)
+        emo_cond_lengths = torch.tensor([emo_cond_emb.shape[-1]], device=self.device)
+
+        do_sample = generation_kwargs.pop("do_sample", True)
+        top_p = generation_kwargs.pop("top_p", 0.8)
+        top_k = generation_kwargs.pop("top_k", 30)
+        temperature = generation_kwargs.pop("temperature", 0.8)
+        autoregressive_batch_size = 1
+        length_penalty = generation_kwargs.pop("length_penalty", 0.0)
+        num_beams = generation_kwargs.pop("num_beams", 3)
+        repetition_penalty = generation_kwargs.pop("repetition_penalty", 10.0)
+        max_mel_tokens = generation_kwargs.pop("max_mel_tokens", 1500)
+        # 复用生成时最后一层的隐状态作为 s2mel 的 latent，省去第二次 GPT 前向
+        reuse_gpt_latent = generation_kwargs.pop("reuse_gpt_latent", True)
+        duration_max_rate = generation_kwargs.pop("duration_max_rate", 2.0)
+        sampling_rate = 22050
+        s2mel_kwargs = self._pop_s2mel_kwargs(generation_kwargs)
+
+        with torch.no_grad():
+            with torch.amp.autocast(self.device.split(":")[0], enabled=self.dtype is not None, dtype=self.dtype):
+                base_emovec = self.gpt.merge_emovec(spk_cond_emb, emo_cond_emb, cond_lengths, emo_cond_lengths,
+                                                    alpha=emo_alpha)
+        text_emovecs = []
+        for text, vec in zip(texts, emo_vectors):
+            if vec is None:
+                text_emovecs.append(base_emovec)
+            else:
+                weight_vector, emovec_mat = self._get_emo_vector_mat(vec, style, use_random, self._seeded_random(seed, text))
+                text_emovecs.append(emovec_mat + (1 - torch.sum(weight_vector)) * base_emovec)
+
+        self._set_gr_progress(0.1, "text processing...")
+        segments = []
+        for text_idx, text in enumerate(texts):
+            text_tokens_list = self.tokenizer.tokenize(text)
+            text_token_ids = self.tokenizer.convert_tokens_to_ids(text_tokens_list)
+            if self.tokenizer.unk_token_id in text_token_ids:
+                print(f"  >> Warning: text {text_idx} contains {text_token_ids.count(self.tokenizer.unk_token_id)} unknown tokens (id={self.tokenizer.unk_token_id}):")
+                print( "     Tokens which can't be encoded: ", [t for t, id in zip(text_tokens_list, text_token_ids) if id == self.tokenizer.unk_token_id])
+            text_segments = self.tokenizer.split_segments(text_tokens_list, max_text_tokens_per_segment)
+            if target_durations is not None and target_durations[text_idx] is not None:
+                plan = self._duration_plan([len(sent) for sent in text_segments], target_durations[text_idx],
+                                           max_mel_tokens, sampling_rate=sampling_rate,
+                                           interval_silence=interval_silence, duration_max_rate=duration_max_rate)
+            else:
+                plan = [(None, max_mel_tokens)] * len(text_segments)
+            for seg_pos, (sent, (frames, budget)) in enumerate(zip(text_segments, plan)):
+                segments.append({"text_idx": text_idx, "seg_pos": seg_pos, "sent": sent,
+                                 "target_frames": frames, "max_mel_tokens": budget})
+        buckets = self.bucket_segments([seg["sent"] for seg in segments], bucket_max_size=segments_bucket_max_size)
+        if verbose:
+            print(">> segments count:", len(segments), "bucket sizes:", [len(b) for b in buckets],
+                  "bucket_max_size:", segments_bucket_max_size)
+
+        seg_wavs = {}
+        gpt_gen_time = 0
+        gpt_forward_time = 0
+        s2mel_time = 0
+        bigvgan_time = 0
+        has_warned = False
+        processed_num = 0
+        for bucket in buckets:
+            processed_num += len(bucket)
+            self._set_gr_progress(0.2 + 0.7 * processed_num / len(segments),
+                                  f"speech synthesis {processed_num}/{len(segments)}...")
+            text_tokens = [
+                torch.tensor(self.tokenizer.convert_tokens_to_ids(item["sent"]), dtype=torch.int32, device=self.device).unsqueeze(0)
+                for item in bucket
+            ]
+            batch_text_tokens = self.pad_tokens_cat(text_tokens) if len(text_tokens) > 1 else text_tokens[0]
+            batch_emovec = torch.cat([text_emovecs[segments[item["idx"]]["text_idx"]] for item in bucket], dim=0)
+            # 整个 batch 一起生成，token 预算取桶内最大值
+            bucket_max_mel_tokens = max(segments[item["idx"]]["max_mel_tokens"] for item in bucket)
+            bucket_target_frames = [segments[item["idx"]]["target_frames"] for item in bucket]
+            bucket_seg_streams = [(segments[item["idx"]]["seg_pos"], segments[item["idx"]]["sent"]) for item in bucket]
+
+            m_start_time = time.perf_counter()
+            with torch.no_grad():
+                with torch.amp.autocast(batch_text_tokens.device.type, enabled=self.dtype is not None, dtype=self.dtype):
+                    while True:
+                        gpt_outputs = self.gpt.inference_speech(
+                            spk_cond_emb,
+                            batch_text_tokens,
+                            emo_cond_emb,
+                            cond_lengths=cond_lengths,
+                            emo_cond_lengths=emo_cond_lengths,
+                            emo_vec=batch_emovec,
+                            do_sample=True,
+                            top_p=top_p,
+                            top_k=top_k,
+                            temperature=temperature,
+                            num_return_sequences=autoregressive_batch_size,
+                            length_penalty=length_penalty,
+                            num_beams=num_beams,
+                            repetition_penalty=repetition_penalty,
+                            max_generate_length=bucket_max_mel_tokens,
+                            return_latent=reuse_gpt_latent,
+                            generators=self._seeded_generators(seed, "gpt", bucket_seg_streams),
+                            **generation_kwargs
+                        )
+                        codes, speech_conditioning_latent = gpt_outputs[:2]
+                        if bucket_max_mel_tokens >= max_mel_tokens or (codes[:, -1] == self.stop_mel_token).all():
+                            break
+                        # 时长预算在停止符之前用尽：整个桶以完整预算重新生成，由 length regulator 压缩到目标时长
+                        print(f">> WARN: a segment reached its duration token budget ({bucket_max_mel_tokens}) "
+                              f"before the stop token, regenerating its bucket with max_mel_tokens ({max_mel_tokens})")
+                        bucket_max_mel_tokens = max_mel_tokens
+                gpt_gen_time += time.perf_counter() - m_start_time
+                if not has_warned and bucket_max_mel_tokens == max_mel_tokens and (codes[:, -1] != self.stop_mel_token).any():
+                    warnings.warn(
+                        f"WARN: generation stopped due to exceeding `max_mel_tokens` ({max_mel_tokens}). "
+                        f"Consider reducing `max_text_tokens_per_segment`({max_text_tokens_per_segment}) or increasing `max_mel_tokens`.",
+                        category=RuntimeWarning
+                    )
+                    has_warned = True
+
+                codes, code_lens = self._trim_codes(codes)
+                if verbose:
+                    print(f"fix codes shape: {codes.shape}, code lens: {code_lens}")
+
+                m_start_time = time.perf_counter()
+                items = []
+                use_speed = torch.zeros(spk_cond_emb.size(0)).to(spk_cond_emb.device).long()
+                for i in range(len(bucket)):
+                    item_codes = codes[i:i + 1, :code_lens[i]]
+                    if reuse_gpt_latent:
+                        latent = gpt_outputs[2][i:i + 1, :code_lens[i]]
+                    else:
+                        with torch.amp.autocast(batch_text_tokens.device.type, enabled=self.dtype is not None, dtype=self.dtype):
+                            latent = self.gpt(
+                                speech_conditioning_latent,
+                                text_tokens[i],
+                                torch.tensor([text_tokens[i].shape[-1]], device=self.device),
+                                item_codes,
+                                torch.tensor([item_codes.shape[-1]], device=self.device),
+                                emo_cond_emb,
+                                cond_mel_lengths=cond_lengths,
+                                emo_cond_mel_lengths=emo_cond_lengths,
+                                emo_vec=batch_emovec[i:i + 1],
+                                use_speed=use_speed,
+                            )
+                    items.append((item_codes, code_lens[i:i + 1], latent))
+                gpt_forward_time += time.perf_counter() - m_start_time
+
+                m_start_time = time.perf_counter()
+                mels = self._s2mel_batch(items, prompt_condition, ref_mel, style, bucket_target_frames, **s2mel_kwargs,
+                                         generators=self._seeded_generators(seed, "cfm", bucket_seg_streams))
+                s2mel_time += time.perf_counter() - m_start_time
+
+                m_start_time = time.perf_counter()
+                for item, vc_target in zip(bucket, mels):
+                    wav = self.bigvgan(vc_target.float()).squeeze().unsqueeze(0)
+                    wav = wav.squeeze(1)
+                    wav = torch.clamp(32767 * wav, -32767.0, 32767.0)
+                    seg_wavs[item["idx"]] = wav.cpu()
+                bigvgan_time += time.perf_counter() - m_start_time
+        end_time = time.perf_counter()
+
+        self._set_gr_progress(0.9, "saving audio...")
+        results = []
+        wav_length = 0
+        for text_idx in range(len(texts)):
+            wavs = [seg_wavs[idx] for idx, seg in enumerate(segments) if seg["text_idx"] == text_idx and idx in seg_wavs]
+            wavs = self.insert_interval_silence(wavs, sampling_rate=sampling_rate, interval_silence=interval_silence)
+            wav = torch.cat(wavs, dim=1) if wavs else torch.zeros(1, 0)
+            wav_length += wav.shape[-1] / sampling_rate
+            results.append((sampling_rate, wav.type(torch.int16).numpy().T))
+        print(f">> gpt_gen_time: {gpt_gen_time:.2f} seconds")
+        print(f">> gpt_forward_time: {gpt_forward_time:.2f} seconds")
+        print(f">> s2mel_time: {s2mel_time:.2f} seconds")
+        print(f">> bigvgan_time: {bigvgan_time:.2f} seconds")
+        print(f">> Total inference time: {end_time - start_time:.2f} seconds")
+        print(f">> Generated audio length: {wav_length:.2f} seconds")
+        if wav_length > 0:
+            print(f">> RTF: {(end_time - start_time) / wav_length:.4f}")
+        return results
+
 
 def find_most_similar_cosine(query_vector, matrix):
     query_vector = query_vector.float()
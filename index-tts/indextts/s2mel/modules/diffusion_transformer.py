@@ -1,5 +1,6 @@
 import torch
 from torch import nn
+import torch.nn.functional as F
 import math
 
 from indextts.s2mel.modules.gpt_fast.model import ModelArgs, Transformer
@@ -203,43 +204,67 @@ class DiT(torch.nn.Module):
             class_dropout = True
         if not self.training and mask_content:
             class_dropout = True
+        prepared = self.prepare(prompt_x, x_lens, style, cond, mask_content=class_dropout)
+        return self.forward_step(x, t, prepared)
+
+    def prepare(self, prompt_x, x_lens, style, cond, mask_content=False):
+        """
+        Precompute everything that does not depend on x and t, so an ODE solver can call
+        `forward_step` for every step instead of `forward`.
+        Returns:
+            dict with the projected conditioning part of `cond_x_merge_linear` [B, T, D],
+            the style token (if style_as_token), x_mask [B, 1, T'] and x_mask_expanded [B, 1, T', T']
+        """
         # cond_in_module = self.cond_embedder if self.content_type == 'discrete' else self.cond_projection
         cond_in_module = self.cond_projection
+        T = prompt_x.size(-1)
 
-        B, _, T = x.size()
+        cond = cond_in_module(cond) # cond [2,1863,512]->[2,1863,512]
+        prompt_x = prompt_x.transpose(1, 2) # [2,1863,80]
+        cond_in = torch.cat([prompt_x, cond], dim=-1) # 80+512
+        if self.transformer_style_condition and not self.style_as_token: # True and True
+            cond_in = torch.cat([cond_in, style[:, None, :].repeat(1, T, 1)], dim=-1) # 80+512+192
+        if mask_content: # 80维后全置为0
+            cond_in = cond_in * 0
 
+        # cond_x_merge_linear([x, prompt_x, cond, style]) = x @ W_x + [prompt_x, cond, style] @ W_c + b，
+        # 后一项与扩散步无关，只计算一次
+        weight = self.cond_x_merge_linear.weight
+        prepared = {"cond_in": F.linear(cond_in, weight[:, self.in_channels:], self.cond_x_merge_linear.bias)}
 
+        if self.style_as_token: # False
+            style = self.style_in(style)
+            prepared["style_token"] = torch.zeros_like(style) if mask_content else style
+
+        seq_len = T + self.style_as_token + self.time_as_token
+        x_mask = sequence_mask(x_lens + self.style_as_token + self.time_as_token, max_length=seq_len).to(cond.device).unsqueeze(1) #torch.Size([1, 1, 1863])True
+        prepared["x_mask"] = x_mask
+        prepared["x_mask_expanded"] = x_mask[:, None, :].repeat(1, 1, seq_len, 1) if not self.is_causal else None # torch.Size([1, 1, 1863, 1863]
+        return prepared
+
+    def forward_step(self, x, t, prepared):
+        """
+        One estimator evaluation with conditioning from `prepare`.
+            x (torch.Tensor): current sample, shape: (batch_size, 80, T)
+            t (torch.Tensor): shape: (batch_size)
+        """
         t1 = self.t_embedder(t)  # (N, D) # t1 [2, 512]
-        cond = cond_in_module(cond) # cond [2,1863,512]->[2,1863,512]
 
         x = x.transpose(1, 2) # [2,1863,80]
-        prompt_x = prompt_x.transpose(1, 2) # [2,1863,80]
+        x_in = prepared["cond_in"] + F.linear(x, self.cond_x_merge_linear.weight[:, :self.in_channels])  # (N, T, D) [2, 1863, 512]
 
-        x_in = torch.cat([x, prompt_x, cond], dim=-1) # 80+80+512=672 [2, 1863, 672]
-        
-        if self.transformer_style_condition and not self.style_as_token: # True and True
-            x_in = torch.cat([x_in, style[:, None, :].repeat(1, T, 1)], dim=-1) #[2, 1863, 864]
-            
-        if class_dropout: #False
-            x_in[..., self.in_channels:] = x_in[..., self.in_channels:] * 0 # 80维后全置为0
-            
-        x_in = self.cond_x_merge_linear(x_in)  # (N, T, D) [2, 1863, 512]
-        
         if self.style_as_token: # False
-            style = self.style_in(style)
-            style = torch.zeros_like(style) if class_dropout else style
-            x_in = torch.cat([style.unsqueeze(1), x_in], dim=1)
-            
+            x_in = torch.cat([prepared["style_token"].unsqueeze(1), x_in], dim=1)
+
         if self.time_as_token: # False
             x_in = torch.cat([t1.unsqueeze(1), x_in], dim=1)
-            
-        x_mask = sequence_mask(x_lens + self.style_as_token + self.time_as_token, max_length=x_in.size(1)).to(x.device).unsqueeze(1) #torch.Size([1, 1, 1863])True
+
+        x_mask = prepared["x_mask"]
         input_pos = self.input_pos[:x_in.size(1)]  # (T,) range（0，1863）
-        x_mask_expanded = x_mask[:, None, :].repeat(1, 1, x_in.size(1), 1) if not self.is_causal else None # torch.Size([1, 1, 1863, 1863]
-        x_res = self.transformer(x_in, t1.unsqueeze(1), input_pos, x_mask_expanded) # [2, 1863, 512]
+        x_res = self.transformer(x_in, t1.unsqueeze(1), input_pos, prepared["x_mask_expanded"]) # [2, 1863, 512]
         x_res = x_res[:, 1:] if self.time_as_token else x_res
         x_res = x_res[:, 1:] if self.style_as_token else x_res
-        
+
         if self.long_skip_connection: #True
             x_res = self.skip_linear(torch.cat([x_res, x], dim=-1))
         if self.final_layer_type == 'wavenet':
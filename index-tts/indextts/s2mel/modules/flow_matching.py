@@ -5,8 +5,53 @@ import torch.nn.functional as F
 
 from indextts.s2mel.modules.diffusion_transformer import DiT
 from indextts.s2mel.modules.commons import sequence_mask
+from indextts.s2mel.modules.ode_solvers import get_solver, get_t_span
+
+class CFGSchedule:
+    """
+    Decides per estimator call whether classifier-free guidance evaluates the null branch (batch 2B),
+    reuses the last null prediction, or is skipped (batch B).
+    Args:
+        interval: (t_start, t_end), guidance is only applied for t inside this interval. None: always.
+        reuse_steps: evaluate the null branch once every `reuse_steps` calls and reuse it in between.
+        stop_threshold: turn guidance off for the rest of the solve once the relative guidance
+            ||v_cond - v_null|| / ||v_cond|| falls below this value. 0 disables the check.
+    """
+
+    def __init__(self, interval=None, reuse_steps=1, stop_threshold=0.0):
+        self.interval = interval
+        self.reuse_steps = max(1, int(reuse_steps))
+        self.stop_threshold = stop_threshold
+        self.last_null = None
+        self.calls_since_null = 0
+        self.stopped = False
+        self.null_evals = 0
+
+    @property
+    def is_default(self):
+        return self.interval is None and self.reuse_steps == 1 and not self.stop_threshold
+
+    def mode(self, t):
+        """"full" (evaluate both branches), "reuse" (conditional + cached null) or "off" (conditional only)."""
+        if self.stopped:
+            return "off"
+        if self.interval is not None and not (self.interval[0] <= float(t) <= self.interval[1]):
+            return "off"
+        if self.last_null is None or self.calls_since_null >= self.reuse_steps - 1:
+            return "full"
+        return "reuse"
+
+    def update(self, mode, dphi_dt, cfg_dphi_dt=None):
+        if mode == "full":
+            self.last_null = cfg_dphi_dt
+            self.calls_since_null = 0
+            self.null_evals += 1
+            if self.stop_threshold:
+                guidance = (dphi_dt - cfg_dphi_dt).norm() / dphi_dt.norm().clamp(min=1e-8)
+                self.stopped = guidance.item() < self.stop_threshold
+        elif mode == "reuse":
+            self.calls_since_null += 1
 
-from tqdm import tqdm
 
 class BASECFM(torch.nn.Module, ABC):
     def __init__(
@@ -28,7 +73,9 @@ class BASECFM(torch.nn.Module, ABC):
             self.zero_prompt_speech_token = False
 
     @torch.inference_mode()
-    def inference(self, mu, x_lens, prompt, style, f0, n_timesteps, temperature=1.0, inference_cfg_rate=0.5):
+    def inference(self, mu, x_lens, prompt, style, f0, n_timesteps, temperature=1.0, inference_cfg_rate=0.5,
+                  solver="euler", schedule="uniform", cfg_interval=None, cfg_reuse_steps=1, cfg_stop_threshold=0.0,
+                  generators=None):
         """Forward diffusion
 
         Args:
@@ -43,23 +90,36 @@ class BASECFM(torch.nn.Module, ABC):
             f0: None
             n_timesteps (int): number of diffusion steps
             temperature (float, optional): temperature for scaling noise. Defaults to 1.0.
+            solver (str): ODE solver, one of `ode_solvers.SOLVERS` (euler, heun, midpoint, multistep).
+            schedule (str): time step schedule, one of `ode_solvers.SCHEDULES` (uniform, cosine, quadratic).
+            cfg_interval, cfg_reuse_steps, cfg_stop_threshold: classifier-free guidance schedule, see `CFGSchedule`.
+            generators (list of torch.Generator, optional): one generator per row for reproducible noise. Row i
+                draws noise for its own x_lens[i] frames only, so it gets the same noise alone or in a padded batch.
 
         Returns:
             sample: generated mel-spectrogram
                 shape: (batch_size, 80, mel_timesteps)
         """
         B, T = mu.size(0), mu.size(1)
-        z = torch.randn([B, self.in_channels, T], device=mu.device) * temperature
-        t_span = torch.linspace(0, 1, n_timesteps + 1, device=mu.device)
-        # t_span = t_span + (-1) * (torch.cos(torch.pi / 2 * t_span) - 1 + t_span)
-        return self.solve_euler(z, x_lens, prompt, mu, style, f0, t_span, inference_cfg_rate)
+        if generators is None:
+            z = torch.randn([B, self.in_channels, T], device=mu.device) * temperature
+        else:
+            z = torch.zeros([B, self.in_channels, T], device=mu.device)
+            for i, generator in enumerate(generators):
+                length = int(x_lens[i])
+                z[i, :, :length] = torch.randn([self.in_channels, length], device=mu.device, generator=generator)
+            z = z * temperature
+        t_span = get_t_span(n_timesteps, schedule, device=mu.device)
+        cfg_schedule = CFGSchedule(cfg_interval, cfg_reuse_steps, cfg_stop_threshold)
+        return self.solve(z, x_lens, prompt, mu, style, f0, t_span, inference_cfg_rate, solver=solver,
+                          cfg_schedule=cfg_schedule)
 
-    def solve_euler(self, x, x_lens, prompt, mu, style, f0, t_span, inference_cfg_rate=0.5):
+    def solve(self, x, x_lens, prompt, mu, style, f0, t_span, inference_cfg_rate=0.5, solver="euler", cfg_schedule=None):
         """
-        Fixed euler solver for ODEs.
+        Integrate the flow from noise to mel with the given ODE solver.
         Args:
             x (torch.Tensor): random noise
-            t_span (torch.Tensor): n_timesteps interpolated
+            t_span (torch.Tensor): time steps from 0 to 1
                 shape: (n_timesteps + 1,)
             mu (torch.Tensor): semantic info of reference audio and altered audio
                 shape: (batch_size, mel_timesteps(795+1069), 512)
@@ -69,12 +129,10 @@ class BASECFM(torch.nn.Module, ABC):
                 shape: (batch_size, 80, 795)
             style (torch.Tensor): reference global style
                 shape: (batch_size, 192)
+            solver (str): name of the ODE solver
+            cfg_schedule (CFGSchedule): optional guidance schedule, None applies guidance at every call
         """
-        t, _, _ = t_span[0], t_span[-1], t_span[1] - t_span[0]
-
-        # I am storing this because I can later plot it by putting a debugger here and saving it to a file
-        # Or in future might add like a return_all_steps flag
-        sol = []
+        solve_fn = get_solver(solver)
         # apply prompt
         prompt_len = prompt.size(-1)
         prompt_x = torch.zeros_like(x)
@@ -82,37 +140,68 @@ class BASECFM(torch.nn.Module, ABC):
         x[..., :prompt_len] = 0
         if self.zero_prompt_speech_token:
             mu[..., :prompt_len] = 0
-        for step in tqdm(range(1, len(t_span))):
-            dt = t_span[step] - t_span[step - 1]
-            if inference_cfg_rate > 0:
-                # Stack original and CFG (null) inputs for batched processing
-                stacked_prompt_x = torch.cat([prompt_x, torch.zeros_like(prompt_x)], dim=0)
-                stacked_style = torch.cat([style, torch.zeros_like(style)], dim=0)
-                stacked_mu = torch.cat([mu, torch.zeros_like(mu)], dim=0)
-                stacked_x = torch.cat([x, x], dim=0)
-                stacked_t = torch.cat([t.unsqueeze(0), t.unsqueeze(0)], dim=0)
-
-                # Perform a single forward pass for both original and CFG inputs
-                stacked_dphi_dt = self.estimator(
-                    stacked_x, stacked_prompt_x, x_lens, stacked_t, stacked_style, stacked_mu,
-                )
-
-                # Split the output back into the original and CFG components
-                dphi_dt, cfg_dphi_dt = stacked_dphi_dt.chunk(2, dim=0)
-
-                # Apply CFG formula
-                dphi_dt = (1.0 + inference_cfg_rate) * dphi_dt - inference_cfg_rate * cfg_dphi_dt
-            else:
-                dphi_dt = self.estimator(x, prompt_x, x_lens, t.unsqueeze(0), style, mu)
-
-            x = x + dt * dphi_dt
-            t = t + dt
-            sol.append(x)
-            if step < len(t_span) - 1:
-                dt = t_span[step + 1] - t
+        # 与 x、t 无关的条件（投影、拼接、mask）只计算一次
+        prepared = self.prepare_estimator(prompt_x, x_lens, style, mu, inference_cfg_rate)
+        if cfg_schedule is not None and cfg_schedule.is_default:
+            cfg_schedule = None
+        if cfg_schedule is not None and inference_cfg_rate > 0:
+            # 只算条件分支时使用前一半（条件输入）的 batch
+            batch_size = x.size(0)
+            prepared["cond_only"] = {k: v[:batch_size] if v is not None else None for k, v in prepared.items()}
+
+        def velocity(x, t):
+            return self.estimate(x, t, prepared, inference_cfg_rate, cfg_schedule)
+
+        def project(x):
             x[:, :, :prompt_len] = 0
+            return x
+
+        return solve_fn(velocity, x, t_span, project)
+
+    def solve_euler(self, x, x_lens, prompt, mu, style, f0, t_span, inference_cfg_rate=0.5):
+        """Fixed euler solver for ODEs, see `solve`."""
+        return self.solve(x, x_lens, prompt, mu, style, f0, t_span, inference_cfg_rate, solver="euler")
+
+    def prepare_estimator(self, prompt_x, x_lens, style, mu, inference_cfg_rate=0.5):
+        """
+        Step-invariant estimator inputs. With CFG the conditional and null (zeroed prompt/style/mu) inputs
+        are stacked into one batch of 2B, matching `estimate`.
+        """
+        if inference_cfg_rate > 0:
+            # Stack original and CFG (null) inputs for batched processing
+            prompt_x = torch.cat([prompt_x, torch.zeros_like(prompt_x)], dim=0)
+            style = torch.cat([style, torch.zeros_like(style)], dim=0)
+            mu = torch.cat([mu, torch.zeros_like(mu)], dim=0)
+            x_lens = torch.cat([x_lens, x_lens], dim=0)
+        return self.estimator.prepare(prompt_x, x_lens, style, mu)
+
+    def estimate(self, x, t, prepared, inference_cfg_rate=0.5, cfg_schedule=None):
+        """Velocity dphi/dt at (x, t), with classifier-free guidance if inference_cfg_rate > 0."""
+        if inference_cfg_rate > 0 and cfg_schedule is not None:
+            mode = cfg_schedule.mode(t)
+            if mode != "full":
+                dphi_dt = self.estimator.forward_step(x, t.unsqueeze(0).expand(x.size(0)), prepared["cond_only"])
+                cfg_schedule.update(mode, dphi_dt)
+                if mode == "off":
+                    return dphi_dt
+                return (1.0 + inference_cfg_rate) * dphi_dt - inference_cfg_rate * cfg_schedule.last_null
+        if inference_cfg_rate > 0:
+            stacked_x = torch.cat([x, x], dim=0)
+            stacked_t = t.unsqueeze(0).expand(stacked_x.size(0))
+
+            # Perform a single forward pass for both original and CFG inputs
+            stacked_dphi_dt = self.estimator.forward_step(stacked_x, stacked_t, prepared)
+
+            # Split the output back into the original and CFG components
+            dphi_dt, cfg_dphi_dt = stacked_dphi_dt.chunk(2, dim=0)
+
+            if cfg_schedule is not None:
+                cfg_schedule.update("full", dphi_dt, cfg_dphi_dt)
+
+            # Apply CFG formula
+            return (1.0 + inference_cfg_rate) * dphi_dt - inference_cfg_rate * cfg_dphi_dt
+        return self.estimator.forward_step(x, t.unsqueeze(0).expand(x.size(0)), prepared)
 
-        return sol[-1]
     def forward(self, x1, x_lens, prompt_lens, mu, style):
         """Computes diffusion loss
 
@@ -179,6 +268,12 @@ class CFM(BASECFM):
         """
         if torch.distributed.is_initialized():
             torch._inductor.config.reorder_for_compute_comm_overlap = True
+        # the solvers call `forward_step` with precomputed conditioning, compile it as well
+        self.estimator.forward_step = torch.compile(
+            self.estimator.forward_step,
+            fullgraph=True,
+            dynamic=True,
+        )
         self.estimator = torch.compile(
             self.estimator, 
             fullgraph=True,
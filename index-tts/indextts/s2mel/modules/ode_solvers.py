@@ -0,0 +1,106 @@
+"""
+ODE solvers and time schedules for flow-matching (CFM) inference.
+
+A solver integrates dx/dt = velocity(x, t) from t_span[0] (noise) to t_span[-1] (mel) and calls
+`project(x)` after every update (the CFM keeps the prompt region at zero). Only the current state and,
+for multistep solvers, the previous velocity are kept, so memory does not grow with the number of steps.
+"""
+
+import torch
+from tqdm import tqdm
+
+
+def uniform_schedule(n_steps, device=None):
+    return torch.linspace(0, 1, n_steps + 1, device=device)
+
+
+def cosine_schedule(n_steps, device=None):
+    # t = 1 - cos(pi/2 * t)：前期步长小、后期步长大（原 solve_euler 中注释掉的 warp）
+    t = torch.linspace(0, 1, n_steps + 1, device=device)
+    return 1 - torch.cos(torch.pi / 2 * t)
+
+
+def quadratic_schedule(n_steps, device=None):
+    # 前期步长大、后期步长小，细节在 t 接近 1 时成形
+    t = torch.linspace(0, 1, n_steps + 1, device=device)
+    return 1 - (1 - t) ** 2
+
+
+SCHEDULES = {
+    "uniform": uniform_schedule,
+    "cosine": cosine_schedule,
+    "quadratic": quadratic_schedule,
+}
+
+
+def euler_solver(velocity, x, t_span, project, progress=True):
+    """First order, one velocity evaluation per step."""
+    for step in tqdm(range(1, len(t_span)), disable=not progress):
+        t, dt = t_span[step - 1], t_span[step] - t_span[step - 1]
+        x = project(x + dt * velocity(x, t))
+    return x
+
+
+def heun_solver(velocity, x, t_span, project, progress=True):
+    """Second order (trapezoidal predictor-corrector), two evaluations per step."""
+    for step in tqdm(range(1, len(t_span)), disable=not progress):
+        t, dt = t_span[step - 1], t_span[step] - t_span[step - 1]
+        v = velocity(x, t)
+        x_pred = project(x + dt * v)
+        x = project(x + dt * 0.5 * (v + velocity(x_pred, t + dt)))
+    return x
+
+
+def midpoint_solver(velocity, x, t_span, project, progress=True):
+    """Second order explicit midpoint, two evaluations per step."""
+    for step in tqdm(range(1, len(t_span)), disable=not progress):
+        t, dt = t_span[step - 1], t_span[step] - t_span[step - 1]
+        x_mid = project(x + 0.5 * dt * velocity(x, t))
+        x = project(x + dt * velocity(x_mid, t + 0.5 * dt))
+    return x
+
+
+def multistep_solver(velocity, x, t_span, project, progress=True):
+    """
+    Second order multistep (DPM-Solver++(2M) style): one evaluation per step, the previous velocity is
+    reused for the second order term (variable step Adams-Bashforth). The first step is Euler.
+    """
+    v_prev, dt_prev = None, None
+    for step in tqdm(range(1, len(t_span)), disable=not progress):
+        t, dt = t_span[step - 1], t_span[step] - t_span[step - 1]
+        v = velocity(x, t)
+        if v_prev is None:
+            x = project(x + dt * v)
+        else:
+            r = dt / dt_prev
+            x = project(x + dt * ((1 + 0.5 * r) * v - 0.5 * r * v_prev))
+        v_prev, dt_prev = v, dt
+    return x
+
+
+SOLVERS = {
+    "euler": euler_solver,
+    "heun": heun_solver,
+    "midpoint": midpoint_solver,
+    "multistep": multistep_solver,
+}
+
+# estimator evaluations per step, used to compare solvers at equal cost
+SOLVER_NFE_PER_STEP = {
+    "euler": 1,
+    "heun": 2,
+    "midpoint": 2,
+    "multistep": 1,
+}
+
+
+def get_solver(name):
+    if name not in SOLVERS:
+        raise ValueError(f"unknown ODE solver {name!r}, expected one of {sorted(SOLVERS)}")
+    return SOLVERS[name]
+
+
+def get_t_span(n_steps, schedule="uniform", device=None):
+    if schedule not in SCHEDULES:
+        raise ValueError(f"unknown time schedule {schedule!r}, expected one of {sorted(SCHEDULES)}")
+    return SCHEDULES[schedule](n_steps, device=device)
@@ -0,0 +1,99 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+import torch
+
+
+def _nbytes(value):
+    if isinstance(value, torch.Tensor):
+        return value.element_size() * value.nelement()
+    if isinstance(value, (tuple, list)):
+        return sum(_nbytes(v) for v in value)
+    if isinstance(value, dict):
+        return sum(_nbytes(v) for v in value.values())
+    return 0
+
+
+class ConditioningCache:
+    """
+    LRU cache of reference-audio conditioning bundles (speaker / emotion embeddings, style, prompt mel ...).
+
+    Entries are keyed by the *content* of the prompt audio, so the same voice under another path still hits,
+    and a file replaced in place misses. The cache is bounded by the total tensor bytes it holds;
+    the least recently used bundles are dropped first.
+    """
+
+    def __init__(self, max_bytes=512 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.bytes = 0
+        self._entries = OrderedDict()  # key -> (value, nbytes)
+        self._digests = {}  # (path, size, mtime_ns) -> content digest
+        self._lock = threading.Lock()
+
+    def audio_key(self, kind, audio_path, *extra):
+        """
+        Build a cache key from the sha256 of the audio file content.
+        `kind` separates bundle types (e.g. "spk", "emo"), `extra` holds any preprocessing parameters.
+        """
+        stat = os.stat(audio_path)
+        file_id = (os.path.abspath(audio_path), stat.st_size, stat.st_mtime_ns)
+        digest = self._digests.get(file_id)
+        if digest is None:
+            sha = hashlib.sha256()
+            with open(audio_path, "rb") as f:
+                for block in iter(lambda: f.read(1 << 20), b""):
+                    sha.update(block)
+            digest = sha.hexdigest()
+            self._digests[file_id] = digest
+        return (kind, digest) + tuple(extra)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value):
+        nbytes = _nbytes(value)
+        with self._lock:
+            if key in self._entries:
+                self.bytes -= self._entries.pop(key)[1]
+            if nbytes > self.max_bytes:
+                # 单个条目超过预算，不缓存
+                return value
+            self._entries[key] = (value, nbytes)
+            self.bytes += nbytes
+            while self.bytes > self.max_bytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self.bytes -= evicted
+                self.evictions += 1
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+    def __len__(self):
+        return len(self._entries)
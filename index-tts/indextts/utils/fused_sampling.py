@@ -0,0 +1,121 @@
+import torch
+from transformers import LogitsProcessor
+
+from indextts.gpt.transformers_generation_utils import _multinomial
+
+
+class FusedSampler:
+    """
+    Repetition penalty, temperature, top-k and top-p applied together to a batch of logits, then token selection.
+
+    Gives the result of the HF chain RepetitionPenaltyLogitsProcessor -> TemperatureLogitsWarper -> TopKLogitsWarper
+    -> TopPLogitsWarper (same order, same float32 arithmetic), but:
+    - the penalty is one masked update over a (b, vocab) `seen` mask instead of a gather / scatter per call;
+    - top-k and top-p share a single `torch.topk`: top-p only needs the cumulative mass of the top-k survivors,
+      so the full-vocabulary sort of TopPLogitsWarper becomes a k-element softmax / cumsum, and both filters
+      end in one threshold compare per row;
+    - the float32 scores, the seen mask and the filter mask are buffers reused across decode steps.
+    """
+
+    def __init__(self):
+        self._buffers = {}
+
+    def buffer(self, name, shape, dtype, device):
+        """A persistent buffer, reallocated only when the batch shape, dtype or device changes."""
+        buf = self._buffers.get(name)
+        if buf is None or buf.shape != shape or buf.dtype != dtype or buf.device != device:
+            buf = self._buffers[name] = torch.empty(shape, dtype=dtype, device=device)
+        return buf
+
+    def seen_mask(self, input_ids, vocab_size):
+        """(b, vocab) bool mask of the tokens in input_ids, the tokens the HF repetition penalty gathers."""
+        seen = self.buffer("seen", (input_ids.shape[0], vocab_size), torch.bool, input_ids.device)
+        seen.zero_()
+        return seen.scatter_(1, input_ids, True)
+
+    def process(self, logits, seen=None, temperature=1.0, top_k=0, top_p=1.0, repetition_penalty=1.0,
+                min_tokens_to_keep=1, warp=True, out=None):
+        """
+        Args:
+            logits: (b, vocab)
+            seen: (b, vocab) bool, the tokens the repetition penalty applies to
+            temperature: float, or (b,) tensor of per-row temperatures
+            min_tokens_to_keep: as the HF warpers, 2 for beam search
+            warp: apply temperature / top-k / top-p (HF only runs them when sampling)
+            out: float32 tensor to process in place (may be logits itself), defaults to a reused buffer
+        Returns:
+            float32 (b, vocab) scores with the filtered tokens at -inf. Without `out` it is the reused buffer,
+            overwritten by the next call.
+        """
+        if out is None:
+            out = self.buffer("scores", logits.shape, torch.float32, logits.device)
+        if out is not logits:
+            out.copy_(logits)
+        scores = out
+        if seen is not None and repetition_penalty != 1.0:
+            penalized = torch.where(scores < 0, scores * repetition_penalty, scores / repetition_penalty)
+            torch.where(seen, penalized, scores, out=scores)
+        if not warp:
+            return scores
+        if isinstance(temperature, torch.Tensor):
+            scores.div_(temperature.to(scores.dtype).unsqueeze(dim=1))
+        elif temperature != 1.0:
+            scores.div_(temperature)
+
+        vocab_size = scores.shape[-1]
+        top_k = min(max(top_k, min_tokens_to_keep), vocab_size) if top_k else 0
+        if not top_k and top_p >= 1.0:
+            return scores
+        # 降序的前 k 个值（只有 top-p 时为整个词表）
+        values = torch.topk(scores, top_k or vocab_size, dim=-1).values
+        k = values.shape[-1]
+        if top_p < 1.0:
+            # HF 按升序累加概率并移除累计质量 <= 1 - top_p 的前缀；top-k 之外的概率为 0，只需在幸存者上计算
+            cumulative = values.flip(-1).softmax(dim=-1).cumsum(dim=-1)
+            removed = cumulative <= 1 - top_p
+            removed[:, k - min_tokens_to_keep:] = False
+            index = k - 1 - removed.sum(dim=-1, keepdim=True)
+            threshold = values.gather(1, index)
+        else:
+            threshold = values[:, -1:]
+        filtered = self.buffer("filtered", scores.shape, torch.bool, scores.device)
+        torch.lt(scores, threshold, out=filtered)
+        return scores.masked_fill_(filtered, -float("inf"))
+
+    def __call__(self, logits, seen=None, do_sample=True, temperature=1.0, top_k=0, top_p=1.0, repetition_penalty=1.0,
+                 generators=None, noise=None):
+        """
+        Next token of every row: argmax of the penalized logits without do_sample, otherwise a draw from the
+        processed distribution, by torch.multinomial (row i from generators[i] if given) or, with Exp(1) `noise`
+        (see `accel_engine.Sampler.noise`), as argmax(p / noise).
+        """
+        scores = self.process(logits, seen, temperature, top_k, top_p, repetition_penalty, warp=do_sample)
+        if not do_sample:
+            return scores.argmax(dim=-1)
+        probs = scores.softmax(dim=-1)
+        if noise is not None:
+            return probs.div_(noise.clamp_min_(1e-10)).argmax(dim=-1)
+        return _multinomial(probs, 1, generators).squeeze(1)
+
+
+class FusedLogitsProcessor(LogitsProcessor):
+    """
+    `FusedSampler.process` as a HF logits processor, for the generate paths that keep HF token selection
+    (beam search). It replaces the repetition penalty and the temperature / top-k / top-p warpers, which must
+    then be disabled in the generate kwargs. The scores are processed in place.
+    """
+
+    def __init__(self, temperature=1.0, top_k=0, top_p=1.0, repetition_penalty=1.0, min_tokens_to_keep=1):
+        self.temperature = temperature
+        self.top_k = top_k
+        self.top_p = top_p
+        self.repetition_penalty = repetition_penalty
+        self.min_tokens_to_keep = min_tokens_to_keep
+        self.sampler = FusedSampler()
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor) -> torch.FloatTensor:
+        seen = None
+        if self.repetition_penalty != 1.0:
+            seen = self.sampler.seen_mask(input_ids, scores.shape[-1])
+        return self.sampler.process(scores, seen, self.temperature, self.top_k, self.top_p, self.repetition_penalty,
+                                    min_tokens_to_keep=self.min_tokens_to_keep, out=scores)
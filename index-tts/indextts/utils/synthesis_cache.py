@@ -0,0 +1,154 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+
+import numpy as np
+
+# 存储格式变化时递增，旧条目自动失效
+SYNTHESIS_CACHE_VERSION = 1
+_SUFFIX = ".npz"
+
+
+class SynthesisCache:
+    """
+    Content-addressed on-disk cache of synthesized audio.
+
+    Keys are the sha256 of the voice prompt digests, the normalized text and every generation parameter
+    (including the seed), so a byte-identical request returns the stored waveform instead of running the
+    GPT / s2mel / vocoder stack again. Entries are `<dir>/<key[:2]>/<key>.npz` files holding the sample rate
+    and the int16 samples; they are written to a temp file and moved into place with `os.replace`, so several
+    processes can share one directory and a reader never sees a partial entry.
+
+    The directory is bounded by `max_bytes`: entries are touched on every hit, and when a write pushes the
+    total over the budget the least recently used files (oldest mtime) are deleted.
+    """
+
+    def __init__(self, cache_dir, max_bytes=1024 * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+        # 启动时统计一次目录大小，之后增量维护（其他进程的写入在下次淘汰扫描时计入）
+        self.bytes = sum(size for _, _, size in self._scan())
+
+    @staticmethod
+    def key(voice_digests, text, params):
+        """
+        Build the cache key of a request.
+        Args:
+            voice_digests: content digests of the speaker / emotion prompts (None for an unused prompt).
+            text: the text as the model sees it, after normalization.
+            params: JSON-serializable generation parameters, seed included.
+        """
+        payload = json.dumps([SYNTHESIS_CACHE_VERSION, list(voice_digests), text, params],
+                             sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key + _SUFFIX)
+
+    def get(self, key):
+        """Return (sampling_rate, int16 samples shaped (frames, channels)) for key, or None."""
+        path = self._path(key)
+        try:
+            with np.load(path) as data:
+                entry = int(data["sr"]), data["wav"]
+            # 更新访问时间，供 LRU 淘汰使用
+            os.utime(path)
+        except (OSError, ValueError, KeyError):
+            # 不存在、已被其他进程淘汰或文件损坏，都按未命中处理
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return entry
+
+    def put(self, key, sampling_rate, wav):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.savez(f, sr=np.int64(sampling_rate), wav=np.asarray(wav, dtype=np.int16))
+            nbytes = os.path.getsize(tmp_path)
+            if nbytes > self.max_bytes:
+                # 单个条目超过预算，不缓存
+                os.remove(tmp_path)
+                return
+            # 覆盖已有条目时只计入大小差值
+            try:
+                old_nbytes = os.path.getsize(path)
+            except OSError:
+                old_nbytes = 0
+            # 并发写入同一个 key 时内容相同，最后一次 replace 生效即可
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f">> WARN: failed to store synthesis cache entry {key[:12]}: {e}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return
+        with self._lock:
+            self.bytes += nbytes - old_nbytes
+            over_budget = self.bytes > self.max_bytes
+        if over_budget:
+            self._evict()
+
+    def _scan(self):
+        """(mtime, path, size) of every entry in the directory."""
+        entries = []
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if not name.endswith(_SUFFIX):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, path, stat.st_size))
+        return entries
+
+    def _evict(self):
+        with self._lock:
+            entries = sorted(self._scan())
+            total = sum(size for _, _, size in entries)
+            for _, path, size in entries:
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                    self.evictions += 1
+                except OSError:
+                    # 其他进程已删除
+                    pass
+                total -= size
+            self.bytes = total
+
+    def clear(self):
+        with self._lock:
+            for _, path, _ in self._scan():
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            self.bytes = 0
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+    def __len__(self):
+        return len(self._scan())
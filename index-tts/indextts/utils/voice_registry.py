@@ -0,0 +1,100 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+
+import safetensors.torch
+
+VOICE_ID_PREFIX = "voice:"
+# 注册文件中保存的条件张量（与 IndexTTS2._get_spk_condition / _get_emo_condition 的输出一致）
+SPK_TENSORS = ("spk_cond_emb", "style", "prompt_condition", "ref_mel")
+EMO_TENSORS = ("emo_cond_emb",)
+
+
+def is_voice_id(value):
+    return isinstance(value, str) and value.startswith(VOICE_ID_PREFIX)
+
+
+class VoiceRegistry:
+    """
+    On-disk registry of precomputed reference-audio conditioning.
+
+    Every voice is one safetensors file (`<dir>/<hash>.safetensors`) holding the speaker and emotion
+    conditioning tensors on CPU. safetensors files are memory-mapped on load, so warming a registered
+    voice after a restart costs a file read instead of the w2v-bert / codec / CAMPPlus front-end.
+    `index.json` keeps the voice names and source audio of every registered ID.
+    """
+
+    def __init__(self, voice_dir):
+        self.voice_dir = voice_dir
+        self._lock = threading.Lock()
+
+    @property
+    def index_path(self):
+        return os.path.join(self.voice_dir, "index.json")
+
+    def _voice_path(self, voice_id):
+        if not is_voice_id(voice_id):
+            raise ValueError(f"not a voice id: {voice_id!r}")
+        return os.path.join(self.voice_dir, voice_id[len(VOICE_ID_PREFIX):] + ".safetensors")
+
+    def _load_index(self):
+        if not os.path.exists(self.index_path):
+            return {}
+        with open(self.index_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def _write_index(self, index):
+        fd, tmp_path = tempfile.mkstemp(dir=self.voice_dir, suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(index, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.index_path)
+
+    @staticmethod
+    def voice_id_for(audio_path):
+        """Voice IDs are derived from the prompt audio content, registering the same audio twice is a no-op."""
+        sha = hashlib.sha256()
+        with open(audio_path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                sha.update(block)
+        return VOICE_ID_PREFIX + sha.hexdigest()[:16]
+
+    def exists(self, voice_id):
+        return is_voice_id(voice_id) and os.path.exists(self._voice_path(voice_id))
+
+    def save(self, voice_id, tensors, name=None, source=None):
+        os.makedirs(self.voice_dir, exist_ok=True)
+        tensors = {k: v.detach().cpu().contiguous() for k, v in tensors.items()}
+        path = self._voice_path(voice_id)
+        fd, tmp_path = tempfile.mkstemp(dir=self.voice_dir, suffix=".tmp")
+        os.close(fd)
+        safetensors.torch.save_file(tensors, tmp_path, metadata={"voice_id": voice_id})
+        os.replace(tmp_path, path)
+        with self._lock:
+            index = self._load_index()
+            index[voice_id] = {
+                "name": name or os.path.splitext(os.path.basename(source or voice_id))[0],
+                "source": source,
+                "created_at": time.time(),
+            }
+            self._write_index(index)
+        return voice_id
+
+    def load(self, voice_id, device="cpu"):
+        """Return {tensor name: tensor} of a registered voice, raises KeyError for unknown IDs."""
+        if not self.exists(voice_id):
+            raise KeyError(f"voice {voice_id} is not registered in {self.voice_dir}")
+        return safetensors.torch.load_file(self._voice_path(voice_id), device=device)
+
+    def remove(self, voice_id):
+        if self.exists(voice_id):
+            os.remove(self._voice_path(voice_id))
+        with self._lock:
+            index = self._load_index()
+            if index.pop(voice_id, None) is not None:
+                self._write_index(index)
+
+    def list(self):
+        return self._load_index()
@@ -0,0 +1,65 @@
+from indextts.infer_v2 import IndexTTS2
+
+if __name__ == "__main__":
+    """
+    Test duration-targeted synthesis of a dense text into a short slot: the GPT token budget of the target may
+    stop generation early, but then the segment must be regenerated with max_mel_tokens, so every segment that
+    reaches the length regulator ends in its stop token and no speech is cut. The output must still last the
+    target duration.
+    ```
+    python tests/duration_test.py checkpoints
+    ```
+    """
+    import sys
+    sys.path.append("..")
+    if len(sys.argv) > 1:
+        model_dir = sys.argv[1]
+    else:
+        model_dir = "checkpoints"
+    audio_prompt = "tests/sample_prompt.wav"
+    tts = IndexTTS2(cfg_path=f"{model_dir}/config.yaml", model_dir=model_dir, use_fp16=False, use_cuda_kernel=False)
+    text = ("Joseph Gordon-Levitt is an American actor, he was born in Los Angeles and started acting as a child "
+            "in commercials and television shows before moving on to films such as Inception and Looper.")
+    target_duration = 1.5
+    max_mel_tokens = 1500
+    sampling_rate = 22050
+    failed = []
+
+    # 记录每次 GPT 生成的预算与 codes
+    calls = []
+    inference_speech = tts.gpt.inference_speech
+
+    def recording_inference_speech(*args, **kwargs):
+        outputs = inference_speech(*args, **kwargs)
+        calls.append((kwargs["max_generate_length"], outputs[0]))
+        return outputs
+
+    tts.gpt.inference_speech = recording_inference_speech
+
+    def check(name, result):
+        """Every generation that ran out of budget before its stop token must be followed by a full-budget one."""
+        finished = [bool((codes[:, -1] == tts.stop_mel_token).all()) for _, codes in calls]
+        regenerated = sum(not done for done in finished)
+        cut = [
+            i for i, ((budget, _), done) in enumerate(zip(calls, finished))
+            if not done and (budget >= max_mel_tokens or i + 1 == len(calls) or calls[i + 1][0] < max_mel_tokens)
+        ]
+        duration = len(result[1]) / result[0]
+        print(f"{name}: {len(calls)} generations, {regenerated} regenerated, cut {cut}, "
+              f"duration {duration:.3f}s (target {target_duration}s)")
+        if not regenerated:
+            failed.append(f"{name}: the budget never stopped generation, the test text is not dense enough")
+        if cut:
+            failed.append(f"{name}: codes cut")
+        if abs(duration - target_duration) > 0.05:
+            failed.append(f"{name}: duration")
+        calls.clear()
+
+    check("infer", tts.infer(audio_prompt, text, None, target_duration=target_duration, max_mel_tokens=max_mel_tokens))
+    check("infer_batch", tts.infer_batch(audio_prompt, [text], target_durations=[target_duration],
+                                         max_mel_tokens=max_mel_tokens)[0])
+    print("--" * 10)
+    if failed:
+        print("failed:", failed)
+        sys.exit(1)
+    print("all passed")
@@ -0,0 +1,65 @@
+import torch
+from indextts.infer_v2 import IndexTTS2
+
+if __name__ == "__main__":
+    """
+    Test that the latent collected during generation (`inference_speech(..., return_latent=True)`)
+    matches the latent of the second GPT forward pass over the generated codes.
+    ```
+    python tests/gpt_latent_test.py checkpoints
+    ```
+    """
+    import transformers
+    transformers.set_seed(42)
+    import sys
+    sys.path.append("..")
+    if len(sys.argv) > 1:
+        model_dir = sys.argv[1]
+    else:
+        model_dir = "checkpoints"
+    audio_prompt = "tests/sample_prompt.wav"
+    tts = IndexTTS2(cfg_path=f"{model_dir}/config.yaml", model_dir=model_dir, use_fp16=False, use_cuda_kernel=False)
+    text = "There is a vehicle arriving in dock number 7?"
+    text_tokens = tts.tokenizer.encode(text)
+    text_tokens = torch.tensor(text_tokens, dtype=torch.int32, device=tts.device).unsqueeze(0)  # [1, L]
+
+    spk_cond_emb, style, prompt_condition, ref_mel = tts._get_spk_condition(audio_prompt)
+    emo_cond_emb = tts._get_emo_condition(audio_prompt)
+    cond_lengths = torch.tensor([spk_cond_emb.shape[-1]], device=tts.device)
+    emo_cond_lengths = torch.tensor([emo_cond_emb.shape[-1]], device=tts.device)
+    atol = 1e-3
+    failed = []
+    with torch.no_grad():
+        emovec = tts.gpt.merge_emovec(spk_cond_emb, emo_cond_emb, cond_lengths, emo_cond_lengths)
+        for name, kwargs in [
+            ("greedy", {"do_sample": False, "num_beams": 1}),
+            ("sampling", {"do_sample": True, "top_p": 0.8, "top_k": 30, "temperature": 0.8, "num_beams": 1}),
+            ("beam search", {"do_sample": True, "top_p": 0.8, "top_k": 30, "temperature": 0.8, "num_beams": 3}),
+        ]:
+            codes, speech_conditioning_latent, latent = tts.gpt.inference_speech(
+                spk_cond_emb, text_tokens, emo_cond_emb,
+                cond_lengths=cond_lengths, emo_cond_lengths=emo_cond_lengths, emo_vec=emovec,
+                repetition_penalty=10.0, length_penalty=0.0, max_generate_length=300,
+                return_latent=True, **kwargs,
+            )
+            codes, code_lens = tts._trim_codes(codes)
+            latent = latent[:, :codes.shape[-1]]
+            # two-pass baseline: full GPT forward over the generated codes
+            baseline = tts.gpt(
+                speech_conditioning_latent, text_tokens,
+                torch.tensor([text_tokens.shape[-1]], device=tts.device),
+                codes, torch.tensor([codes.shape[-1]], device=tts.device),
+                emo_cond_emb,
+                cond_mel_lengths=cond_lengths, emo_cond_mel_lengths=emo_cond_lengths,
+                emo_vec=emovec,
+                use_speed=torch.zeros(1, device=tts.device).long(),
+            )
+            max_diff = (latent.float() - baseline.float()).abs().max().item()
+            print(f"{name}: codes {tuple(codes.shape)}, latent {tuple(latent.shape)} vs {tuple(baseline.shape)}, max abs diff {max_diff:.2e}")
+            if latent.shape != baseline.shape or max_diff > atol:
+                failed.append(name)
+    print("--" * 10)
+    if failed:
+        print("mismatch:", failed)
+        sys.exit(1)
+    print("all matched")
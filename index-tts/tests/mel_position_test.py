@@ -0,0 +1,69 @@
+import torch
+import torch.nn as nn
+from transformers import GPT2Config
+
+from indextts.gpt.model_v2 import GPT2InferenceModel, build_hf_gpt_transformer
+
+if __name__ == "__main__":
+    """
+    Test the mel position embedding of the `GPT2InferenceModel` decode step against `UnifiedVoice.forward`:
+    the codes [start_mel, c1, ..., ck] sit at mel positions 0..k there (`mel_pos_embedding(mel_codes)`), so the
+    logits of every KV-cached decode step must equal those of one full GPT pass over the same sequence.
+    A small randomly initialized GPT is used, no checkpoints are needed.
+    ```
+    python tests/mel_position_test.py
+    ```
+    """
+    import sys
+    sys.path.append("..")
+    torch.manual_seed(0)
+    layers, dim, heads, vocab = 2, 64, 4, 100
+    start_token = vocab - 2
+    gpt, mel_pos_embedding, _, _, _ = build_hf_gpt_transformer(layers, dim, heads, 256, 128, False)
+    mel_embedding = nn.Embedding(vocab, dim)
+    final_norm = nn.LayerNorm(dim)
+    mel_head = nn.Linear(dim, vocab)
+    config = GPT2Config(vocab_size=vocab, n_positions=384, n_ctx=384, n_embd=dim, n_layer=layers, n_head=heads)
+    inference_model = GPT2InferenceModel(config, gpt, mel_pos_embedding, mel_embedding, final_norm, mel_head,
+                                         kv_cache=True).eval()
+    gpt.wte = mel_embedding
+    steps = 12
+    atol = 1e-4
+    failed = []
+
+    def reference_logits(inputs_embeds, mel_codes):
+        """Logits after every mel code, positioned as in UnifiedVoice.forward."""
+        mel_emb = mel_embedding(mel_codes) + mel_pos_embedding(mel_codes)
+        hidden = gpt(inputs_embeds=torch.cat([inputs_embeds, mel_emb], dim=1), return_dict=True).last_hidden_state
+        return mel_head(final_norm(hidden[:, inputs_embeds.shape[1]:]))
+
+    with torch.no_grad():
+        for rows, s in [(1, 17), (3, 9)]:
+            # [条件 + 文本] 的嵌入，与 inference_speech 存入 cached_mel_emb 的内容对应
+            inputs_embeds = torch.randn(rows, s, dim)
+            codes = torch.randint(0, vocab - 2, (rows, steps))
+            mel_codes = torch.cat([torch.full((rows, 1), start_token), codes], dim=1)
+            expected = reference_logits(inputs_embeds, mel_codes)
+
+            inference_model.store_mel_emb(inputs_embeds)
+            input_ids = torch.ones(rows, s + 1, dtype=torch.long)
+            input_ids[:, -1] = start_token
+            attention_mask = torch.ones(rows, s + 1, dtype=torch.long)
+            outputs = inference_model(input_ids, attention_mask=attention_mask, use_cache=True, return_dict=True)
+            logits = [outputs.logits[:, -1]]
+            for step in range(steps):
+                attention_mask = torch.ones(rows, s + 2 + step, dtype=torch.long)
+                outputs = inference_model(codes[:, step:step + 1], past_key_values=outputs.past_key_values,
+                                          attention_mask=attention_mask, use_cache=True, return_dict=True)
+                logits.append(outputs.logits[:, -1])
+            logits = torch.stack(logits, dim=1)
+            diff = (logits - expected).abs().max().item()
+            label = f"{rows} rows, prompt {s}"
+            print(f"{label}: {steps} decode steps, max abs logit diff {diff:.2e}")
+            if diff > atol:
+                failed.append(label)
+    print("--" * 10)
+    if failed:
+        print("mismatch:", failed)
+        sys.exit(1)
+    print("all matched")
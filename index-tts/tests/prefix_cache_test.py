@@ -0,0 +1,90 @@
+import torch
+from indextts.infer_v2 import IndexTTS2
+
+if __name__ == "__main__":
+    """
+    Test that reusing the KV of the conditioning prefix (`UnifiedVoice.prefix_kv_cache`) does not change the
+    generated codes: greedy decoding without the cache, with a cold cache and with a warm cache must agree,
+    for a single text and for a padded batch. With the cache the HF prefill must start after the prefix, so
+    the cached KV is actually used and not recomputed.
+    ```
+    python tests/prefix_cache_test.py checkpoints
+    ```
+    """
+    import sys
+    sys.path.append("..")
+    if len(sys.argv) > 1:
+        model_dir = sys.argv[1]
+    else:
+        model_dir = "checkpoints"
+    audio_prompt = "tests/sample_prompt.wav"
+    tts = IndexTTS2(cfg_path=f"{model_dir}/config.yaml", model_dir=model_dir, use_fp16=False, use_cuda_kernel=False)
+    texts = [
+        "There is a vehicle arriving in dock number 7?",
+        "Joseph Gordon-Levitt is an American actor.",
+    ]
+    text_tokens = [torch.tensor(tts.tokenizer.encode(text), dtype=torch.int32, device=tts.device).unsqueeze(0) for text in texts]
+    batched_text_tokens = tts.pad_tokens_cat(text_tokens)
+
+    spk_cond_emb, style, prompt_condition, ref_mel = tts._get_spk_condition(audio_prompt)
+    emo_cond_emb = tts._get_emo_condition(audio_prompt)
+    cond_lengths = torch.tensor([spk_cond_emb.shape[-1]], device=tts.device)
+    emo_cond_lengths = torch.tensor([emo_cond_emb.shape[-1]], device=tts.device)
+    kwargs = {"do_sample": False, "num_beams": 1, "repetition_penalty": 10.0, "max_generate_length": 300}
+    prefix_kv_cache = tts.gpt.prefix_kv_cache
+    failed = []
+
+    # 记录 HF 生成时 prefill 的输入长度与传入的 past 长度（decode 步每次只输入一个位置）
+    prefills = []
+
+    def past_length(past):
+        if past is None:
+            return 0
+        if hasattr(past, "get_seq_length"):
+            return past.get_seq_length()
+        return past[0][0].shape[-2]
+
+    def record_prefill(module, args, kwargs):
+        emb = kwargs.get("inputs_embeds")
+        if emb is not None and emb.shape[1] > 1:
+            prefills.append((emb.shape[1], past_length(kwargs.get("past_key_values"))))
+
+    tts.gpt.inference_model.transformer.register_forward_pre_hook(record_prefill, with_kwargs=True)
+
+    def generate(tokens):
+        prefills.clear()
+        with torch.no_grad():
+            emovec = tts.gpt.merge_emovec(spk_cond_emb, emo_cond_emb, cond_lengths, emo_cond_lengths)
+            codes, _ = tts.gpt.inference_speech(
+                spk_cond_emb, tokens, emo_cond_emb,
+                cond_lengths=cond_lengths, emo_cond_lengths=emo_cond_lengths, emo_vec=emovec, **kwargs,
+            )
+        # 最后一次 prefill 属于 HF 生成，冷缓存时之前还有一次前缀计算
+        return codes, prefills[-1]
+
+    for name, tokens in [("single", text_tokens[0]), ("batch", batched_text_tokens)]:
+        tts.gpt.prefix_kv_cache = None
+        baseline, (baseline_len, baseline_past) = generate(tokens)
+        tts.gpt.prefix_kv_cache = prefix_kv_cache
+        prefix_kv_cache.clear()
+        cold = generate(tokens)
+        warm = generate(tokens)
+        prefix_len = tts.gpt.inference_model.cached_prefix_past[0][0].shape[-2]
+        if baseline_past != 0:
+            failed.append(f"{name} / no cache: prefill got a past of {baseline_past}")
+        for run, (codes, (prefill_len, prefill_past)) in [("cold", cold), ("warm", warm)]:
+            equal = codes.shape == baseline.shape and torch.equal(codes, baseline)
+            print(f"{name} / {run} cache: codes {tuple(codes.shape)} vs {tuple(baseline.shape)}, identical {equal}")
+            if not equal:
+                failed.append(f"{name} / {run}")
+            used = prefill_past == prefix_len and prefill_len == baseline_len - prefix_len
+            print(f"{name} / {run} cache: prefill {prefill_len} positions after a past of {prefill_past} "
+                  f"(no cache: {baseline_len}, prefix {prefix_len}), cached prefix used {used}")
+            if not used:
+                failed.append(f"{name} / {run}: cached prefix not used")
+    print("prefix kv cache:", prefix_kv_cache.stats())
+    print("--" * 10)
+    if failed:
+        print("mismatch:", failed)
+        sys.exit(1)
+    print("all matched")
@@ -0,0 +1,63 @@
+if __name__ == "__main__":
+    """
+    Test that words WhisperX leaves unaligned (no "start" / "end", typically numbers such as "2005") keep
+    their place in time: `_collect_words` puts them between their aligned neighbours, so no chunk cut from
+    them starts at t=0 or ends before it starts. No models are needed, run it from index-tts/ like the others:
+    ```
+    python tests/unaligned_words_test.py
+    ```
+    """
+    import sys
+    sys.path.append("..")
+    from src.services.overlay_audio_on_video import _chunk_transcript
+    from src.services.transcribe_video import _collect_words
+
+    offset = 60.0  # a streaming window that starts one minute in
+    segments = [
+        {"start": 10.0, "end": 14.0, "words": [
+            {"word": "In", "start": 10.0, "end": 10.2},
+            {"word": "2005"},
+            {"word": "I", "start": 11.0, "end": 11.1},
+            {"word": "graduated.", "start": 11.2, "end": 11.8},
+            {"word": "It", "start": 12.6, "end": 12.7},
+            {"word": "was", "start": 12.8, "end": 12.9},
+            {"word": "1975."},
+        ]},
+        # a segment that is only an unaligned number
+        {"start": 15.0, "end": 15.5, "words": [{"word": "42"}]},
+        {"start": 16.0, "end": 18.0, "words": [
+            {"word": "Then", "start": 16.0, "end": 16.3},
+            {"word": "nothing", "start": 16.4, "end": 16.9},
+        ]},
+    ]
+    failed = []
+
+    def check(name, ok, detail=""):
+        print(f"{name}: {'ok' if ok else 'FAILED'} {detail}")
+        if not ok:
+            failed.append(name)
+
+    words = _collect_words(segments, offset=offset)
+    spans = list(words)
+    check("every word kept", len(spans) == 10, f"({len(spans)} words)")
+    check("starts never go back", all(a[1] <= b[1] for a, b in zip(spans, spans[1:])))
+    check("ends not before starts", all(end >= start for _, start, end in spans))
+    check("all words inside the window", all(start >= offset for _, start, _ in spans))
+    text, start, end = spans[1]
+    check("unaligned word between its neighbours", (start, end) == (70.2, 71.0), f"{text} {start} - {end}")
+    text, start, end = spans[7]
+    check("unaligned segment at its segment start", start == 75.0, f"{text} {start} - {end}")
+
+    # cut the chunks right before / after the unaligned words as well as elsewhere
+    for chunk_size in (0.5, 1.0, 2.0, 4.0):
+        clips = _chunk_transcript(words, default_sample="sample.wav", chunk_size_seconds=chunk_size)
+        check(f"chunk size {chunk_size}: positive clip durations", all(c.end >= c.start for c in clips),
+              [(c.text, c.start, c.end) for c in clips])
+        check(f"chunk size {chunk_size}: no clip placed before the window", all(c.start >= offset for c in clips))
+        check(f"chunk size {chunk_size}: every word in one clip",
+              " ".join(c.text for c in clips) == words.join())
+    print("--" * 10)
+    if failed:
+        print("failed:", failed)
+        sys.exit(1)
+    print("all passed")
@@ -0,0 +1,52 @@
+import argparse
+
+from indextts.infer_v2 import IndexTTS2
+from bench_cfm_solvers import mel_distance, prepare_s2mel_inputs, run_cfm
+
+# name -> CFM.inference kwargs of the guidance schedule
+GUIDANCE_CONFIGS = {
+    "off (cfg 0)": {"inference_cfg_rate": 0.0},
+    "interval 0.0-0.5": {"cfg_interval": (0.0, 0.5)},
+    "interval 0.0-0.7": {"cfg_interval": (0.0, 0.7)},
+    "interval 0.2-0.8": {"cfg_interval": (0.2, 0.8)},
+    "reuse 2": {"cfg_reuse_steps": 2},
+    "reuse 3": {"cfg_reuse_steps": 3},
+    "reuse 4": {"cfg_reuse_steps": 4},
+    "stop < 0.05": {"cfg_stop_threshold": 0.05},
+    "stop < 0.1": {"cfg_stop_threshold": 0.1},
+    "interval 0.0-0.7 + reuse 2": {"cfg_interval": (0.0, 0.7), "cfg_reuse_steps": 2},
+}
+
+
+if __name__ == "__main__":
+    """
+    Compare classifier-free guidance schedules of the s2mel CFM against full guidance at every step:
+    ```
+    uv run tools/bench_cfm_guidance.py --model_dir checkpoints --steps 25
+    ```
+    """
+    parser = argparse.ArgumentParser(description="s2mel CFM guidance schedule benchmark")
+    parser.add_argument("--model_dir", type=str, default="checkpoints")
+    parser.add_argument("--prompt", type=str, default="tests/sample_prompt.wav")
+    parser.add_argument("--text", type=str, default="There is a vehicle arriving in dock number 7? The weather is really nice today, perfect for studying at home.")
+    parser.add_argument("--steps", type=int, default=25)
+    parser.add_argument("--solver", type=str, default="euler")
+    parser.add_argument("--cfg_rate", type=float, default=0.7)
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs per configuration (best is reported)")
+    parser.add_argument("--device", type=str, default=None)
+    args = parser.parse_args()
+
+    tts = IndexTTS2(cfg_path=f"{args.model_dir}/config.yaml", model_dir=args.model_dir, use_fp16=False, device=args.device)
+    inputs = prepare_s2mel_inputs(tts, args.prompt, args.text)
+    base_kwargs = dict(n_timesteps=args.steps, inference_cfg_rate=args.cfg_rate, solver=args.solver)
+
+    reference, _ = run_cfm(tts, inputs, **base_kwargs)
+    reference_time = min(run_cfm(tts, inputs, **base_kwargs)[1] for _ in range(args.repeat))
+
+    print(f"{'guidance':<28} {'time(s)':>8} {'speedup':>7} {'mel L1':>8}")
+    print(f"{'full (every step)':<28} {reference_time:>8.3f} {1.0:>7.2f} {0.0:>8.4f}  (reference)")
+    for name, guidance in GUIDANCE_CONFIGS.items():
+        kwargs = {**base_kwargs, **guidance}
+        mel, _ = run_cfm(tts, inputs, **kwargs)
+        elapsed = min(run_cfm(tts, inputs, **kwargs)[1] for _ in range(args.repeat))
+        print(f"{name:<28} {elapsed:>8.3f} {reference_time / elapsed:>7.2f} {mel_distance(mel, reference):>8.4f}")
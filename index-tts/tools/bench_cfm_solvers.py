@@ -0,0 +1,91 @@
+import argparse
+import time
+
+import torch
+
+from indextts.infer_v2 import IndexTTS2
+from indextts.s2mel.modules.ode_solvers import SOLVER_NFE_PER_STEP
+
+
+def prepare_s2mel_inputs(tts: IndexTTS2, prompt_wav: str, text: str, seed: int = 0):
+    """
+    Run the GPT stage once and return the CFM inputs (cat_condition, x_lens, ref_mel, style),
+    so every solver configuration integrates the same conditions.
+    """
+    torch.manual_seed(seed)
+    spk_cond_emb, style, prompt_condition, ref_mel = tts._get_spk_condition(prompt_wav)
+    emo_cond_emb = tts._get_emo_condition(prompt_wav)
+    cond_lengths = torch.tensor([spk_cond_emb.shape[-1]], device=tts.device)
+    emo_cond_lengths = torch.tensor([emo_cond_emb.shape[-1]], device=tts.device)
+    text_tokens = torch.tensor(tts.tokenizer.encode(text), dtype=torch.int32, device=tts.device).unsqueeze(0)
+    with torch.no_grad():
+        emovec = tts.gpt.merge_emovec(spk_cond_emb, emo_cond_emb, cond_lengths, emo_cond_lengths)
+        codes, _, latent = tts.gpt.inference_speech(
+            spk_cond_emb, text_tokens, emo_cond_emb,
+            cond_lengths=cond_lengths, emo_cond_lengths=emo_cond_lengths, emo_vec=emovec,
+            do_sample=True, top_p=0.8, top_k=30, temperature=0.8, num_beams=3,
+            repetition_penalty=10.0, length_penalty=0.0, max_generate_length=1500,
+            return_latent=True,
+        )
+        codes, code_lens = tts._trim_codes(codes)
+        cat_condition, x_lens = tts._s2mel_conditions([(codes, code_lens, latent[:, :codes.shape[-1]])], prompt_condition)
+    return cat_condition, x_lens, ref_mel, style
+
+
+def run_cfm(tts: IndexTTS2, inputs, seed: int = 0, **cfm_kwargs):
+    """Integrate the CFM with a fixed noise seed, returns (mel without prompt, seconds)."""
+    cat_condition, x_lens, ref_mel, style = inputs
+    if tts.device.startswith("cuda"):
+        torch.cuda.synchronize()
+    torch.manual_seed(seed)
+    start = time.perf_counter()
+    mel = tts.s2mel.models['cfm'].inference(cat_condition, x_lens, ref_mel, style, None, **cfm_kwargs)
+    if tts.device.startswith("cuda"):
+        torch.cuda.synchronize()
+    return mel[:, :, ref_mel.size(-1):], time.perf_counter() - start
+
+
+def mel_distance(mel, reference):
+    """Mean absolute difference of two log-mel spectrograms."""
+    return (mel.float() - reference.float()).abs().mean().item()
+
+
+if __name__ == "__main__":
+    """
+    Compare CFM ODE solvers and time schedules against the 25-step Euler reference:
+    ```
+    uv run tools/bench_cfm_solvers.py --model_dir checkpoints --steps 8 10 12 16 25
+    ```
+    """
+    parser = argparse.ArgumentParser(description="s2mel CFM solver benchmark")
+    parser.add_argument("--model_dir", type=str, default="checkpoints")
+    parser.add_argument("--prompt", type=str, default="tests/sample_prompt.wav")
+    parser.add_argument("--text", type=str, default="There is a vehicle arriving in dock number 7? The weather is really nice today, perfect for studying at home.")
+    parser.add_argument("--steps", type=int, nargs="+", default=[6, 8, 10, 12, 16, 25])
+    parser.add_argument("--solvers", type=str, nargs="+", default=["euler", "heun", "midpoint", "multistep"])
+    parser.add_argument("--schedules", type=str, nargs="+", default=["uniform", "cosine", "quadratic"])
+    parser.add_argument("--cfg_rate", type=float, default=0.7)
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs per configuration (best is reported)")
+    parser.add_argument("--device", type=str, default=None)
+    args = parser.parse_args()
+
+    tts = IndexTTS2(cfg_path=f"{args.model_dir}/config.yaml", model_dir=args.model_dir, use_fp16=False, device=args.device)
+    inputs = prepare_s2mel_inputs(tts, args.prompt, args.text)
+    print(f">> condition frames: {inputs[0].shape[1]} (prompt {inputs[2].shape[-1]})")
+
+    reference, _ = run_cfm(tts, inputs, n_timesteps=25, inference_cfg_rate=args.cfg_rate)
+    reference_time = min(run_cfm(tts, inputs, n_timesteps=25, inference_cfg_rate=args.cfg_rate)[1] for _ in range(args.repeat))
+
+    print(f"{'solver':<10} {'schedule':<10} {'steps':>5} {'NFE':>4} {'time(s)':>8} {'speedup':>7} {'mel L1':>8}")
+    print(f"{'euler':<10} {'uniform':<10} {25:>5} {25:>4} {reference_time:>8.3f} {1.0:>7.2f} {0.0:>8.4f}  (reference)")
+    for solver in args.solvers:
+        for schedule in args.schedules:
+            for steps in args.steps:
+                if solver == "euler" and schedule == "uniform" and steps == 25:
+                    continue
+                kwargs = dict(n_timesteps=steps, inference_cfg_rate=args.cfg_rate, solver=solver, schedule=schedule)
+                mel, _ = run_cfm(tts, inputs, **kwargs)
+                elapsed = min(run_cfm(tts, inputs, **kwargs)[1] for _ in range(args.repeat))
+                nfe = steps * SOLVER_NFE_PER_STEP[solver]
+                print(f"{solver:<10} {schedule:<10} {steps:>5} {nfe:>4} {elapsed:>8.3f} "
+                      f"{reference_time / elapsed:>7.2f} {mel_distance(mel, reference):>8.4f}")
@@ -0,0 +1,106 @@
+import argparse
+import asyncio
+import random
+import time
+
+import torch
+import torch.nn as nn
+from transformers import GPT2Config
+
+from indextts.accel import AccelInferenceEngine, ContinuousBatchScheduler, GPT2AccelModel
+from indextts.gpt.model_v2 import LearnedPositionEmbeddings
+
+
+def build_engine(layers: int, dim: int, heads: int, vocab: int, block_size: int, num_blocks: int):
+    """A randomly initialized GPT with the IndexTTS2 layout: accel model, mel embedding, mel position embedding, head."""
+    config = GPT2Config(vocab_size=vocab, n_positions=2048, n_ctx=2048, n_embd=dim, n_layer=layers, n_head=heads)
+    model = GPT2AccelModel(config).eval()
+    mel_embedding = nn.Embedding(vocab, dim).eval()
+    mel_pos_embedding = LearnedPositionEmbeddings(1600, dim).eval()
+    lm_head = nn.Sequential(nn.LayerNorm(dim), nn.Linear(dim, vocab)).eval()
+    engine = AccelInferenceEngine(model, lm_head, layers, heads, dim // heads,
+                                  block_size=block_size, num_blocks=num_blocks, use_cuda_graph=False)
+    return engine, mel_embedding, mel_pos_embedding
+
+
+def run_sequential(engine, mel_embedding, mel_pos_embedding, segments, start_token):
+    """One blocking `engine.generate` per segment, the current behaviour."""
+    codes = []
+    for prompt, max_new_tokens in segments:
+        input_ids = torch.ones(1, prompt.shape[0] + 1, dtype=torch.long)
+        input_ids[:, -1] = start_token
+        output = engine.generate(input_ids, max_new_tokens=max_new_tokens, temperature=0,
+                                 tts_embeddings=prompt.unsqueeze(0), tts_mel_embedding=mel_embedding,
+                                 tts_text_pos_embedding=mel_pos_embedding)
+        codes.append(output[0, input_ids.shape[1]:])
+    return codes
+
+
+async def run_concurrent(scheduler, segments, start_token):
+    """All segments submitted at once, as concurrent pipeline chunks would."""
+    return await asyncio.gather(*[
+        scheduler.submit(prompt, start_token, max_new_tokens=max_new_tokens, temperature=0)
+        for prompt, max_new_tokens in segments
+    ])
+
+
+if __name__ == "__main__":
+    """
+    Throughput of the continuous batching scheduler against sequential `AccelInferenceEngine.generate` calls,
+    on CPU with a randomly initialized GPT (IndexTTS2 dimensions by default, no checkpoint needed):
+    ```
+    uv run tools/bench_continuous_batching.py --segments 16 --batch_sizes 1 4 8
+    ```
+    Segments get random token budgets (random weights rarely emit the stop token), so short segments retire
+    early and waiting ones are admitted into the running batch. Lower --num_blocks to exercise preemption.
+    """
+    parser = argparse.ArgumentParser(description="continuous batching throughput benchmark")
+    parser.add_argument("--segments", type=int, default=16)
+    parser.add_argument("--prompt_len", type=int, nargs=2, default=[60, 120], help="min / max prompt tokens")
+    parser.add_argument("--new_tokens", type=int, nargs=2, default=[50, 200], help="min / max generated tokens")
+    parser.add_argument("--batch_sizes", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--layers", type=int, default=24)
+    parser.add_argument("--dim", type=int, default=1280)
+    parser.add_argument("--heads", type=int, default=20)
+    parser.add_argument("--vocab", type=int, default=8194)
+    parser.add_argument("--block_size", type=int, default=256)
+    parser.add_argument("--num_blocks", type=int, default=32)
+    parser.add_argument("--threads", type=int, default=None, help="torch intra-op threads")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    torch.manual_seed(args.seed)
+    rng = random.Random(args.seed)
+    engine, mel_embedding, mel_pos_embedding = build_engine(args.layers, args.dim, args.heads, args.vocab,
+                                                            args.block_size, args.num_blocks)
+    start_token = args.vocab - 2
+    segments = [
+        (torch.randn(rng.randint(*args.prompt_len), args.dim), rng.randint(*args.new_tokens))
+        for _ in range(args.segments)
+    ]
+    total_tokens = sum(n for _, n in segments)
+    print(f">> {args.segments} segments, {total_tokens} tokens to generate, {torch.get_num_threads()} threads")
+
+    with torch.inference_mode():
+        run_sequential(engine, mel_embedding, mel_pos_embedding, segments[:1], start_token)  # warmup
+        start = time.perf_counter()
+        reference = run_sequential(engine, mel_embedding, mel_pos_embedding, segments, start_token)
+        sequential_time = time.perf_counter() - start
+
+    print(f"{'mode':<12} {'batch':>5} {'time(s)':>8} {'tok/s':>8} {'speedup':>7} {'mean bs':>7} {'preempt':>7} {'match':>7}")
+    print(f"{'sequential':<12} {1:>5} {sequential_time:>8.2f} {total_tokens / sequential_time:>8.1f} {1.0:>7.2f} "
+          f"{1.0:>7.2f} {0:>7} {len(segments):>3}/{len(segments):<3}")
+    for batch_size in args.batch_sizes:
+        scheduler = ContinuousBatchScheduler(engine, mel_embedding, mel_pos_embedding, max_batch_size=batch_size)
+        start = time.perf_counter()
+        codes = asyncio.run(run_concurrent(scheduler, segments, start_token))
+        elapsed = time.perf_counter() - start
+        stats = scheduler.stats()
+        scheduler.stop()
+        # 批量矩阵乘的数值与单条略有差异，greedy 结果可能在极少数位置分叉
+        matched = sum(torch.equal(c, r) for c, r in zip(codes, reference))
+        print(f"{'continuous':<12} {batch_size:>5} {elapsed:>8.2f} {total_tokens / elapsed:>8.1f} "
+              f"{sequential_time / elapsed:>7.2f} {stats['mean_batch_size']:>7.2f} {stats['preemptions']:>7} "
+              f"{matched:>3}/{len(segments):<3}")
@@ -0,0 +1,105 @@
+import argparse
+import time
+
+import torch
+from transformers import (
+    LogitsProcessorList,
+    RepetitionPenaltyLogitsProcessor,
+    TemperatureLogitsWarper,
+    TopKLogitsWarper,
+    TopPLogitsWarper,
+)
+
+from indextts.utils.fused_sampling import FusedLogitsProcessor, FusedSampler
+
+
+def synchronize(device):
+    if device.type == "cuda":
+        torch.cuda.synchronize()
+
+
+def timed(fn, steps, device):
+    """Mean milliseconds per call of fn(step) over steps calls, after one warmup call."""
+    fn(0)
+    synchronize(device)
+    start = time.perf_counter()
+    for step in range(steps):
+        fn(step)
+    synchronize(device)
+    return (time.perf_counter() - start) * 1000 / steps
+
+
+if __name__ == "__main__":
+    """
+    Per-step cost of mel-token logits processing: the HF processor chain `inference_speech` used to run
+    (repetition penalty -> temperature -> top-k -> top-p, then softmax + multinomial) against `FusedSampler`,
+    with the IndexTTS2 defaults, on random logits (no checkpoint needed):
+    ```
+    uv run tools/bench_fused_sampling.py --batch_sizes 1 3 6 --device cuda
+    ```
+    `fused (processor)` rebuilds the seen mask from input_ids every step, as `FusedLogitsProcessor` does in
+    HF beam search; `fused (sampler)` updates it incrementally, as `StaticCacheDecoder` and the accel engine do.
+    The processed scores of both are checked against the chain: same kept tokens, same values.
+    """
+    parser = argparse.ArgumentParser(description="fused logits processing benchmark")
+    parser.add_argument("--batch_sizes", type=int, nargs="+", default=[1, 3, 6], help="rows, e.g. beams x texts")
+    parser.add_argument("--vocab", type=int, default=8194)
+    parser.add_argument("--history", type=int, default=300, help="prompt + generated tokens seen by the penalty")
+    parser.add_argument("--steps", type=int, default=200)
+    parser.add_argument("--temperature", type=float, default=0.8)
+    parser.add_argument("--top_k", type=int, default=30)
+    parser.add_argument("--top_p", type=float, default=0.8)
+    parser.add_argument("--repetition_penalty", type=float, default=10.0)
+    parser.add_argument("--device", type=str, default="cuda" if torch.cuda.is_available() else "cpu")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    device = torch.device(args.device)
+    torch.manual_seed(args.seed)
+    chain = LogitsProcessorList([
+        RepetitionPenaltyLogitsProcessor(penalty=args.repetition_penalty),
+        TemperatureLogitsWarper(args.temperature),
+        TopKLogitsWarper(top_k=args.top_k),
+        TopPLogitsWarper(top_p=args.top_p),
+    ])
+    fused_processor = FusedLogitsProcessor(temperature=args.temperature, top_k=args.top_k, top_p=args.top_p,
+                                           repetition_penalty=args.repetition_penalty)
+    sampler = FusedSampler()
+    sampling = {"temperature": args.temperature, "top_k": args.top_k, "top_p": args.top_p,
+                "repetition_penalty": args.repetition_penalty}
+    print(f">> vocab {args.vocab}, history {args.history}, {args.steps} steps on {device}, {sampling}")
+    print(f"{'batch':>5} {'chain(ms)':>10} {'fused proc(ms)':>14} {'fused samp(ms)':>14} {'speedup':>7} {'match':>7}")
+
+    for batch_size in args.batch_sizes:
+        # 类似真实 logits 的尖峰分布：少数 token 占据大部分概率
+        logits = torch.randn(args.steps, batch_size, args.vocab, device=device) * 4
+        input_ids = torch.randint(0, args.vocab, (batch_size, args.history), device=device)
+        seen = torch.zeros(batch_size, args.vocab, dtype=torch.bool, device=device).scatter_(1, input_ids, True)
+
+        def run_chain(step):
+            scores = chain(input_ids, logits[step].clone())
+            return torch.multinomial(scores.softmax(dim=-1), num_samples=1).squeeze(1)
+
+        def run_fused_processor(step):
+            scores = fused_processor(input_ids, logits[step].clone())
+            return torch.multinomial(scores.softmax(dim=-1), num_samples=1).squeeze(1)
+
+        def run_fused_sampler(step):
+            tokens = sampler(logits[step], seen, **sampling)
+            return seen.scatter_(1, tokens.unsqueeze(1), True)
+
+        with torch.inference_mode():
+            chain_ms = timed(run_chain, args.steps, device)
+            processor_ms = timed(run_fused_processor, args.steps, device)
+            seen_start = seen.clone()
+            sampler_ms = timed(run_fused_sampler, args.steps, device)
+            seen.copy_(seen_start)
+
+            matched = 0
+            for step in range(args.steps):
+                expected = chain(input_ids, logits[step].clone())
+                scores = sampler.process(logits[step], seen, **sampling)
+                kept = torch.isfinite(expected)
+                matched += int(torch.equal(kept, torch.isfinite(scores)) and torch.equal(expected[kept], scores[kept]))
+        print(f"{batch_size:>5} {chain_ms:>10.3f} {processor_ms:>14.3f} {sampler_ms:>14.3f} "
+              f"{chain_ms / sampler_ms:>7.2f} {matched:>3}/{args.steps:<3}")
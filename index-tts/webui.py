@@ -29,6 +29,8 @@ parser.add_argument("--fp16", action="store_true", default=False, help="Use FP16
 parser.add_argument("--deepspeed", action="store_true", default=False, help="Use DeepSpeed to accelerate if available")
 parser.add_argument("--cuda_kernel", action="store_true", default=False, help="Use CUDA kernel for inference if available")
 parser.add_argument("--gui_seg_tokens", type=int, default=120, help="GUI: Max tokens per generation segment")
+parser.add_argument("--synthesis_cache_dir", type=str, default=None, help="Cache synthesized audio on disk, identical requests are served from it")
+parser.add_argument("--synthesis_cache_mb", type=int, default=1024, help="Size cap of the synthesis cache in MB")
 cmd_args = parser.parse_args()
 
 if not os.path.exists(cmd_args.model_dir):
@@ -58,6 +60,8 @@ tts = IndexTTS2(model_dir=cmd_args.model_dir,
                 use_fp16=cmd_args.fp16,
                 use_deepspeed=cmd_args.deepspeed,
                 use_cuda_kernel=cmd_args.cuda_kernel,
+                synthesis_cache_dir=cmd_args.synthesis_cache_dir,
+                synthesis_cache_mb=cmd_args.synthesis_cache_mb,
                 )
 # 支持的语言列表
 LANGUAGES = {
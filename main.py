@@ -6,8 +6,11 @@ import uuid
 
 from src.services.download_video import download_video
 from src.services.transcribe_video import transcribe_video, _load_models
-from src.services.generate_audio import generate_audio, _load_tts_model
+from src.services.transcript_cache import transcript_to_json
+from src.services.generate_audio import generate_audio_batch, count_text_tokens, synthesis_cache_stats, _load_tts_model
 from src.services.overlay_audio_on_video import overlay_audio_on_video, _chunk_transcript
+from src.services.stream_pipeline import run_streaming_pipeline
+from src.services.resumable_pipeline import run_resumable_pipeline
 
 from src.config.logger_config import logger
 
@@ -21,12 +24,48 @@ logger.info("IndexTTS Loaded Successfully.")
 
 
 CHUNK_LENGTH=10
-
-async def main_pipeline(youtube_url="", sample_file="", video_file=""):
+TTS_CHUNK_GROUP=8
+
+def _ensure_wav_sample(sample_file):
+    if sample_file.endswith(".mp3"):
+        wav_file_path = sample_file[:-4]+".wav"
+        subprocess.call(['ffmpeg', '-i', sample_file, wav_file_path])
+        sample_file = wav_file_path
+    return sample_file
+
+def _report_progress(progress_callback, stage, progress):
+    if progress_callback:
+        progress_callback(stage, progress)
+
+async def main_pipeline(youtube_url="", sample_file="", video_file="", streaming=False, run_id=None, progress_callback=None, resumable=False):
+    """
+    Dub a YouTube video or a local video file with the voice in sample_file.
+    With streaming=True transcription, synthesis and merging run as overlapped stages
+    (see src.services.stream_pipeline) instead of one after the other.
+    With resumable=True the stages run as a checkpointed DAG under output/runs/{run_id}
+    (see src.services.resumable_pipeline); calling again with the same run_id resumes a failed run.
+    progress_callback, if given, is called as progress_callback(stage, fraction) with fraction in [0, 1].
+    Returns the path of the final dubbed video.
+    """
     video_details = {}
-    run_id = str(uuid.uuid4())
+    run_id = run_id or str(uuid.uuid4())
+    output_video_path = f"output/{run_id}_final_dubbed_video.mp4"
+
+    if resumable:
+        try:
+            return await run_resumable_pipeline(
+                run_id=run_id,
+                youtube_url=youtube_url,
+                sample_file=sample_file,
+                video_file=video_file,
+                chunk_size_seconds=CHUNK_LENGTH,
+                progress_callback=progress_callback,
+            )
+        except Exception as e:
+            raise Exception(f"Failed resumable pipeline, re-run with run_id={run_id} to resume: {e}")
     
     # Downloads/Fetches the video
+    _report_progress(progress_callback, "fetch", 0.0)
     if video_file:
         video_details["video_path"] = video_file
         source_video_path = video_file
@@ -38,13 +77,32 @@ async def main_pipeline(youtube_url="", sample_file="", video_file=""):
         except:
             raise Exception("Failed to download video")
 
+    if streaming:
+        try:
+            logger.info("Running streaming dubbing pipeline...")
+            await run_streaming_pipeline(
+                video_path=source_video_path,
+                sample_file=_ensure_wav_sample(sample_file),
+                chunk_audio_dir=f"output/audio_chunks/{run_id}",
+                output_video_path=output_video_path,
+                chunk_size_seconds=CHUNK_LENGTH,
+                transcript_path=f"output/{run_id}_transcript.json",
+                progress_callback=lambda fraction: _report_progress(progress_callback, "synthesize", 0.05 + 0.9 * fraction),
+            )
+        except Exception as e:
+            raise Exception(f"Failed streaming pipeline: {e}")
+
+        _cleanup_run(run_id, source_video_path)
+        _report_progress(progress_callback, "done", 1.0)
+        return output_video_path
 
     # Transcribes the video to get word-level timestamps
+    _report_progress(progress_callback, "transcribe", 0.05)
     try:
         logger.debug(f"Transcribing video: {source_video_path}")
         transcription = await transcribe_video(video_path=source_video_path)
         with open(f"output/{run_id}_transcript.json", "w", encoding='utf-8') as fh:
-            json.dump(transcription, fh, ensure_ascii=False, indent=4)
+            json.dump(transcript_to_json(transcription), fh, ensure_ascii=False, indent=4)
 
         word_level_timestamps = transcription.get("word_level_timestamps", None)
     except:
@@ -52,33 +110,47 @@ async def main_pipeline(youtube_url="", sample_file="", video_file=""):
 
     
     # Generate audio chunks based on word-level timestamps
+    _report_progress(progress_callback, "synthesize", 0.3)
     try:
         logger.debug("Generating audio chunks...")
-        if sample_file.endswith(".mp3"):
-            wav_file_path = sample_file[:-4]+".wav"
-            subprocess.call(['ffmpeg', '-i', sample_file, wav_file_path])
-            sample_file = wav_file_path
-        clips = _chunk_transcript(word_level_timestamps, default_sample=sample_file, chunk_size_seconds=CHUNK_LENGTH)
-        os.makedirs(f"output/audio_chunks/{run_id}", exist_ok=True)
-        for i, clip in enumerate(clips):
-            await generate_audio(text=clip.text, output_filepath=f"output/audio_chunks/{run_id}/chunk{i}.wav", sample_filepath=clip.sample_to_use, video_sec=clip.end - clip.start)
+        sample_file = _ensure_wav_sample(sample_file)
+        clips = _chunk_transcript(word_level_timestamps, default_sample=sample_file, chunk_size_seconds=CHUNK_LENGTH, token_counter=count_text_tokens)
+        # Chunks are synthesized in groups so IndexTTS2 can batch their segments, progress is reported per group.
+        # The audio stays in memory until the merge, no chunk files are written.
+        audios = []
+        for group_start in range(0, len(clips), TTS_CHUNK_GROUP):
+            group = clips[group_start:group_start + TTS_CHUNK_GROUP]
+            audios += await generate_audio_batch(
+                texts=[clip.text for clip in group],
+                output_filepaths=None,
+                sample_filepath=sample_file,
+                video_secs=[clip.end - clip.start for clip in group],
+            )
+            _report_progress(progress_callback, "synthesize", 0.3 + 0.6 * (group_start + len(group)) / len(clips))
+        logger.info(f"Synthesis cache: {synthesis_cache_stats()}")
     except:
         raise Exception("Failed to Audio Generation")
 
 
     # Overlay generated audio on video
+    _report_progress(progress_callback, "overlay", 0.9)
     try:
         logger.info("Overlaying generated audio on video...")
         overlay_audio_on_video(
             video_path=source_video_path,
             chunk_audio_dir=f"output/audio_chunks/{run_id}",
-            output_video_path=f"output/{run_id}_final_dubbed_video.mp4",
-            clips=clips
+            output_video_path=output_video_path,
+            clips=clips,
+            audios=audios,
         )
     except Exception as e:
         raise Exception(f"Failed to overlay audio on video: {e}")
 
-    # Cleanup
+    _cleanup_run(run_id, source_video_path)
+    _report_progress(progress_callback, "done", 1.0)
+    return output_video_path
+
+def _cleanup_run(run_id, source_video_path):
     try:
         # 1. Remove temporary transcription audio directory if exists
         tmp_dirs = [d for d in os.listdir(".") if d.startswith("transcribe_video_")]
@@ -92,12 +164,7 @@ async def main_pipeline(youtube_url="", sample_file="", video_file=""):
         # 3. Remove individual chunk audios (keep merged + final video)
         shutil.rmtree(f"output/audio_chunks/{run_id}", ignore_errors=True)
 
-        # 4. Remove temporary stretch directory (if created by generate_audio)
-        stretch_tmp = "_temp_dub_segments_for_stretch"
-        if os.path.exists(stretch_tmp):
-            shutil.rmtree(stretch_tmp, ignore_errors=True)
-
-        # 5. Delete transcript json
+        # 4. Delete transcript json
         os.remove(f"output/{run_id}_transcript.json")
 
         logger.info("Cleanup completed successfully.")
@@ -0,0 +1,83 @@
+import argparse
+import random
+import statistics
+import time
+
+from src.services.overlay_audio_on_video import _chunk_transcript, estimate_text_tokens
+
+_VOCAB = ["the", "voice", "pipeline", "model", "we", "really", "think", "about", "synthesis", "a", "new",
+          "video", "is", "and", "to", "of", "international", "because", "people", "should", "1999"]
+
+
+def synthetic_transcript(num_words: int, seed: int = 0):
+    """Word timestamps with speech-like word lengths, short inter-word gaps and longer pauses at sentence ends."""
+    rng = random.Random(seed)
+    words, t = [], 0.0
+    sentence_left = rng.randint(5, 25)
+    for _ in range(num_words):
+        text = rng.choice(_VOCAB)
+        duration = 0.08 + 0.05 * len(text) * rng.uniform(0.7, 1.3)
+        sentence_left -= 1
+        if sentence_left == 0:
+            text += rng.choice([".", ".", "?", "!"])
+            gap = rng.uniform(0.35, 1.2)
+            sentence_left = rng.randint(5, 25)
+        elif rng.random() < 0.08:
+            text += ","
+            gap = rng.uniform(0.15, 0.4)
+        else:
+            gap = rng.uniform(0.0, 0.12)
+        words.append({"word": text, "start": round(t, 3), "end": round(t + duration, 3)})
+        t += duration + gap
+    return words
+
+
+def grid_chunk_transcript(word_timestamps, chunk_size_seconds=10):
+    """The original fixed-grid chunker: rescans all words per window and drops boundary-straddling words."""
+    chunks = []
+    current_time = 0
+    while current_time < word_timestamps[-1]['end']:
+        chunk_words = [
+            word for word in word_timestamps
+            if word['start'] >= current_time and word['end'] <= current_time + chunk_size_seconds
+        ]
+        if chunk_words:
+            chunks.append({"text": " ".join([_["word"] for _ in chunk_words]),
+                           "start": chunk_words[0]['start'], "end": chunk_words[-1]['end']})
+        current_time += chunk_size_seconds
+    return chunks
+
+
+def _report(name, elapsed, chunks, num_words, max_text_tokens, sentence_ends):
+    durations = [c["end"] - c["start"] for c in chunks]
+    tokens = [sum(estimate_text_tokens(w) for w in c["text"].split()) for c in chunks]
+    words_kept = sum(len(c["text"].split()) for c in chunks)
+    over_budget = sum(t > max_text_tokens for t in tokens)
+    clean_cuts = sum(c["text"].endswith(sentence_ends) for c in chunks)
+    print(f"{name:<10} {elapsed:>8.3f} {len(chunks):>7} {statistics.mean(durations):>7.2f} {statistics.pstdev(durations):>6.2f} "
+          f"{max(tokens):>6} {over_budget:>6} {num_words - words_kept:>7} {clean_cuts / len(chunks):>8.1%}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Transcript chunker benchmark: fixed grid vs pause/token-aware single pass")
+    parser.add_argument("--words", type=int, nargs="+", default=[10_000, 100_000])
+    parser.add_argument("--chunk_seconds", type=float, default=10.0)
+    parser.add_argument("--max_text_tokens", type=int, default=120)
+    parser.add_argument("--skip_grid_above", type=int, default=100_000, help="the grid chunker is quadratic, skip it for larger inputs")
+    args = parser.parse_args()
+
+    for num_words in args.words:
+        words = synthetic_transcript(num_words)
+        print(f"\n{num_words} words, {words[-1]['end'] / 3600:.2f} h of speech")
+        print(f"{'chunker':<10} {'time(s)':>8} {'chunks':>7} {'mean(s)':>7} {'std':>6} {'maxtok':>6} {'>budget':>6} {'dropped':>7} {'sent.end':>8}")
+        start = time.perf_counter()
+        clips = _chunk_transcript(words, default_sample="", chunk_size_seconds=args.chunk_seconds, max_text_tokens=args.max_text_tokens)
+        elapsed = time.perf_counter() - start
+        _report("pause", elapsed, [c.model_dump() for c in clips], num_words, args.max_text_tokens, (".", "?", "!"))
+        if num_words <= args.skip_grid_above:
+            start = time.perf_counter()
+            chunks = grid_chunk_transcript(words, chunk_size_seconds=args.chunk_seconds)
+            elapsed = time.perf_counter() - start
+            _report("grid", elapsed, chunks, num_words, args.max_text_tokens, (".", "?", "!"))
+
+    # uv run python -m src.benchmarks.bench_chunker --words 10000 100000
@@ -0,0 +1,97 @@
+import argparse
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+
+import numpy as np
+import soundfile as sf
+
+from src.services.time_stretch import stretch_to_duration
+
+
+def _synthetic_speech(sr: int, seconds: float, seed: int = 0) -> np.ndarray:
+    """Voiced harmonics with a gliding pitch, syllable-rate amplitude envelope and noise bursts."""
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(sr * seconds)) / sr
+    f0 = 140 + 30 * np.sin(2 * np.pi * 0.7 * t)
+    phase = 2 * np.pi * np.cumsum(f0) / sr
+    voiced = sum(np.sin(h * phase) / h for h in range(1, 12))
+    envelope = np.clip(np.sin(2 * np.pi * 4 * t), 0, None) ** 0.5
+    noise = rng.normal(0, 0.3, len(t)) * (np.sin(2 * np.pi * 1.3 * t) > 0.9)
+    y = voiced * envelope + noise
+    return (0.3 * y / np.abs(y).max()).astype(np.float32)
+
+
+def _atempo_filter(rate: float) -> str:
+    # atempo accepts 0.5-2.0 per filter instance, chain them for larger factors.
+    filters = []
+    while rate > 2.0:
+        filters.append("atempo=2.0")
+        rate /= 2.0
+    while rate < 0.5:
+        filters.append("atempo=0.5")
+        rate /= 0.5
+    filters.append(f"atempo={rate}")
+    return ",".join(filters)
+
+
+def stretch_ffmpeg(y: np.ndarray, sr: int, target_sec: float) -> np.ndarray:
+    """The previous generate_audio path: write, ffmpeg atempo in a temp dir, read back."""
+    temp_dir = tempfile.mkdtemp(prefix="bench_atempo_")
+    try:
+        src_path = os.path.join(temp_dir, "in.wav")
+        dst_path = os.path.join(temp_dir, "out.wav")
+        sf.write(src_path, y, sr)
+        rate = len(y) / sr / target_sec
+        subprocess.run(["ffmpeg", "-y", "-i", src_path, "-filter:a", _atempo_filter(rate), dst_path],
+                       check=True, capture_output=True)
+        out, _ = sf.read(dst_path, dtype="float32")
+        return out
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+
+def _best_time(fn, repeat: int):
+    best, out = float("inf"), None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        out = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, out
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time-stretch benchmark: in-memory WSOLA vs ffmpeg atempo")
+    parser.add_argument("--input", type=str, default=None, help="mono wav to stretch, synthetic speech if omitted")
+    parser.add_argument("--seconds", type=float, default=10.0, help="length of the synthetic input")
+    parser.add_argument("--sr", type=int, default=22050)
+    parser.add_argument("--rates", type=float, nargs="+", default=[0.4, 0.6, 0.8, 0.95, 1.05, 1.25, 1.5, 2.0, 2.5])
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs per configuration (best is reported)")
+    parser.add_argument("--skip_ffmpeg", action="store_true")
+    args = parser.parse_args()
+
+    if args.input:
+        y, sr = sf.read(args.input, dtype="float32")
+        if y.ndim > 1:
+            y = y.mean(axis=1)
+    else:
+        sr = args.sr
+        y = _synthetic_speech(sr, args.seconds)
+    duration = len(y) / sr
+    print(f"input: {duration:.2f}s @ {sr} Hz")
+    print(f"{'rate':>5} {'target(s)':>9} {'wsola(s)':>9} {'err(ms)':>8} {'ffmpeg(s)':>9} {'err(ms)':>8} {'speedup':>7}")
+    for rate in args.rates:
+        target_sec = duration / rate
+        wsola_time, wsola_out = _best_time(lambda: stretch_to_duration(y, sr, target_sec), args.repeat)
+        wsola_err = abs(len(wsola_out) / sr - target_sec) * 1000
+        if args.skip_ffmpeg:
+            print(f"{rate:>5.2f} {target_sec:>9.2f} {wsola_time:>9.4f} {wsola_err:>8.2f}")
+            continue
+        ffmpeg_time, ffmpeg_out = _best_time(lambda: stretch_ffmpeg(y, sr, target_sec), args.repeat)
+        ffmpeg_err = abs(len(ffmpeg_out) / sr - target_sec) * 1000
+        print(f"{rate:>5.2f} {target_sec:>9.2f} {wsola_time:>9.4f} {wsola_err:>8.2f} "
+              f"{ffmpeg_time:>9.4f} {ffmpeg_err:>8.2f} {ffmpeg_time / wsola_time:>7.2f}")
+
+    # uv run python -m src.benchmarks.bench_time_stretch --input output/gen.wav
@@ -6,6 +6,33 @@ from .logger_config import logger
 class Settings(BaseSettings):
     HF_TOKEN: Optional[str] = None
 
+    # Content-addressed transcript cache (src/services/transcript_cache.py)
+    TRANSCRIPT_CACHE_DIR: str = "cache/transcripts"
+
+    # Registered voices with precomputed IndexTTS2 conditioning (src/services/generate_audio.py)
+    VOICE_REGISTRY_DIR: str = "cache/voices"
+
+    # Synthesize chunks directly at their video slot length instead of stretching afterwards (src/services/generate_audio.py)
+    TTS_DURATION_CONTROL: bool = True
+    # IndexTTS2 text token budget per segment, the transcript chunker keeps every chunk within it
+    TTS_MAX_TEXT_TOKENS: int = 120
+    # Seed of IndexTTS2 sampling, set it to make chunk audio reproducible across runs and retries (None samples freshly every time)
+    TTS_SEED: Optional[int] = None
+
+    # Content-addressed cache of synthesized chunks keyed by voice, normalized text and generation settings (src/services/generate_audio.py)
+    SYNTHESIS_CACHE_DIR: str = "cache/synthesis"
+    SYNTHESIS_CACHE_MB: int = 2048
+
+    # Chunk overlap handling of the dub timeline: truncate, crossfade or sum (src/services/overlay_audio_on_video.py)
+    MERGE_OVERLAP_POLICY: str = "crossfade"
+
+    # Job server (src/server/job_server.py)
+    SERVER_HOST: str = "127.0.0.1"
+    SERVER_PORT: int = 8080
+    SERVER_WORKERS: int = 1
+    SERVER_JOBS_DIR: str = "input/jobs"
+    SERVER_MAX_UPLOAD_MB: int = 512
+
 config_path = pathlib.Path(__file__).parent / ".env"
 settings = Settings(_env_file=config_path, _env_file_encoding='utf-8')
 logger.info(f"Settings loaded.")
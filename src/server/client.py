@@ -0,0 +1,103 @@
+import json
+import mimetypes
+import os
+import time
+import urllib.error
+import urllib.request
+import uuid
+from typing import Optional
+
+
+class JobClient:
+    """
+    Minimal stdlib client for the job server (src/server/job_server.py).
+    """
+
+    def __init__(self, base_url: str = "http://127.0.0.1:8080"):
+        self.base_url = base_url.rstrip("/")
+
+    def _request(self, method: str, path: str, body: Optional[bytes] = None, headers: Optional[dict] = None):
+        request = urllib.request.Request(self.base_url + path, data=body, method=method, headers=headers or {})
+        try:
+            with urllib.request.urlopen(request) as response:
+                return response.status, response.read()
+        except urllib.error.HTTPError as e:
+            return e.code, e.read()
+
+    def _json(self, method: str, path: str, body: Optional[bytes] = None, headers: Optional[dict] = None) -> dict:
+        status, data = self._request(method, path, body, headers)
+        payload = json.loads(data or b"{}")
+        if status >= 400:
+            raise RuntimeError(f"{method} {path} failed ({status}): {payload.get('error', payload)}")
+        return payload
+
+    def submit(self, sample_path: str, video_path: str = "", youtube_url: str = "", streaming: bool = False) -> dict:
+        """
+        Upload a voice sample plus a video (or a YouTube URL) and queue a dubbing job.
+        Returns:
+            The job status, including its `id`.
+        """
+        boundary = uuid.uuid4().hex
+        parts = []
+        fields = {"youtube_url": youtube_url, "streaming": "1" if streaming else ""}
+        for name, value in fields.items():
+            if value:
+                parts.append(
+                    f"--{boundary}\r\nContent-Disposition: form-data; name=\"{name}\"\r\n\r\n{value}\r\n".encode("utf-8")
+                )
+        for name, path in (("sample", sample_path), ("video", video_path)):
+            if not path:
+                continue
+            content_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+            with open(path, "rb") as fh:
+                data = fh.read()
+            parts.append(
+                f"--{boundary}\r\nContent-Disposition: form-data; name=\"{name}\"; "
+                f"filename=\"{os.path.basename(path)}\"\r\nContent-Type: {content_type}\r\n\r\n".encode("utf-8")
+                + data + b"\r\n"
+            )
+        parts.append(f"--{boundary}--\r\n".encode("utf-8"))
+
+        return self._json(
+            "POST", "/jobs", b"".join(parts),
+            {"Content-Type": f"multipart/form-data; boundary={boundary}"},
+        )
+
+    def status(self, job_id: str) -> dict:
+        return self._json("GET", f"/jobs/{job_id}")
+
+    def jobs(self) -> list:
+        return self._json("GET", "/jobs")
+
+    def wait(self, job_id: str, poll_interval: float = 2.0, timeout: Optional[float] = None) -> dict:
+        """Poll a job until it is done or failed and return its final status."""
+        deadline = time.time() + timeout if timeout else None
+        while True:
+            job = self.status(job_id)
+            if job["status"] in ("done", "failed"):
+                return job
+            if deadline and time.time() > deadline:
+                raise TimeoutError(f"Job {job_id} still {job['status']} after {timeout}s")
+            time.sleep(poll_interval)
+
+    def download(self, job_id: str, output_path: str) -> str:
+        """Download the dubbed video of a finished job to output_path."""
+        status, data = self._request("GET", f"/jobs/{job_id}/result")
+        if status != 200:
+            raise RuntimeError(f"Result not available ({status}): {data.decode('utf-8', 'replace')}")
+        os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+        with open(output_path, "wb") as fh:
+            fh.write(data)
+        return output_path
+
+
+if __name__ == "__main__":
+    client = JobClient()
+    job = client.submit(sample_path="./input/VoiceSample1.wav", video_path="./input/MiniCropSteve Jobs' 2005 Stanford Commencement Address.mp4")
+    print(f"Submitted job {job['id']}")
+    job = client.wait(job["id"])
+    print(f"Job {job['id']} {job['status']} {job['error']}")
+    if job["status"] == "done":
+        print(client.download(job["id"], f"output/{job['id']}_downloaded.mp4"))
+
+    # Run via (with the server running): uv run python -m src.server.client
@@ -0,0 +1,389 @@
+import asyncio
+import importlib
+import json
+import multiprocessing as mp
+import os
+import re
+import shutil
+import time
+import uuid
+from email import policy
+from email.parser import BytesParser
+from typing import Dict, Optional
+from urllib.parse import urlsplit
+
+from pydantic import BaseModel
+
+from src.config.settings import settings
+from src.config.logger_config import logger
+
+# Pipeline run by the workers, "module:function". Importing `main` loads WhisperX and IndexTTS2 once per worker.
+DEFAULT_PIPELINE = "main:main_pipeline"
+# How often dead worker processes are detected and replaced.
+WORKER_CHECK_INTERVAL = 5.0
+# Multipart fields that may carry an uploaded file, anything else with a filename is rejected.
+UPLOAD_FIELDS = ("sample", "video")
+
+HTTP_REASONS = {
+    200: "OK", 202: "Accepted", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+    409: "Conflict", 413: "Payload Too Large", 500: "Internal Server Error",
+}
+
+
+class Job(BaseModel):
+    id: str
+    status: str = "queued"  # queued | running | done | failed
+    stage: str = ""
+    progress: float = 0.0
+    error: str = ""
+    youtube_url: str = ""
+    video_file: str = ""
+    sample_file: str = ""
+    streaming: bool = False
+    result_path: str = ""
+    created_at: float = 0.0
+    updated_at: float = 0.0
+
+    def public(self) -> dict:
+        data = self.model_dump(exclude={"video_file", "sample_file", "result_path"})
+        data["result_url"] = f"/jobs/{self.id}/result" if self.status == "done" else ""
+        return data
+
+
+def _safe_filename(filename: str) -> str:
+    """Last path component of an uploaded filename, restricted to letters, digits, '.', '-' and '_'."""
+    name = re.sub(r"[^\w.-]", "_", os.path.basename(filename.replace("\\", "/")))
+    return name.lstrip(".") or "upload"
+
+
+def _worker_main(pipeline_path: str, job_queue, event_queue, num_threads: int):
+    """
+    Worker process loop. Loads the pipeline (and with it the models) once, then runs jobs from job_queue
+    until it receives None, reporting (event, job_id, payload) tuples on event_queue.
+    """
+    if num_threads:
+        # Keep concurrent workers from oversubscribing the CPU, must happen before torch is imported.
+        os.environ.setdefault("OMP_NUM_THREADS", str(num_threads))
+    module_name, _, func_name = pipeline_path.partition(":")
+    pipeline = getattr(importlib.import_module(module_name), func_name)
+    event_queue.put(("ready", None, os.getpid()))
+
+    while True:
+        job = job_queue.get()
+        if job is None:
+            break
+
+        job_id = job["id"]
+        event_queue.put(("running", job_id, os.getpid()))
+
+        def progress_callback(stage, progress):
+            event_queue.put(("progress", job_id, (stage, float(progress))))
+
+        try:
+            result_path = asyncio.run(pipeline(
+                youtube_url=job["youtube_url"],
+                sample_file=job["sample_file"],
+                video_file=job["video_file"],
+                streaming=job["streaming"],
+                run_id=job_id,
+                progress_callback=progress_callback,
+            ))
+            event_queue.put(("done", job_id, result_path or ""))
+        except Exception as e:
+            event_queue.put(("failed", job_id, str(e)))
+
+
+class JobServer:
+    """
+    Long-running asyncio HTTP service that queues dubbing jobs and runs them on worker processes.
+
+    Endpoints:
+        POST /jobs                multipart/form-data with `sample` (file) and either `video` (file) or
+                                  `youtube_url`; optional `streaming` ("1"/"true"). Returns the job status.
+        GET  /jobs                Status of all jobs.
+        GET  /jobs/{id}           Status, stage and progress of one job.
+        GET  /jobs/{id}/result    Download the dubbed video once the job is done.
+    """
+
+    def __init__(
+        self,
+        host: str = settings.SERVER_HOST,
+        port: int = settings.SERVER_PORT,
+        num_workers: int = settings.SERVER_WORKERS,
+        jobs_dir: str = settings.SERVER_JOBS_DIR,
+        pipeline_path: str = DEFAULT_PIPELINE,
+        max_upload_mb: int = settings.SERVER_MAX_UPLOAD_MB,
+    ):
+        self.host = host
+        self.port = port
+        self.num_workers = max(1, num_workers)
+        self.jobs_dir = jobs_dir
+        self.pipeline_path = pipeline_path
+        self.max_upload_bytes = max_upload_mb * 1024 * 1024
+        self.jobs: Dict[str, Job] = {}
+
+        self._ctx = mp.get_context("spawn")
+        self._job_queue = self._ctx.Queue()
+        self._event_queue = self._ctx.Queue()
+        self._workers = []
+        self._running_by_pid: Dict[int, str] = {}
+        self._server: Optional[asyncio.Server] = None
+        self._tasks = []
+
+    # Workers
+
+    def _spawn_worker(self):
+        num_threads = max(1, (os.cpu_count() or 1) // self.num_workers)
+        proc = self._ctx.Process(
+            target=_worker_main,
+            args=(self.pipeline_path, self._job_queue, self._event_queue, num_threads),
+            daemon=True,
+        )
+        proc.start()
+        self._workers.append(proc)
+        logger.info(f"Started job worker pid={proc.pid}")
+
+    async def _pump_events(self):
+        while True:
+            event = await asyncio.to_thread(self._event_queue.get)
+            if event is None:
+                return
+            kind, job_id, payload = event
+            if kind == "ready":
+                logger.info(f"Job worker pid={payload} loaded its models.")
+                continue
+
+            job = self.jobs.get(job_id)
+            if job is None:
+                continue
+            if kind == "running":
+                self._running_by_pid[payload] = job_id
+                job.status = "running"
+            elif kind == "progress":
+                job.stage, job.progress = payload
+            elif kind == "done":
+                self._forget_running(job_id)
+                job.status, job.stage, job.progress, job.result_path = "done", "done", 1.0, payload
+                logger.info(f"Job {job_id} finished: {payload}")
+            elif kind == "failed":
+                self._forget_running(job_id)
+                job.status, job.error = "failed", payload
+                logger.error(f"Job {job_id} failed: {payload}")
+            job.updated_at = time.time()
+
+    def _forget_running(self, job_id: str):
+        for pid, running_id in list(self._running_by_pid.items()):
+            if running_id == job_id:
+                del self._running_by_pid[pid]
+
+    async def _watch_workers(self):
+        """Fail the job of a worker that died (e.g. out of memory) and start a replacement."""
+        while True:
+            await asyncio.sleep(WORKER_CHECK_INTERVAL)
+            for proc in list(self._workers):
+                if proc.is_alive():
+                    continue
+                self._workers.remove(proc)
+                job_id = self._running_by_pid.pop(proc.pid, None)
+                if job_id and job_id in self.jobs:
+                    job = self.jobs[job_id]
+                    job.status, job.error = "failed", f"Worker exited with code {proc.exitcode}"
+                    job.updated_at = time.time()
+                logger.error(f"Job worker pid={proc.pid} exited with code {proc.exitcode}, restarting.")
+                self._spawn_worker()
+
+    # Jobs
+
+    def submit(self, sample_file: str, youtube_url: str = "", video_file: str = "", streaming: bool = False, job_id: Optional[str] = None) -> Job:
+        """Queue a job for files already on disk and return it."""
+        if not sample_file:
+            raise ValueError("A voice sample is required.")
+        if not (youtube_url or video_file):
+            raise ValueError("Provide either a YouTube URL or a video file.")
+
+        now = time.time()
+        job = Job(
+            id=job_id or str(uuid.uuid4()),
+            youtube_url=youtube_url,
+            video_file=video_file,
+            sample_file=sample_file,
+            streaming=streaming,
+            created_at=now,
+            updated_at=now,
+        )
+        self.jobs[job.id] = job
+        self._job_queue.put(job.model_dump(include={"id", "youtube_url", "video_file", "sample_file", "streaming"}))
+        logger.info(f"Queued job {job.id}")
+        return job
+
+    def _submit_form(self, content_type: str, body: bytes) -> Job:
+        if not content_type.startswith("multipart/form-data"):
+            raise ValueError("Expected multipart/form-data.")
+        message = BytesParser(policy=policy.HTTP).parsebytes(
+            b"Content-Type: " + content_type.encode("latin-1") + b"\r\n\r\n" + body
+        )
+        if not message.is_multipart():
+            raise ValueError("Malformed multipart body.")
+
+        job_id = str(uuid.uuid4())
+        job_dir = os.path.join(self.jobs_dir, job_id)
+        fields, files = {}, {}
+        try:
+            for part in message.iter_parts():
+                name = part.get_param("name", header="content-disposition")
+                filename = part.get_filename()
+                payload = part.get_payload(decode=True) or b""
+                if filename:
+                    if name not in UPLOAD_FIELDS:
+                        raise ValueError(f"Unexpected file field {name!r}, expected one of {UPLOAD_FIELDS}.")
+                    os.makedirs(job_dir, exist_ok=True)
+                    path = os.path.join(job_dir, f"{name}_{_safe_filename(filename)}")
+                    if os.path.dirname(os.path.realpath(path)) != os.path.realpath(job_dir):
+                        raise ValueError(f"Invalid upload filename {filename!r}.")
+                    with open(path, "wb") as fh:
+                        fh.write(payload)
+                    files[name] = path
+                elif name:
+                    fields[name] = payload.decode("utf-8").strip()
+
+            return self.submit(
+                sample_file=files.get("sample", ""),
+                youtube_url=fields.get("youtube_url", ""),
+                video_file=files.get("video", ""),
+                streaming=fields.get("streaming", "").lower() in ("1", "true", "yes"),
+                job_id=job_id,
+            )
+        except ValueError:
+            # a rejected request leaves no uploads behind
+            shutil.rmtree(job_dir, ignore_errors=True)
+            raise
+
+    # HTTP
+
+    async def _route(self, method: str, path: str, headers: Dict[str, str], body: bytes):
+        parts = [_ for _ in path.split("/") if _]
+        if parts == ["jobs"]:
+            if method == "GET":
+                return 200, [job.public() for job in self.jobs.values()]
+            if method == "POST":
+                try:
+                    job = self._submit_form(headers.get("content-type", ""), body)
+                except ValueError as e:
+                    return 400, {"error": str(e)}
+                return 202, job.public()
+            return 405, {"error": f"{method} not allowed"}
+
+        if len(parts) in (2, 3) and parts[0] == "jobs":
+            job = self.jobs.get(parts[1])
+            if job is None:
+                return 404, {"error": "Unknown job"}
+            if method != "GET":
+                return 405, {"error": f"{method} not allowed"}
+            if len(parts) == 2:
+                return 200, job.public()
+            if parts[2] == "result":
+                if job.status != "done" or not os.path.exists(job.result_path):
+                    return 409, {"error": f"Job is {job.status}"}
+                return 200, job.result_path
+
+        return 404, {"error": "Not found"}
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request_line = await reader.readline()
+            if not request_line:
+                return
+            method, target, _ = request_line.decode("latin-1").split(" ", 2)
+
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b"\r\n", b"\n", b""):
+                    break
+                name, _, value = line.decode("latin-1").partition(":")
+                headers[name.strip().lower()] = value.strip()
+
+            length = int(headers.get("content-length", 0) or 0)
+            if length > self.max_upload_bytes:
+                await self._respond(writer, 413, {"error": "Upload too large"})
+                return
+            body = await reader.readexactly(length) if length else b""
+
+            status, payload = await self._route(method.upper(), urlsplit(target).path, headers, body)
+            await self._respond(writer, status, payload)
+        except Exception as e:
+            logger.error(f"Request failed: {e}")
+            try:
+                await self._respond(writer, 500, {"error": str(e)})
+            except Exception:
+                pass
+        finally:
+            writer.close()
+
+    async def _respond(self, writer: asyncio.StreamWriter, status: int, payload):
+        """Send a JSON payload, or stream the file at `payload` when it is a path."""
+        if isinstance(payload, str):
+            size = os.path.getsize(payload)
+            writer.write((
+                f"HTTP/1.1 {status} {HTTP_REASONS[status]}\r\n"
+                f"Content-Type: video/mp4\r\n"
+                f"Content-Length: {size}\r\n"
+                f"Content-Disposition: attachment; filename=\"{os.path.basename(payload)}\"\r\n"
+                f"Connection: close\r\n\r\n"
+            ).encode("latin-1"))
+            with open(payload, "rb") as fh:
+                while data := fh.read(1 << 20):
+                    writer.write(data)
+                    await writer.drain()
+            return
+
+        data = json.dumps(payload).encode("utf-8")
+        writer.write((
+            f"HTTP/1.1 {status} {HTTP_REASONS[status]}\r\n"
+            f"Content-Type: application/json\r\n"
+            f"Content-Length: {len(data)}\r\n"
+            f"Connection: close\r\n\r\n"
+        ).encode("latin-1") + data)
+        await writer.drain()
+
+    # Lifecycle
+
+    async def start(self):
+        os.makedirs(self.jobs_dir, exist_ok=True)
+        for _ in range(self.num_workers):
+            self._spawn_worker()
+        self._tasks = [
+            asyncio.create_task(self._pump_events()),
+            asyncio.create_task(self._watch_workers()),
+        ]
+        self._server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        logger.info(f"Job server listening on http://{self.host}:{self.port}")
+
+    async def stop(self):
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+        for task in self._tasks:
+            task.cancel()
+        for _ in self._workers:
+            self._job_queue.put(None)
+        self._event_queue.put(None)
+        for proc in self._workers:
+            await asyncio.to_thread(proc.join, 10)
+            if proc.is_alive():
+                proc.terminate()
+        self._workers = []
+
+    async def serve_forever(self):
+        await self.start()
+        try:
+            await self._server.serve_forever()
+        finally:
+            await self.stop()
+
+
+if __name__ == "__main__":
+    asyncio.run(JobServer().serve_forever())
+
+    # Run via: uv run python -m src.server.job_server
@@ -0,0 +1,167 @@
+import asyncio
+import hashlib
+import json
+import os
+import tempfile
+import time
+import uuid
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from src.config.logger_config import logger
+
+
+@dataclass
+class Node:
+    """
+    One stage of a pipeline DAG.
+    Args:
+        name: Unique node name, also the name of its completion marker.
+        fn: Async callable receiving {dep_name: dep_result} and returning a JSON-serializable result dict.
+            Paths listed under result["files"] are artifacts that must still exist for the node to count as done.
+        deps: Names of the nodes this one needs, either in the same `run` call or completed earlier.
+        params: JSON-serializable inputs of the node. Changing them invalidates the node and its dependents.
+    """
+    name: str
+    fn: Callable[[Dict[str, dict]], Awaitable[dict]]
+    deps: List[str] = field(default_factory=list)
+    params: dict = field(default_factory=dict)
+
+
+class DagRunError(Exception):
+    def __init__(self, failed: Dict[str, BaseException]):
+        self.failed = failed
+        details = "; ".join([f"{name}: {err}" for name, err in failed.items()])
+        super().__init__(f"{len(failed)} pipeline node(s) failed: {details}")
+
+
+class DagExecutor:
+    """
+    Runs DAG nodes with persisted completion markers under `run_dir/markers`, so re-running the same
+    run only executes nodes that are missing, failed or invalidated. A node is invalidated when its
+    params change, one of its artifacts is gone, or one of its dependencies was executed again.
+    Nodes whose dependencies are satisfied run concurrently, at most `max_parallel` at a time; a failing
+    node only stops its dependents, independent branches still complete and keep their markers.
+    """
+
+    def __init__(self, run_dir: str, max_parallel: int = 2):
+        self.run_dir = run_dir
+        self.marker_dir = os.path.join(run_dir, "markers")
+        self.max_parallel = max(1, max_parallel)
+        self.executed: List[str] = []
+        self.skipped: List[str] = []
+        self._results: Dict[str, dict] = {}
+        self._tokens: Dict[str, str] = {}
+
+    def result(self, name: str) -> dict:
+        return self._results[name]
+
+    def _marker_path(self, name: str) -> str:
+        return os.path.join(self.marker_dir, f"{name}.json")
+
+    def _fingerprint(self, node: Node) -> str:
+        payload = json.dumps([node.name, node.params, [self._tokens[dep] for dep in node.deps]], sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _load_marker(self, node: Node, fingerprint: str) -> Optional[dict]:
+        path = self._marker_path(node.name)
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, "r", encoding="utf-8") as fh:
+                marker = json.load(fh)
+        except (OSError, ValueError):
+            return None
+        if marker.get("fingerprint") != fingerprint:
+            return None
+        if not all(os.path.exists(p) for p in marker["result"].get("files", [])):
+            return None
+        return marker
+
+    def _write_marker(self, node: Node, fingerprint: str, result: dict) -> str:
+        os.makedirs(self.marker_dir, exist_ok=True)
+        token = uuid.uuid4().hex
+        fd, tmp_path = tempfile.mkstemp(dir=self.marker_dir, suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as fh:
+            json.dump({
+                "name": node.name,
+                "fingerprint": fingerprint,
+                "token": token,
+                "completed_at": time.time(),
+                "result": result,
+            }, fh, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self._marker_path(node.name))
+        return token
+
+    def _topological_order(self, nodes: Dict[str, Node]) -> List[Node]:
+        order, state = [], {}
+
+        def visit(name, path):
+            if state.get(name) == "done":
+                return
+            if state.get(name) == "visiting":
+                raise ValueError(f"Cycle in pipeline DAG: {' -> '.join(path + [name])}")
+            state[name] = "visiting"
+            for dep in nodes[name].deps:
+                if dep in nodes:
+                    visit(dep, path + [name])
+                elif dep not in self._results:
+                    raise ValueError(f"Node {name} depends on unknown node {dep}")
+            state[name] = "done"
+            order.append(nodes[name])
+
+        for name in nodes:
+            visit(name, [])
+        return order
+
+    async def run(self, nodes: List[Node]) -> Dict[str, dict]:
+        """
+        Execute the given nodes (skipping completed ones) and return {name: result} for them.
+        Can be called several times on the same executor, later calls may depend on nodes of earlier ones.
+        Raises:
+            DagRunError: If any node failed. Nodes that completed keep their markers.
+        """
+        by_name = {node.name: node for node in nodes}
+        order = self._topological_order(by_name)
+        semaphore = asyncio.Semaphore(self.max_parallel)
+        failed: Dict[str, BaseException] = {}
+        tasks: Dict[str, asyncio.Task] = {}
+
+        async def run_node(node: Node):
+            for dep in node.deps:
+                if dep in tasks:
+                    await tasks[dep]
+            if any(dep not in self._tokens for dep in node.deps):
+                logger.warning(f"Skipping node {node.name}, a dependency did not complete.")
+                return
+
+            fingerprint = self._fingerprint(node)
+            marker = self._load_marker(node, fingerprint)
+            if marker is not None:
+                self._results[node.name] = marker["result"]
+                self._tokens[node.name] = marker["token"]
+                self.skipped.append(node.name)
+                logger.debug(f"Node {node.name} already completed, skipping.")
+                return
+
+            async with semaphore:
+                logger.info(f"Running pipeline node {node.name} ...")
+                try:
+                    result = await node.fn({dep: self._results[dep] for dep in node.deps})
+                except Exception as e:
+                    logger.error(f"Pipeline node {node.name} failed: {e}")
+                    failed[node.name] = e
+                    return
+
+            result = result or {}
+            self._tokens[node.name] = self._write_marker(node, fingerprint, result)
+            self._results[node.name] = result
+            self.executed.append(node.name)
+
+        for node in order:
+            tasks[node.name] = asyncio.create_task(run_node(node))
+        await asyncio.gather(*tasks.values())
+
+        if failed:
+            raise DagRunError(failed)
+        return {name: self._results[name] for name in by_name}
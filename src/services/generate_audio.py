@@ -2,63 +2,175 @@ import numpy as np
 if not hasattr(np, "bool8"):
     np.bool8 = np.bool_
 
-import shutil
-import subprocess
+import asyncio
+import threading
+import time
 import librosa
+import soundfile as sf
 import os
 import torch
+from dataclasses import dataclass
+from typing import List, Optional
 from indextts.infer_v2 import IndexTTS2
+from src.config.settings import settings
+from src.services.time_stretch import stretch_to_duration
+from src.services.overlay_audio_on_video import estimate_text_tokens
 
 INDEXTTS_MODEL = None
 TTS_DEVICE = "cpu"
+# IndexTTS2 keeps per-call state (prompt caches, progress), so only one inference may run at a time.
+TTS_LOCK = threading.Lock()
+# Maximum number of text segments IndexTTS2 synthesizes together in `generate_audio_batch`.
+TTS_BATCH_SIZE = 4
+# Sample rate of the IndexTTS2 output.
+TTS_SAMPLE_RATE = 22050
 
 # Load the IndexTTS model globally and kept seperate for just initialization.
 def _load_tts_model():
     global INDEXTTS_MODEL, TTS_DEVICE
     TTS_DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
-    INDEXTTS_MODEL = IndexTTS2(cfg_path="src/models/indextts/checkpoints/config.yaml", model_dir="src/models/indextts/checkpoints", use_fp16=False, use_cuda_kernel=False, use_deepspeed=False, device=TTS_DEVICE)
+    INDEXTTS_MODEL = IndexTTS2(cfg_path="src/models/indextts/checkpoints/config.yaml", model_dir="src/models/indextts/checkpoints", use_fp16=False, use_cuda_kernel=False, use_deepspeed=False, device=TTS_DEVICE, voice_dir=settings.VOICE_REGISTRY_DIR, synthesis_cache_dir=settings.SYNTHESIS_CACHE_DIR or None, synthesis_cache_mb=settings.SYNTHESIS_CACHE_MB)
 
-async def generate_audio(text: str, output_filepath: str, sample_filepath: str, video_sec: float=None):
-    """Generate audio using IndexTTS with a speaker audio prompt. Optionally stretch to match video duration.
+def count_text_tokens(text: str) -> int:
+    """
+    Number of IndexTTS2 text tokens of text (after normalization), used to keep chunks within TTS_MAX_TEXT_TOKENS.
+    Falls back to the conservative `estimate_text_tokens` while the model is not loaded.
+    """
+    if INDEXTTS_MODEL is None:
+        return estimate_text_tokens(text)
+    return len(INDEXTTS_MODEL.tokenizer.tokenize(text))
+
+def synthesis_cache_stats() -> Optional[dict]:
+    """Hits, misses, hit rate and size of the IndexTTS2 synthesis cache, None if it is disabled.
+    Repeated chunks (intros, catchphrases, re-runs after a failure) are served from the cache instead of resynthesized.
+    """
+    cache = INDEXTTS_MODEL.synthesis_cache
+    return cache.stats() if cache is not None else None
+
+async def register_voice(sample_filepath: str, name: str=None) -> str:
+    """Precompute the IndexTTS2 conditioning of a speaker sample and persist it in the voice registry.
+    Args:
+        sample_filepath: Path to the speaker audio sample (wav).
+        name: Optional display name of the voice.
+    Returns:
+        Voice ID usable as `sample_filepath` of `generate_audio` / `generate_audio_batch`, also after a restart.
+    """
+    def _register():
+        with TTS_LOCK:
+            return INDEXTTS_MODEL.register_voice(sample_filepath, name=name)
+    return await asyncio.to_thread(_register)
+
+@dataclass
+class SynthesizedAudio:
+    """In-memory result of `generate_audio`, ready for merging without reloading a wav file."""
+    samples: np.ndarray  # float32 mono, in [-1, 1]
+    sr: int
+    synthesis_sec: float = 0.0  # IndexTTS2 wall time, a batched call is split over its texts by audio length
+    stretch_sec: float = 0.0
+    target_duration: Optional[float] = None
+    output_filepath: Optional[str] = None
+
+    @property
+    def duration(self) -> float:
+        return len(self.samples) / self.sr
+
+    def resampled(self, sr: int) -> np.ndarray:
+        """Samples at sample rate sr, e.g. the 44.1 kHz timeline of the merger."""
+        if sr == self.sr:
+            return self.samples
+        return librosa.resample(self.samples, orig_sr=self.sr, target_sr=sr)
+
+    def write(self, output_filepath: str) -> str:
+        if os.path.dirname(output_filepath):
+            os.makedirs(os.path.dirname(output_filepath), exist_ok=True)
+        sf.write(output_filepath, self.samples, self.sr)
+        self.output_filepath = output_filepath
+        return output_filepath
+
+async def generate_audio(text: str, output_filepath: Optional[str], sample_filepath: str, video_sec: float=None) -> SynthesizedAudio:
+    """Generate audio using IndexTTS with a speaker audio prompt. Optionally fit it to the video duration.
+    The work runs in a worker thread so other pipeline stages keep running on the event loop.
     Args:
         text: Text to be synthesized.
-        output_filepath: Path to save the generated audio.
-        sample_filepath: Path to speaker audio prompt file.
-        video_sec: Optional target duration in seconds to stretch the audio to match.
+        output_filepath: Optional path to also save the generated audio to (debugging, resumable runs).
+        sample_filepath: Path to speaker audio prompt file, or a voice ID from `register_voice`.
+        video_sec: Optional target duration in seconds, ignored unless positive. With `TTS_DURATION_CONTROL`
+            IndexTTS2 synthesizes the chunk at this length directly, otherwise the audio is stretched afterwards.
     Returns:
-        Creates the audio file at output_filepath.
+        SynthesizedAudio with the samples, sample rate and timing of the chunk.
     """
+    return await asyncio.to_thread(_generate_audio_sync, text, output_filepath, sample_filepath, video_sec)
+
+def _generate_audio_sync(text: str, output_filepath: Optional[str], sample_filepath: str, video_sec: float=None) -> SynthesizedAudio:
     global INDEXTTS_MODEL
-    INDEXTTS_MODEL.infer(spk_audio_prompt=sample_filepath, text=text, output_path=output_filepath, verbose=True)
-    
-    # The below code stretches the audio to match the video segment duration if provided.
-    if video_sec:
-        # measure actual vs target
-        y, sr = librosa.load(output_filepath, sr=None)
-        actual_duration_s = librosa.get_duration(y=y, sr=sr)
-
-        if actual_duration_s > 0.1 and abs(actual_duration_s - video_sec) > 0.05:
-            stretch_rate = actual_duration_s / video_sec
-
-            temp_dir = "_temp_dub_segments_for_stretch"
-            if 0.5 <= stretch_rate <= 2.0:
-                stretched_dub_path =  os.path.join(temp_dir, "stretched_dub.wav")
-                os.makedirs(temp_dir, exist_ok=True)
-
-                cmd = [
-                    "ffmpeg", "-y", "-i", str(output_filepath),
-                    "-filter:a", f"atempo={stretch_rate}",
-                    str(stretched_dub_path)
-                ]
-                subprocess.run(cmd, check=True, capture_output=True)
-
-                
-                os.replace(stretched_dub_path, output_filepath)
-                shutil.rmtree(temp_dir)
+    # Only a positive target is planned by IndexTTS2, anything else is synthesized at its natural length.
+    target_duration = video_sec if settings.TTS_DURATION_CONTROL and video_sec and video_sec > 0 else None
+    start = time.perf_counter()
+    with TTS_LOCK:
+        result = INDEXTTS_MODEL.infer(spk_audio_prompt=sample_filepath, text=text, output_path=None, verbose=True, max_text_tokens_per_segment=settings.TTS_MAX_TEXT_TOKENS, target_duration=target_duration, seed=settings.TTS_SEED)
+    if result is None:
+        # IndexTTS2 returns None when the text has nothing to speak (e.g. it normalizes to nothing), keep the slot silent.
+        silence_sec = video_sec if video_sec and video_sec > 0 else 0.0
+        result = TTS_SAMPLE_RATE, np.zeros(int(round(silence_sec * TTS_SAMPLE_RATE)), dtype=np.int16)
+    sr, wav_data = result
+    audio = _to_synthesized_audio(sr, wav_data, time.perf_counter() - start, target_duration)
+    if target_duration is None:
+        _stretch_to_duration(audio, video_sec)
+    if output_filepath:
+        audio.write(output_filepath)
+    return audio
+
+async def generate_audio_batch(texts: List[str], output_filepaths: Optional[List[str]], sample_filepath: str, video_secs: Optional[List[float]]=None) -> List[SynthesizedAudio]:
+    """Generate the audio of several chunks with the same speaker prompt in one batched IndexTTS2 call.
+    Segments of all texts are bucketed by length and synthesized together, which keeps the GPT and
+    diffusion batches full instead of running one short chunk at a time.
+    Args:
+        texts: Texts to be synthesized.
+        output_filepaths: Optional path to also save the generated audio of every text to.
+        sample_filepath: Path to speaker audio prompt file (or voice ID) shared by all texts.
+        video_secs: Optional target duration of every text, see `generate_audio`.
+    Returns:
+        One SynthesizedAudio per text.
+    """
+    return await asyncio.to_thread(_generate_audio_batch_sync, texts, output_filepaths, sample_filepath, video_secs)
+
+def _generate_audio_batch_sync(texts: List[str], output_filepaths: Optional[List[str]], sample_filepath: str, video_secs: Optional[List[float]]=None) -> List[SynthesizedAudio]:
+    global INDEXTTS_MODEL
+    video_secs = video_secs or [None] * len(texts)
+    target_durations = [video_sec if video_sec and video_sec > 0 else None for video_sec in video_secs] if settings.TTS_DURATION_CONTROL else None
+    start = time.perf_counter()
+    with TTS_LOCK:
+        results = INDEXTTS_MODEL.infer_batch(spk_audio_prompt=sample_filepath, texts=texts, output_paths=None, verbose=True, max_text_tokens_per_segment=settings.TTS_MAX_TEXT_TOKENS, segments_bucket_max_size=TTS_BATCH_SIZE, target_durations=target_durations, seed=settings.TTS_SEED)
+    elapsed = time.perf_counter() - start
+    total_samples = sum(len(wav_data) for _, wav_data in results) or 1
+    audios = []
+    for i, ((sr, wav_data), video_sec) in enumerate(zip(results, video_secs)):
+        audio = _to_synthesized_audio(sr, wav_data, elapsed * len(wav_data) / total_samples,
+                                      target_durations[i] if target_durations else None)
+        if target_durations is None:
+            _stretch_to_duration(audio, video_sec)
+        if output_filepaths:
+            audio.write(output_filepaths[i])
+        audios.append(audio)
+    return audios
+
+def _to_synthesized_audio(sr: int, wav_data: np.ndarray, synthesis_sec: float, target_duration: Optional[float]) -> SynthesizedAudio:
+    # IndexTTS2 returns int16 samples shaped (frames, channels) when no output path is given.
+    samples = (wav_data[:, 0] if wav_data.ndim > 1 else wav_data).astype(np.float32) / 32767.0
+    return SynthesizedAudio(samples=samples, sr=sr, synthesis_sec=synthesis_sec, target_duration=target_duration)
+
+def _stretch_to_duration(audio: SynthesizedAudio, video_sec: float=None):
+    # Stretch the audio in memory to match the video segment duration if provided.
+    if video_sec and video_sec > 0 and audio.duration > 0.1 and abs(audio.duration - video_sec) > 0.05:
+        start = time.perf_counter()
+        audio.samples = stretch_to_duration(audio.samples, audio.sr, video_sec)
+        audio.stretch_sec = time.perf_counter() - start
+        audio.target_duration = video_sec
 
 if __name__ == "__main__":
     import asyncio
     _load_tts_model()
-    asyncio.run(generate_audio("Hi there, this is a test for voice cloning.", "output/gen.wav", "input/voice_12.wav"))
+    audio = asyncio.run(generate_audio("Hi there, this is a test for voice cloning.", "output/gen.wav", "input/voice_12.wav"))
+    print(f"{audio.duration:.2f}s of audio in {audio.synthesis_sec:.2f}s")
 
     # uv run python -m src.services.generate_audio
\ No newline at end of file
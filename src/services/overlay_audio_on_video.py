@@ -9,6 +9,8 @@ import numpy as np
 from pydantic import BaseModel
 from typing import List
 
+from src.services.timeline import Timeline, as_timeline
+from src.config.settings import settings
 from src.config.logger_config import logger
 
 
@@ -19,46 +21,139 @@ class ClipPart(BaseModel):
     audio_file_path: str = ""
     sample_to_use: str = ""
 
-def _chunk_transcript(word_timestamps, default_sample, chunk_size_seconds=30) -> List[ClipPart]:
+# Cut scoring of `TranscriptChunker`: the pause after a word plus a punctuation bonus, minus the distance of the
+# resulting chunk from the target length (relative to the target).
+_SENTENCE_END = (".", "!", "?", "。", "！", "？", "…")
+_CLAUSE_END = (",", ";", ":", "，", "；", "：", "-")
+_MAX_PAUSE_SCORE = 2.0
+_SENTENCE_END_BONUS = 0.6
+_CLAUSE_END_BONUS = 0.25
+_LENGTH_PENALTY = 0.5
+
+def estimate_text_tokens(text: str) -> int:
+    """
+    Conservative estimate of the IndexTTS2 BPE tokens of a word: one per CJK character, one per three other
+    letters or digits and one per punctuation mark, rounded up so chunks stay within the real token budget.
+    """
+    cjk = sum(ord(ch) >= 0x2E80 for ch in text)
+    alnum = sum(ch.isalnum() for ch in text) - cjk
+    punct = sum(not ch.isalnum() and not ch.isspace() for ch in text)
+    return max(1, cjk + -(-alnum // 3) + punct)
+
+def _cut_bonus(texts: List[str]) -> np.ndarray:
+    """Punctuation bonus of cutting after every word."""
+    return np.fromiter(
+        (_SENTENCE_END_BONUS if text.endswith(_SENTENCE_END) else _CLAUSE_END_BONUS if text.endswith(_CLAUSE_END) else 0.0
+         for text in texts),
+        dtype=np.float64, count=len(texts),
+    )
+
+class TranscriptChunker:
+    """
+    Single-pass chunker for a time-ordered stream of word-level timestamps.
+    The words not emitted yet are kept as one Timeline, with their token counts and cut bonuses as parallel arrays.
+    A chunk starting at the first pending word grows until the next word would push it past `max_chunk_seconds`
+    or `max_text_tokens`; all its word boundaries after `min_chunk_seconds` are then scored as cuts at once
+    (longer pause, sentence / clause end, closeness to `chunk_size_seconds`) and the chunk is cut off at the best
+    one as a Timeline view, the words after it start the next chunk. A chunk spans at most `max_text_tokens`
+    words, so every cut looks at a bounded window and chunking is linear in the number of words. Clips are
+    emitted as soon as they are cut, so they can be synthesized while transcription is still running.
+    """
+
+    def __init__(self, default_sample: str, chunk_size_seconds: float = 30, min_chunk_seconds: float | None = None,
+                 max_chunk_seconds: float | None = None, max_text_tokens: int | None = None, token_counter=None):
+        self.default_sample = default_sample
+        self.chunk_size_seconds = chunk_size_seconds
+        self.min_chunk_seconds = 0.5 * chunk_size_seconds if min_chunk_seconds is None else min_chunk_seconds
+        self.max_chunk_seconds = 1.5 * chunk_size_seconds if max_chunk_seconds is None else max_chunk_seconds
+        self.max_text_tokens = max_text_tokens or settings.TTS_MAX_TEXT_TOKENS
+        self.token_counter = token_counter or estimate_text_tokens
+        self._pending = Timeline.empty()  # words not emitted yet, the open chunk starts at the first one
+        self._tokens = np.zeros(0, dtype=np.int64)  # token count of every pending word
+        self._bonus = np.zeros(0)  # punctuation bonus of cutting after every pending word
+        self._last_end = None  # end of the last fed word, places a leading unaligned word
+
+    def feed(self, words) -> List[ClipPart]:
+        """Add words (a Timeline or {"word", "start", "end"} dicts) to the chunker and return the clips that were cut."""
+        words = as_timeline(words, last_end=self._last_end)
+        if not len(words):
+            return []
+        self._last_end = words.end
+        texts = words.texts()
+        self._pending = Timeline.concat([self._pending, words])
+        self._tokens = np.concatenate([
+            self._tokens, np.fromiter((self.token_counter(text) for text in texts), dtype=np.int64, count=len(texts))
+        ])
+        self._bonus = np.concatenate([self._bonus, _cut_bonus(texts)])
+        return [self._clip(chunk) for chunk in self._cut()]
+
+    def flush(self) -> List[ClipPart]:
+        """Emit the last, possibly short, chunk."""
+        chunk = self._pending
+        self._pending, self._tokens, self._bonus = Timeline.empty(), self._tokens[:0], self._bonus[:0]
+        return [self._clip(chunk)] if len(chunk) else []
+
+    def _cut(self) -> List[Timeline]:
+        """Cut every complete chunk off the pending words, as views of the pending Timeline."""
+        pending, chunks, head = self._pending, [], 0
+        while len(pending) - head > 1:
+            # a chunk holds at most max_text_tokens words, look no further than the first word that cannot fit
+            stop = min(len(pending), head + self.max_text_tokens + 1)
+            over = (pending.ends[head:stop] - pending.starts[head] > self.max_chunk_seconds) \
+                | (np.cumsum(self._tokens[head:stop]) > self.max_text_tokens)
+            over[0] = False  # the first word always opens the chunk
+            if not over.any():
+                if stop == len(pending):
+                    break  # the chunk may still grow, wait for more words
+                first_over = stop  # only with a counter giving 0-token words: cap the chunk at the window
+            else:
+                first_over = head + int(np.argmax(over))
+            cut = self._best_cut(head, first_over)
+            chunks.append(pending[head:cut])
+            head = cut
+        self._pending, self._tokens, self._bonus = pending[head:], self._tokens[head:], self._bonus[head:]
+        return chunks
+
+    def _best_cut(self, head: int, first_over: int) -> int:
+        """End (exclusive) of the chunk starting at `head`, cut at the best boundary before word `first_over`."""
+        pending = self._pending
+        ends = pending.ends[head:first_over]
+        duration = ends - pending.starts[head]
+        pause = np.clip(pending.starts[head + 1:first_over + 1] - ends, 0.0, _MAX_PAUSE_SCORE)
+        score = pause + self._bonus[head:first_over] \
+            - _LENGTH_PENALTY * np.abs(duration - self.chunk_size_seconds) / self.chunk_size_seconds
+        score[duration < self.min_chunk_seconds] = -np.inf
+        if not np.isfinite(score).any():
+            return first_over
+        # the latest of equally good cuts
+        return head + len(score) - int(np.argmax(score[::-1]))
+
+    def _clip(self, chunk: Timeline) -> ClipPart:
+        # fields are built here, skip pydantic validation
+        return ClipPart.model_construct(
+            text=chunk.join(),
+            start=chunk.start,
+            end=chunk.end,
+            audio_file_path="",
+            sample_to_use=self.default_sample
+        )
+
+def _chunk_transcript(word_timestamps, default_sample, chunk_size_seconds=30, max_text_tokens=None, token_counter=None) -> List[ClipPart]:
     """
-    Chunk the word-level timestamps into segments of specified duration.
+    Chunk the word-level timestamps into segments of about the specified duration, cut at pauses and
+    sentence ends (see `TranscriptChunker`).
     Args:
-        word_timestamps: List of word-level timestamps from transcription.
+        word_timestamps: Word-level timestamps from transcription, a Timeline or a list of dicts.
         default_sample: Default speaker sample file to use for all chunks.
         chunk_size_seconds: Desired chunk size in seconds.
+        max_text_tokens: TTS token budget of a chunk, defaults to settings.TTS_MAX_TEXT_TOKENS.
+        token_counter: Callable returning the TTS tokens of a word, defaults to `estimate_text_tokens`.
     Returns:
         List of ClipPart objects representing the chunks.
     """
-    chunks = []
-
-    current_time = 0
-    while current_time < word_timestamps[-1]['end']:
-        # Find the words that fall within the current chunk window
-        chunk_words = [
-            word for word in word_timestamps 
-            if word['start'] >= current_time and word['end'] <= current_time + chunk_size_seconds
-        ]
-        
-        if not chunk_words:
-            # Move to the next potential start time if no words are in this chunk
-            current_time += chunk_size_seconds
-            continue
-
-        # Create a string representation of the chunk
-        chunk_text = " ".join([_["word"] for _ in chunk_words])
-        chunk_text.replace(" ,", ",")
-        chunks.append(ClipPart(
-            text=chunk_text,
-            start=chunk_words[0]['start'],
-            end=chunk_words[-1]['end'],
-            audio_file_path="",
-            sample_to_use=default_sample
-        ))
-        
-        # Move the window forward
-        current_time += chunk_size_seconds
-
-    return chunks
+    chunker = TranscriptChunker(default_sample=default_sample, chunk_size_seconds=chunk_size_seconds,
+                                max_text_tokens=max_text_tokens, token_counter=token_counter)
+    return chunker.feed(word_timestamps) + chunker.flush()
 
 
 def _get_video_duration(video_path: str) -> float:
@@ -73,39 +168,130 @@ def _get_video_duration(video_path: str) -> float:
     )
     return float(json.loads(result.stdout)["format"]["duration"])
 
-def _merge_audio_chunks_with_timing(clips, output_path: str, sr: int = 44100, total_video_dur: float | None = None):
+# How a chunk is written over the tail of the previous one when it runs past the next clip's start.
+OVERLAP_POLICIES = ("truncate", "crossfade", "sum")
+
+class _TimedChunkMerger:
+    """
+    Sample-accurate dub timeline. Every chunk is written at the sample offset of its clip start into one
+    preallocated float32 buffer (sized from the probed video duration, grown by doubling if needed), so
+    merging is linear in the video length and chunk length errors never shift the following clips.
+    Used by `_merge_audio_chunks_with_timing` and by the streaming pipeline, which adds chunks as they finish.
+
+    Overlap policies, for a chunk starting before the previous audio has ended:
+        truncate: the new chunk overwrites the tail of the previous one.
+        crossfade: like truncate, with a short linear crossfade at the new chunk's start.
+        sum: both are mixed, overlapping samples go through a soft limiter.
+    """
+
+    def __init__(self, sr: int = 44100, total_duration: float | None = None, overlap: str | None = None, crossfade_ms: float = 20.0):
+        overlap = overlap or settings.MERGE_OVERLAP_POLICY
+        if overlap not in OVERLAP_POLICIES:
+            raise ValueError(f"Unknown overlap policy {overlap!r}, expected one of {OVERLAP_POLICIES}")
+        self.sr = sr
+        self.overlap = overlap
+        self.crossfade_len = int(sr * crossfade_ms / 1000)
+        self._buffer = np.zeros(int(round((total_duration or 0.0) * sr)), dtype=np.float32)
+        self._end = 0  # one past the last written sample
+        self._last_offset = 0  # start of the last added chunk
+        self._taken = 0  # samples already handed out by `take_ready` / `take_rest`
+
+    @property
+    def current_time(self) -> float:
+        """End of the audio written so far, in seconds."""
+        return self._end / self.sr
+
+    def _reserve(self, length: int):
+        if length > len(self._buffer):
+            grown = np.zeros(max(length, 2 * len(self._buffer)), dtype=np.float32)
+            grown[:self._end] = self._buffer[:self._end]
+            self._buffer = grown
+
+    def add(self, clip: ClipPart, y: np.ndarray):
+        """Write the audio `y` (sampled at self.sr) of a clip at the offset of clip.start."""
+        self.add_at(clip.start, y)
+
+    def add_at(self, start: float, y: np.ndarray):
+        """Write the audio `y` (sampled at self.sr) starting at `start` seconds."""
+        self.add_at_sample(max(int(round(start * self.sr)), 0), y)
+
+    def add_at_sample(self, offset: int, y: np.ndarray):
+        """Write the audio `y` (sampled at self.sr) starting at sample `offset`."""
+        y = np.asarray(y, dtype=np.float32)
+        end = offset + len(y)
+        self._reserve(end)
+        overlap_len = max(min(self._end, end) - offset, 0)
+
+        if overlap_len == 0 or self.overlap == "truncate":
+            self._buffer[offset:end] = y
+        elif self.overlap == "crossfade":
+            fade_len = min(overlap_len, self.crossfade_len)
+            fade_in = np.linspace(0.0, 1.0, fade_len, endpoint=False, dtype=np.float32)
+            head = self._buffer[offset:offset + fade_len] * (1.0 - fade_in) + y[:fade_len] * fade_in
+            self._buffer[offset:end] = y
+            self._buffer[offset:offset + fade_len] = head
+        else:
+            self._buffer[offset:end] += y
+            mixed = self._buffer[offset:offset + overlap_len]
+            if np.abs(mixed).max(initial=0.0) > 1.0:
+                # soft limiter, ~linear for quiet samples and bounded by +-1
+                self._buffer[offset:offset + overlap_len] = np.tanh(mixed)
+        self._end = max(self._end, end)
+        self._last_offset = max(self._last_offset, offset)
+
+    def take_ready(self) -> np.ndarray:
+        """
+        Samples that no later chunk can change yet, not handed out before. Chunks are added in clip order,
+        so a later chunk never starts before the last added one and everything before its offset is final.
+        """
+        ready = self._buffer[self._taken:self._last_offset]
+        self._taken = max(self._taken, self._last_offset)
+        return ready
+
+    def take_rest(self, total_video_dur: float | None = None) -> np.ndarray:
+        """The remaining samples after the last chunk was added, padded like `finalize`."""
+        rest = self.finalize(total_video_dur)[self._taken:]
+        self._taken += len(rest)
+        return rest
+
+    def finalize(self, total_video_dur: float | None = None) -> np.ndarray:
+        """Return the merged audio, padded with silence till the end of the video if its duration is known."""
+        length = max(self._end, int(round((total_video_dur or 0.0) * self.sr)))
+        self._reserve(length)
+        return self._buffer[:length]
+
+    def write(self, output_path: str, total_video_dur: float | None = None) -> str:
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+        sf.write(output_path, self.finalize(total_video_dur), self.sr)
+        return output_path
+
+def _merge_audio_chunks_with_timing(clips, output_path: str, sr: int = 44100, total_video_dur: float | None = None, audios=None):
     """
     Merge audio chunks according to their start and end timestamps,
     adding silence where needed to match the video timeline.
+    If audios (one in-memory SynthesizedAudio per clip) is given, the chunk files are not read.
     """
-    os.makedirs(os.path.dirname(output_path), exist_ok=True)
-    final_audio = np.zeros(0, dtype=np.float32)
-    current_time = 0.0
+    merger = _build_timeline(clips, sr=sr, total_video_dur=total_video_dur, audios=audios)
+    return merger.write(output_path, total_video_dur=total_video_dur)
+
+def _build_timeline(clips, sr: int = 44100, total_video_dur: float | None = None, audios=None) -> _TimedChunkMerger:
+    """Add the audio of every clip (in-memory audios or the clip's audio_file_path) to a new timeline."""
+    merger = _TimedChunkMerger(sr=sr, total_duration=total_video_dur)
+    # sample offsets of all clip starts at once, rounded like `add_at` (np.rint and round both go to even)
+    offsets = np.maximum(np.rint(Timeline.from_clips(clips).starts * sr), 0).astype(np.int64).tolist()
 
-    for clip in clips:
+    for i, clip in enumerate(clips):
+        if audios is not None:
+            merger.add_at_sample(offsets[i], audios[i].resampled(sr))
+            continue
         if not os.path.exists(clip.audio_file_path):
             raise FileNotFoundError(f"Missing chunk: {clip.audio_file_path}")
-        
-        # Add silence for gap before this clip
-        if clip.start > current_time:
-            gap_dur = clip.start - current_time
-            silence = np.zeros(int(gap_dur * sr), dtype=np.float32)
-            final_audio = np.concatenate([final_audio, silence])
-            current_time += gap_dur
 
         # Load the chunk
         y, sr_ = librosa.load(clip.audio_file_path, sr=sr)
-        final_audio = np.concatenate([final_audio, y])
-        current_time += clip.end - clip.start
+        merger.add_at_sample(offsets[i], y)
 
-    # If total video duration is known, pad silence till the end
-    if total_video_dur and total_video_dur > current_time:
-        pad_dur = total_video_dur - current_time
-        silence = np.zeros(int(pad_dur * sr), dtype=np.float32)
-        final_audio = np.concatenate([final_audio, silence])
-
-    sf.write(output_path, final_audio, sr)
-    return output_path
+    return merger
 
 @DeprecationWarning
 def _merge_audio_chunks(chunk_paths: List[str], output_path: str) -> str:
@@ -165,41 +351,112 @@ def _mux_video_with_audio(video_path: str, audio_path: str, output_path: str):
     subprocess.run(cmd, check=True, capture_output=True)
     return output_path
 
-def overlay_audio_on_video(video_path: str, chunk_audio_dir: str, output_video_path: str, clips: List[ClipPart]) -> str:
+class _StreamingMuxer:
+    """
+    Mux the video with dub audio fed as raw float32 PCM over ffmpeg's stdin, no intermediate WAV.
+    Blocks can be fed while later chunks are still being synthesized, so the mux finishes shortly after
+    the last chunk. Same stream mapping as `_mux_video_with_audio`.
+    """
+
+    # Samples per write, keeps the float32 -> bytes copy small for long videos.
+    BLOCK_SAMPLES = 1 << 18
+
+    def __init__(self, video_path: str, output_path: str, sr: int = 44100):
+        if not os.path.exists(video_path):
+            raise FileNotFoundError(f"Video not found: {video_path}")
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+        self.output_path = output_path
+        cmd = [
+            "ffmpeg",
+            "-y",
+            "-loglevel", "error",
+            "-i", video_path,
+            "-f", "f32le", "-ar", str(sr), "-ac", "1",
+            "-i", "pipe:0",
+            "-c:v", "copy",          # keep video as is
+            "-map", "0:v:0",         # take video from input 0
+            "-map", "1:a:0",         # take audio from stdin
+            # video packets queue up while the audio is still being produced
+            "-max_muxing_queue_size", "65536",
+            "-shortest",             # end when shortest stream ends
+            output_path
+        ]
+        self._proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+
+    def feed(self, samples: np.ndarray):
+        for start in range(0, len(samples), self.BLOCK_SAMPLES):
+            self._proc.stdin.write(np.ascontiguousarray(samples[start:start + self.BLOCK_SAMPLES], dtype="<f4").tobytes())
+
+    def close(self) -> str:
+        """Signal the end of the audio and wait for ffmpeg, raises CalledProcessError on failure."""
+        self._proc.stdin.close()
+        stderr = self._proc.stderr.read()
+        returncode = self._proc.wait()
+        if returncode != 0:
+            raise subprocess.CalledProcessError(returncode, self._proc.args, stderr=stderr)
+        return self.output_path
+
+    def abort(self):
+        self._proc.kill()
+        self._proc.wait()
+
+def _mux_video_with_timeline(video_path: str, merger: _TimedChunkMerger, output_path: str, total_video_dur: float | None = None) -> str:
+    """Pipe a complete timeline into ffmpeg and mux it with the video."""
+    muxer = _StreamingMuxer(video_path, output_path, sr=merger.sr)
+    try:
+        muxer.feed(merger.take_ready())
+        muxer.feed(merger.take_rest(total_video_dur))
+    except BaseException:
+        muxer.abort()
+        raise
+    return muxer.close()
+
+def overlay_audio_on_video(video_path: str, chunk_audio_dir: str, output_video_path: str, clips: List[ClipPart], audios=None, write_merged_wav: bool = False) -> str:
     """
     Merge all audio chunks and overlay the combined dubbed audio over the source video.
 
     Args:
         video_path: Path to the source/original video.
-        chunk_audio_dir: Directory containing chunk{i}.wav audio files.
+        chunk_audio_dir: Directory containing chunk{i}.wav audio files, merged_dub.wav is written here.
         output_video_path: Path to save the final dubbed video.
         clips: List of ClipPart objects with timing and text info.
+        audios: Optional in-memory SynthesizedAudio of every clip (from generate_audio), replaces the chunk files.
+        write_merged_wav: Save merged_dub.wav and mux from it, by default the dub is piped into ffmpeg directly.
     Returns:
         Path to the final dubbed video.
     """
-    # Gather and sort audio chunks
-    chunk_files = sorted(
-        [os.path.join(chunk_audio_dir, f) for f in os.listdir(chunk_audio_dir) if f.endswith(".wav")],
-        key=lambda x: int(os.path.splitext(os.path.basename(x))[0].replace("chunk", "")),
-    )
-
-    if not chunk_files:
-        raise FileNotFoundError("No chunk audio files found in directory.")
-
+    os.makedirs(chunk_audio_dir, exist_ok=True)
     merged_audio_path = os.path.join(chunk_audio_dir, "merged_dub.wav")
-
-    logger.debug(f"Merging {len(chunk_files)} audio chunks...")
     video_dur = _get_video_duration(video_path)
 
-    for i, clip in enumerate(clips):
-        clip.audio_file_path = os.path.join(chunk_audio_dir, f"chunk{i}.wav")
+    if audios is not None:
+        if len(audios) != len(clips):
+            raise ValueError(f"got {len(audios)} audios for {len(clips)} clips")
+        logger.debug(f"Merging {len(audios)} in-memory audio chunks...")
+    else:
+        # Gather and sort audio chunks
+        chunk_files = sorted(
+            [os.path.join(chunk_audio_dir, f) for f in os.listdir(chunk_audio_dir) if f.endswith(".wav") and f.startswith("chunk")],
+            key=lambda x: int(os.path.splitext(os.path.basename(x))[0].replace("chunk", "")),
+        )
+
+        if not chunk_files:
+            raise FileNotFoundError("No chunk audio files found in directory.")
+
+        logger.debug(f"Merging {len(chunk_files)} audio chunks...")
+        for i, clip in enumerate(clips):
+            clip.audio_file_path = os.path.join(chunk_audio_dir, f"chunk{i}.wav")
 
     # New merge with silent gaps
-    _merge_audio_chunks_with_timing(clips, merged_audio_path, total_video_dur=video_dur)
+    merger = _build_timeline(clips, total_video_dur=video_dur, audios=audios)
     # _merge_audio_chunks(chunk_files, merged_audio_path)
 
     logger.debug("Overlaying dubbed audio onto video...")
-    _mux_video_with_audio(video_path, merged_audio_path, output_video_path)
+    if write_merged_wav:
+        merger.write(merged_audio_path, total_video_dur=video_dur)
+        _mux_video_with_audio(video_path, merged_audio_path, output_video_path)
+    else:
+        _mux_video_with_timeline(video_path, merger, output_video_path, total_video_dur=video_dur)
 
     logger.debug(f"Final dubbed video saved at: {output_video_path}")
     return output_video_path
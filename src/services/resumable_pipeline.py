@@ -0,0 +1,157 @@
+import asyncio
+import os
+import subprocess
+from typing import Callable, Optional
+
+from src.services.dag_executor import DagExecutor, Node
+from src.services.timeline import Timeline
+from src.services.download_video import download_video
+from src.services.transcribe_video import _extract_audio_to_wav, transcribe_audio
+from src.services.generate_audio import generate_audio, count_text_tokens
+from src.services.overlay_audio_on_video import (
+    ClipPart,
+    _chunk_transcript,
+    _get_video_duration,
+    _merge_audio_chunks_with_timing,
+    _mux_video_with_audio,
+)
+
+from src.config.settings import settings
+from src.config.logger_config import logger
+
+# Artifacts and completion markers of every resumable run live in RUNS_DIR/{run_id}.
+RUNS_DIR = "output/runs"
+
+
+def _file_params(path: str) -> dict:
+    """Identify an input file by path, size and modification time, so replacing it invalidates its node."""
+    stat = os.stat(path)
+    return {"path": os.path.abspath(path), "size": stat.st_size, "mtime": stat.st_mtime}
+
+
+async def run_resumable_pipeline(
+    run_id: str,
+    youtube_url: str = "",
+    sample_file: str = "",
+    video_file: str = "",
+    chunk_size_seconds: float = 10,
+    language: Optional[str] = None,
+    max_parallel: int = 2,
+    progress_callback: Optional[Callable[[str, float], None]] = None,
+) -> str:
+    """
+    Dub a video as a DAG of checkpointed stages: fetch, extract audio, transcribe, chunk,
+    one synthesis node per chunk, merge and mux (plus converting the voice sample).
+    Every node persists its artifacts and a completion marker under RUNS_DIR/{run_id}; calling this
+    again with the same run_id skips completed nodes and only runs missing or invalidated ones,
+    e.g. the single chunk that failed near the end of a long video.
+    Args:
+        run_id: Identifier of the run, reuse it to resume.
+        youtube_url: URL to download when video_file is not given.
+        sample_file: Speaker sample (mp3 or wav).
+        video_file: Local source video.
+        chunk_size_seconds: Desired chunk size in seconds.
+        language: Optional language code for transcription.
+        max_parallel: Maximum number of nodes running at the same time.
+        progress_callback: Optional callable receiving (stage, fraction).
+    Returns:
+        Path to the final dubbed video.
+    """
+    run_dir = os.path.join(RUNS_DIR, run_id)
+    chunk_dir = os.path.join(run_dir, "chunks")
+    os.makedirs(chunk_dir, exist_ok=True)
+    output_video_path = f"output/{run_id}_final_dubbed_video.mp4"
+    dag = DagExecutor(run_dir, max_parallel=max_parallel)
+
+    def report(stage, progress):
+        if progress_callback:
+            progress_callback(stage, progress)
+
+    async def fetch(_):
+        if video_file:
+            return {"video_path": video_file, "files": [video_file]}
+        details = await download_video(url=youtube_url, source="youtube", output_dir=os.path.join(run_dir, "source"))
+        return {"video_path": details["video_path"], "files": [details["video_path"]]}
+
+    async def prepare_sample(_):
+        if not sample_file.endswith(".mp3"):
+            return {"sample_path": sample_file, "files": [sample_file]}
+        wav_path = os.path.join(run_dir, "sample.wav")
+        await asyncio.to_thread(subprocess.run, ["ffmpeg", "-y", "-i", sample_file, wav_path], check=True, capture_output=True)
+        return {"sample_path": wav_path, "files": [wav_path]}
+
+    async def extract_audio(inputs):
+        wav_path = os.path.join(run_dir, "audio_16k.wav")
+        if not await asyncio.to_thread(_extract_audio_to_wav, inputs["fetch"]["video_path"], wav_path):
+            raise RuntimeError("Failed to extract audio for transcription.")
+        return {"wav_path": wav_path, "files": [wav_path]}
+
+    async def transcribe(inputs):
+        transcription = await asyncio.to_thread(transcribe_audio, inputs["extract_audio"]["wav_path"], language)
+        # Only the word timeline feeds the chunk node, keep it in the compact binary form.
+        transcript_path = transcription["word_level_timestamps"].save(os.path.join(run_dir, "transcript.tln"))
+        return {"transcript_path": transcript_path, "files": [transcript_path]}
+
+    async def chunk(inputs):
+        words = Timeline.load(inputs["transcribe"]["transcript_path"])
+        clips = _chunk_transcript(words, default_sample="", chunk_size_seconds=chunk_size_seconds, token_counter=count_text_tokens)
+        if not clips:
+            raise ValueError("Transcript has no words to dub.")
+        return {"clips": [clip.model_dump(include={"text", "start", "end"}) for clip in clips]}
+
+    report("fetch", 0.0)
+    await dag.run([
+        Node("fetch", fetch, params={"video": _file_params(video_file)} if video_file else {"youtube_url": youtube_url}),
+        Node("prepare_sample", prepare_sample, params={"sample": _file_params(sample_file)}),
+        Node("extract_audio", extract_audio, deps=["fetch"]),
+        Node("transcribe", transcribe, deps=["extract_audio"], params={"language": language, "format": "tln"}),
+        Node("chunk", chunk, deps=["transcribe"], params={"chunk_size_seconds": chunk_size_seconds, "max_text_tokens": settings.TTS_MAX_TEXT_TOKENS}),
+    ])
+
+    clips = [ClipPart(**clip) for clip in dag.result("chunk")["clips"]]
+    synthesized = 0
+    report("synthesize", 0.3)
+
+    def synthesize(index: int, clip: ClipPart):
+        async def fn(inputs):
+            nonlocal synthesized
+            audio_path = os.path.join(chunk_dir, f"chunk{index}.wav")
+            await generate_audio(
+                text=clip.text,
+                output_filepath=audio_path,
+                sample_filepath=inputs["prepare_sample"]["sample_path"],
+                video_sec=clip.end - clip.start,
+            )
+            synthesized += 1
+            report("synthesize", 0.3 + 0.6 * synthesized / len(clips))
+            return {"audio_path": audio_path, "files": [audio_path]}
+        return fn
+
+    synth_names = [f"synthesize_{i}" for i in range(len(clips))]
+
+    async def merge(inputs):
+        for name, clip in zip(synth_names, clips):
+            clip.audio_file_path = inputs[name]["audio_path"]
+        merged_path = os.path.join(run_dir, "merged_dub.wav")
+        video_dur = await asyncio.to_thread(_get_video_duration, inputs["fetch"]["video_path"])
+        await asyncio.to_thread(_merge_audio_chunks_with_timing, clips, merged_path, total_video_dur=video_dur)
+        return {"merged_path": merged_path, "files": [merged_path]}
+
+    async def mux(inputs):
+        await asyncio.to_thread(_mux_video_with_audio, inputs["fetch"]["video_path"], inputs["merge"]["merged_path"], output_video_path)
+        return {"output_video_path": output_video_path, "files": [output_video_path]}
+
+    await dag.run(
+        [
+            Node(name, synthesize(i, clip), deps=["prepare_sample"], params=clip.model_dump(include={"text", "start", "end"}))
+            for i, (name, clip) in enumerate(zip(synth_names, clips))
+        ]
+        + [
+            Node("merge", merge, deps=["fetch"] + synth_names),
+            Node("mux", mux, deps=["fetch", "merge"]),
+        ]
+    )
+
+    logger.info(f"Run {run_id}: executed {len(dag.executed)} node(s), reused {len(dag.skipped)} completed node(s).")
+    report("done", 1.0)
+    return output_video_path
@@ -0,0 +1,182 @@
+import asyncio
+import json
+import os
+from typing import Callable, List, Optional
+
+from src.services.timeline import Timeline
+from src.services.transcribe_video import transcribe_video_stream
+from src.services.generate_audio import generate_audio, count_text_tokens, synthesis_cache_stats
+from src.services.overlay_audio_on_video import (
+    TranscriptChunker,
+    _TimedChunkMerger,
+    _StreamingMuxer,
+    _get_video_duration,
+    _mux_video_with_audio,
+)
+
+from src.config.logger_config import logger
+
+# Marks the end of a stage's output on the queues between stages.
+_STAGE_DONE = None
+
+
+async def _transcribe_stage(video_path: str, chunker: TranscriptChunker, clip_queue: asyncio.Queue, words: List[Timeline], num_workers: int):
+    """Transcribe the video and push (index, ClipPart) pairs as soon as the chunker cuts them."""
+    index = 0
+    async for new_words in transcribe_video_stream(video_path=video_path):
+        words.append(new_words)
+        for clip in chunker.feed(new_words):
+            logger.debug(f"Chunk {index} ready for synthesis ({clip.start:.2f}s - {clip.end:.2f}s)")
+            await clip_queue.put((index, clip))
+            index += 1
+
+    for clip in chunker.flush():
+        await clip_queue.put((index, clip))
+        index += 1
+
+    logger.info(f"Transcription finished, {index} chunks queued.")
+    for _ in range(num_workers):
+        await clip_queue.put(_STAGE_DONE)
+
+
+async def _synthesis_stage(chunk_audio_dir: str, clip_queue: asyncio.Queue, done_queue: asyncio.Queue, keep_chunk_files: bool = False):
+    """Synthesize queued clips and hand (index, clip, audio) to the merge stage, optionally saving chunk{i}.wav."""
+    while True:
+        item = await clip_queue.get()
+        if item is _STAGE_DONE:
+            await done_queue.put(_STAGE_DONE)
+            return
+
+        index, clip = item
+        if keep_chunk_files:
+            clip.audio_file_path = os.path.join(chunk_audio_dir, f"chunk{index}.wav")
+        audio = await generate_audio(
+            text=clip.text,
+            output_filepath=clip.audio_file_path or None,
+            sample_filepath=clip.sample_to_use,
+            video_sec=clip.end - clip.start,
+        )
+        await done_queue.put((index, clip, audio))
+
+
+async def _merge_stage(
+    done_queue: asyncio.Queue,
+    merger: _TimedChunkMerger,
+    num_workers: int,
+    video_dur: float,
+    progress_callback: Optional[Callable[[float], None]] = None,
+    muxer: Optional[_StreamingMuxer] = None,
+) -> int:
+    """
+    Write finished chunks into the dub timeline in clip order, feeding the finalized part of the timeline
+    to the muxer if given. Returns the number of merged chunks.
+    """
+    pending = {}
+    next_index = 0
+    finished_workers = 0
+    while finished_workers < num_workers:
+        item = await done_queue.get()
+        if item is _STAGE_DONE:
+            finished_workers += 1
+            continue
+
+        index, clip, audio = item
+        pending[index] = (clip, audio)
+        # Workers may finish out of order, only merge the contiguous prefix.
+        while next_index in pending:
+            clip, audio = pending.pop(next_index)
+            y = await asyncio.to_thread(audio.resampled, merger.sr)
+            merger.add(clip, y)
+            if muxer is not None:
+                await asyncio.to_thread(muxer.feed, merger.take_ready())
+            next_index += 1
+            if progress_callback and video_dur > 0:
+                progress_callback(min(merger.current_time / video_dur, 1.0))
+
+    return next_index
+
+
+async def run_streaming_pipeline(
+    video_path: str,
+    sample_file: str,
+    chunk_audio_dir: str,
+    output_video_path: str,
+    chunk_size_seconds: float = 30,
+    transcript_path: Optional[str] = None,
+    tts_workers: int = 1,
+    queue_size: int = 4,
+    progress_callback: Optional[Callable[[float], None]] = None,
+    keep_chunk_files: bool = False,
+    stream_mux: bool = True,
+) -> str:
+    """
+    Dub a video with transcription, synthesis and merging running as overlapped stages.
+    Clips are emitted as soon as the aligned words of a chunk are available, a bounded queue feeds
+    them to the TTS workers and finished chunks are written into the timeline while later ones synthesize,
+    so wall-clock time approaches that of the slowest stage instead of the sum of all stages.
+    Args:
+        video_path: Path to the source/original video.
+        sample_file: Speaker sample (wav) used for every chunk.
+        chunk_audio_dir: Directory for merged_dub.wav without stream_mux, and the chunk{i}.wav files with keep_chunk_files.
+        output_video_path: Path to save the final dubbed video.
+        chunk_size_seconds: Desired chunk size in seconds.
+        transcript_path: Optional path to dump the word-level transcript to.
+        tts_workers: Number of synthesis workers. Model inference is serialized, extra workers overlap
+            the post-processing (time stretching) of one chunk with the inference of the next.
+        queue_size: Maximum number of chunks waiting for synthesis, bounds how far ASR runs ahead.
+        progress_callback: Optional callable receiving the fraction of the video timeline dubbed so far.
+        keep_chunk_files: Also save every chunk as chunk{i}.wav (debugging), chunks are merged from memory either way.
+        stream_mux: Pipe the timeline into ffmpeg while later chunks are synthesized instead of writing
+            merged_dub.wav and muxing it after the last chunk.
+    Returns:
+        Path to the final dubbed video.
+    """
+    os.makedirs(chunk_audio_dir, exist_ok=True)
+    clip_queue = asyncio.Queue(maxsize=queue_size)
+    done_queue = asyncio.Queue()
+    chunker = TranscriptChunker(default_sample=sample_file, chunk_size_seconds=chunk_size_seconds, token_counter=count_text_tokens)
+    words: List[Timeline] = []
+    video_dur = await asyncio.to_thread(_get_video_duration, video_path)
+    merger = _TimedChunkMerger(total_duration=video_dur)
+    muxer = _StreamingMuxer(video_path, output_video_path, sr=merger.sr) if stream_mux else None
+
+    try:
+        async with asyncio.TaskGroup() as tg:
+            tg.create_task(_transcribe_stage(video_path, chunker, clip_queue, words, tts_workers))
+            for _ in range(tts_workers):
+                tg.create_task(_synthesis_stage(chunk_audio_dir, clip_queue, done_queue, keep_chunk_files))
+            merge_task = tg.create_task(_merge_stage(done_queue, merger, tts_workers, video_dur, progress_callback, muxer))
+
+        if not merge_task.result():
+            raise FileNotFoundError("No chunk audio was synthesized.")
+        logger.info(f"Synthesis cache: {synthesis_cache_stats()}")
+    except BaseException:
+        if muxer is not None:
+            muxer.abort()
+        raise
+
+    if transcript_path:
+        timeline = Timeline.concat(words)
+        with open(transcript_path, "w", encoding='utf-8') as fh:
+            json.dump({
+                "complete_transcript": timeline.join(),
+                "word_level_timestamps": timeline.to_words(),
+            }, fh, ensure_ascii=False, indent=4)
+
+    if muxer is not None:
+        logger.debug("Finishing the streaming mux...")
+        try:
+            await asyncio.to_thread(muxer.feed, merger.take_rest(video_dur))
+        except BaseException:
+            muxer.abort()
+            raise
+        await asyncio.to_thread(muxer.close)
+    else:
+        merged_audio_path = os.path.join(chunk_audio_dir, "merged_dub.wav")
+        merger.write(merged_audio_path, total_video_dur=video_dur)
+
+        logger.debug("Overlaying dubbed audio onto video...")
+        await asyncio.to_thread(_mux_video_with_audio, video_path, merged_audio_path, output_video_path)
+
+    logger.debug(f"Final dubbed video saved at: {output_video_path}")
+    return output_video_path
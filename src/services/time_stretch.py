@@ -0,0 +1,81 @@
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+
+def _hann(frame_len: int) -> np.ndarray:
+    # Periodic Hann window: overlapping copies at hop = frame_len / 2 sum to exactly one.
+    return (0.5 - 0.5 * np.cos(2 * np.pi * np.arange(frame_len) / frame_len)).astype(np.float32)
+
+
+def stretch_to_length(y: np.ndarray, target_len: int, sr: int, frame_ms: float = 40.0, tolerance_ms: float = 10.0) -> np.ndarray:
+    """
+    Change the duration of mono audio without changing its pitch (WSOLA, waveform similarity overlap-add).
+    Output frames are taken at a fixed hop from the input at the nominal position `k * hop * rate`,
+    shifted by up to `tolerance_ms` so that each frame lines up with the natural continuation of the
+    previous one. The offset search of a frame is one matrix-vector product over all candidate offsets.
+    Args:
+        y: Mono audio samples, 1-D.
+        target_len: Number of output samples.
+        sr: Sample rate of y.
+        frame_ms: Analysis frame length; 40 ms keeps a couple of pitch periods per frame for speech.
+        tolerance_ms: Maximum shift of a frame from its nominal input position.
+    Returns:
+        float32 array of exactly target_len samples.
+    """
+    y = np.asarray(y, dtype=np.float32)
+    if y.ndim != 1:
+        raise ValueError(f"expected mono audio, got shape {y.shape}")
+    target_len = int(target_len)
+    if target_len <= 0 or len(y) == 0:
+        return np.zeros(max(target_len, 0), dtype=np.float32)
+    if target_len == len(y):
+        return y.copy()
+
+    frame_len = max(2 * int(sr * frame_ms / 2000), 2)
+    half, hop = frame_len // 2, frame_len // 2
+    tol = max(int(sr * tolerance_ms / 1000), 0)
+    if len(y) < frame_len:
+        # Too short for overlap-add, resample linearly.
+        return np.interp(np.linspace(0, len(y) - 1, target_len), np.arange(len(y)), y).astype(np.float32)
+
+    rate = len(y) / target_len
+    n_frames = int(np.ceil(target_len / hop)) + 1
+    # Padding: `half` so the first frame is centred on sample 0, `tol` for the search on both sides.
+    pad_left = half + tol
+    padded = np.pad(y, (pad_left, 2 * frame_len + 2 * tol + 2 * int(np.ceil(hop * rate))))
+    window = _hann(frame_len)
+    out = np.zeros(n_frames * hop + frame_len, dtype=np.float32)
+
+    prev = tol
+    out[:frame_len] += padded[prev:prev + frame_len] * window
+    for k in range(1, n_frames):
+        nominal = tol + int(round(k * hop * rate))
+        # The previous frame continued by one hop is what a seamless next frame looks like.
+        template = padded[prev + hop:prev + hop + frame_len]
+        region = padded[nominal - tol:nominal + tol + frame_len]
+        candidates = sliding_window_view(region, frame_len)
+        prev = nominal - tol + int(np.argmax(candidates @ template))
+        out[k * hop:k * hop + frame_len] += padded[prev:prev + frame_len] * window
+    return out[half:half + target_len]
+
+
+def time_stretch(y: np.ndarray, rate: float, sr: int, **kwargs) -> np.ndarray:
+    """
+    Speed mono audio up (rate > 1) or slow it down (rate < 1) by any factor, like ffmpeg `atempo`
+    but in memory and without its 0.5-2.0 range limit per filter.
+    Args:
+        y: Mono audio samples, 1-D.
+        rate: Playback speed factor.
+        sr: Sample rate of y.
+        kwargs: Passed to `stretch_to_length`.
+    Returns:
+        float32 array of round(len(y) / rate) samples.
+    """
+    if rate <= 0:
+        raise ValueError(f"stretch rate must be positive, got {rate}")
+    return stretch_to_length(y, int(round(len(y) / rate)), sr, **kwargs)
+
+
+def stretch_to_duration(y: np.ndarray, sr: int, target_sec: float, **kwargs) -> np.ndarray:
+    """Stretch mono audio to last exactly target_sec seconds (rounded to whole samples)."""
+    return stretch_to_length(y, int(round(target_sec * sr)), sr, **kwargs)
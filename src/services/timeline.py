@@ -0,0 +1,227 @@
+import struct
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+# Binary layout: magic, version, count, text length in bytes, then starts (f8), ends (f8), offsets (u4, count + 1)
+# and the UTF-8 text. Little endian throughout.
+_MAGIC = b"TLN"
+_FORMAT_VERSION = 1
+_HEADER = struct.Struct("<3sBQQ")
+
+
+def _offsets(lengths: List[int], dtype=np.int64) -> np.ndarray:
+    """[0, l0, l0 + l1, ...] for span lengths."""
+    offsets = np.zeros(len(lengths) + 1, dtype=dtype)
+    if lengths:
+        offsets[1:] = np.cumsum(np.asarray(lengths, dtype=np.int64))
+    return offsets
+
+
+class Timeline:
+    """
+    Time-ordered text spans (words of a transcript or clips of a dub) stored as parallel NumPy arrays:
+    float64 `starts` / `ends` and int64 `offsets` into one shared text buffer, span i being
+    `text[offsets[i]:offsets[i + 1]]`. Millions of words cost a few arrays instead of millions of dicts.
+
+    Slicing returns a view sharing the arrays and the text buffer, `range(t0, t1)` finds the spans of a time
+    window by binary search, and `to_bytes` / `from_bytes` give a compact binary form.
+    """
+
+    __slots__ = ("starts", "ends", "offsets", "_text")
+
+    def __init__(self, starts: np.ndarray, ends: np.ndarray, offsets: np.ndarray, text: str):
+        if not (len(starts) == len(ends) == len(offsets) - 1):
+            raise ValueError(f"inconsistent timeline arrays: {len(starts)} starts, {len(ends)} ends, {len(offsets)} offsets")
+        self.starts = starts
+        self.ends = ends
+        self.offsets = offsets
+        self._text = text
+
+    @classmethod
+    def empty(cls) -> "Timeline":
+        return cls(np.zeros(0), np.zeros(0), np.zeros(1, dtype=np.int64), "")
+
+    @classmethod
+    def from_spans(cls, spans: Iterable[Tuple[str, float, float]]) -> "Timeline":
+        """Build a timeline from (text, start, end) tuples."""
+        texts, starts, ends = [], [], []
+        for text, start, end in spans:
+            texts.append(text)
+            starts.append(start)
+            ends.append(end)
+        offsets = _offsets([len(t) for t in texts])
+        return cls(np.asarray(starts, dtype=np.float64), np.asarray(ends, dtype=np.float64), offsets, "".join(texts))
+
+    @classmethod
+    def from_words(cls, words: Iterable[Dict], last_end: Optional[float] = None) -> "Timeline":
+        """
+        Build a timeline from {"word", "start", "end"} dicts. Aligners may leave words (e.g. numbers) without
+        timestamps, those are placed between their aligned neighbours: from the end of the previous word
+        (`last_end` for the first one) to the start of the next aligned word.
+        """
+        words = list(words)
+        # start of the next aligned word after every word
+        next_starts, following = [None] * len(words), None
+        for i in range(len(words) - 1, -1, -1):
+            next_starts[i] = following
+            if words[i].get("start") is not None:
+                following = words[i]["start"]
+
+        def spans():
+            nonlocal last_end
+            for word, next_start in zip(words, next_starts):
+                start = word.get("start")
+                if start is None:
+                    start = last_end if last_end is not None else next_start if next_start is not None else 0.0
+                    end = max(start, next_start) if next_start is not None else start
+                else:
+                    end = word.get("end")
+                    end = start if end is None else end
+                last_end = end
+                yield word["word"], start, end
+        return cls.from_spans(spans())
+
+    @classmethod
+    def from_clips(cls, clips: Sequence) -> "Timeline":
+        """Build a timeline from objects with text / start / end attributes, e.g. ClipPart."""
+        return cls.from_spans((clip.text, clip.start, clip.end) for clip in clips)
+
+    @classmethod
+    def concat(cls, timelines: Sequence["Timeline"]) -> "Timeline":
+        timelines = [t for t in timelines if len(t)]
+        if not timelines:
+            return cls.empty()
+        if len(timelines) == 1:
+            return timelines[0]
+        texts, offsets, base = [], [np.zeros(1, dtype=np.int64)], 0
+        for t in timelines:
+            text = t.text_buffer()
+            offsets.append(t.offsets[1:] - t.offsets[0] + base)
+            texts.append(text)
+            base += len(text)
+        return cls(np.concatenate([t.starts for t in timelines]), np.concatenate([t.ends for t in timelines]),
+                   np.concatenate(offsets), "".join(texts))
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step != 1:
+                raise ValueError("timeline slices must be contiguous")
+            stop = max(stop, start)
+            return Timeline(self.starts[start:stop], self.ends[start:stop], self.offsets[start:stop + 1], self._text)
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(f"timeline index {index} out of range")
+        return self.text(index), float(self.starts[index]), float(self.ends[index])
+
+    def __iter__(self) -> Iterator[Tuple[str, float, float]]:
+        offsets = self.offsets.tolist()
+        for i, (start, end) in enumerate(zip(self.starts.tolist(), self.ends.tolist())):
+            yield self._text[offsets[i]:offsets[i + 1]], start, end
+
+    def text(self, index: int) -> str:
+        return self._text[self.offsets[index]:self.offsets[index + 1]]
+
+    def texts(self) -> List[str]:
+        offsets = self.offsets.tolist()
+        return [self._text[a:b] for a, b in zip(offsets[:-1], offsets[1:])]
+
+    def join(self, sep: str = " ") -> str:
+        return sep.join(self.texts())
+
+    def text_buffer(self) -> str:
+        """The text of this timeline's spans only (a view's part of the shared buffer)."""
+        return self._text[self.offsets[0]:self.offsets[-1]]
+
+    @property
+    def start(self) -> float:
+        return float(self.starts[0]) if len(self) else 0.0
+
+    @property
+    def end(self) -> float:
+        return float(self.ends[-1]) if len(self) else 0.0
+
+    def index_at(self, t: float) -> int:
+        """Index of the last span starting at or before t (-1 if none)."""
+        return int(np.searchsorted(self.starts, t, side="right")) - 1
+
+    def range(self, t0: float, t1: float) -> "Timeline":
+        """View of the spans overlapping [t0, t1). Assumes ends are ordered like starts (true for words and clips)."""
+        i = int(np.searchsorted(self.ends, t0, side="right"))
+        j = int(np.searchsorted(self.starts, t1, side="left"))
+        return self[i:max(i, j)]
+
+    def within(self, t0: float, t1: float) -> "Timeline":
+        """View of the spans lying completely inside [t0, t1]."""
+        i = int(np.searchsorted(self.starts, t0, side="left"))
+        j = int(np.searchsorted(self.ends, t1, side="right"))
+        return self[i:max(i, j)]
+
+    def gaps(self) -> np.ndarray:
+        """Pause between every span and the next one (len - 1 values, never negative)."""
+        return np.maximum(self.starts[1:] - self.ends[:-1], 0.0)
+
+    def to_words(self) -> List[Dict]:
+        """The {"word", "start", "end"} dict form used by the JSON transcripts."""
+        return [{"word": text, "start": start, "end": end} for text, start, end in self]
+
+    def to_bytes(self) -> bytes:
+        text = self.text_buffer().encode("utf-8")
+        # byte offsets of every span into the encoded text
+        byte_offsets = _offsets([len(t.encode("utf-8")) for t in self.texts()], dtype="<u4")
+        return b"".join([
+            _HEADER.pack(_MAGIC, _FORMAT_VERSION, len(self), len(text)),
+            self.starts.astype("<f8").tobytes(),
+            self.ends.astype("<f8").tobytes(),
+            byte_offsets.tobytes(),
+            text,
+        ])
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "Timeline":
+        magic, version, count, text_len = _HEADER.unpack_from(data, 0)
+        if magic != _MAGIC or version != _FORMAT_VERSION:
+            raise ValueError(f"not a timeline (magic {magic!r}, version {version})")
+        pos = _HEADER.size
+        starts = np.frombuffer(data, dtype="<f8", count=count, offset=pos)
+        pos += 8 * count
+        ends = np.frombuffer(data, dtype="<f8", count=count, offset=pos)
+        pos += 8 * count
+        byte_offsets = np.frombuffer(data, dtype="<u4", count=count + 1, offset=pos)
+        pos += 4 * (count + 1)
+        raw = data[pos:pos + text_len]
+        if len(raw) != text_len:
+            raise ValueError("truncated timeline")
+        text = raw.decode("utf-8")
+        if len(text) == text_len:
+            offsets = byte_offsets.astype(np.int64)
+        else:
+            # non-ASCII text: byte offsets differ from character offsets
+            bounds = byte_offsets.tolist()
+            offsets = _offsets([len(raw[a:b].decode("utf-8")) for a, b in zip(bounds[:-1], bounds[1:])])
+        return cls(starts, ends, offsets, text)
+
+    def save(self, path: str) -> str:
+        with open(path, "wb") as fh:
+            fh.write(self.to_bytes())
+        return path
+
+    @classmethod
+    def load(cls, path: str) -> "Timeline":
+        with open(path, "rb") as fh:
+            return cls.from_bytes(fh.read())
+
+    def __repr__(self) -> str:
+        return f"Timeline({len(self)} spans, {self.start:.2f}s - {self.end:.2f}s)"
+
+
+def as_timeline(words, last_end: Optional[float] = None) -> Optional[Timeline]:
+    """Accept a Timeline or a list of {"word", "start", "end"} dicts."""
+    if words is None or isinstance(words, Timeline):
+        return words
+    return Timeline.from_words(words, last_end=last_end)
@@ -1,17 +1,29 @@
+import asyncio
 import json
 import os
 import subprocess
 import tempfile
-from typing import Dict, Optional
+from typing import AsyncIterator, Dict, Optional
+import numpy as np
 import torch
 import whisperx
+from whisperx.alignment import DEFAULT_ALIGN_MODELS_HF, DEFAULT_ALIGN_MODELS_TORCH
 
+from src.services.timeline import Timeline
+from src.services.transcript_cache import load_cached_transcript, store_transcript, transcript_cache_key, transcript_to_json
 from src.config.logger_config import logger
 
 WHISPERX_MODEL = None
 ALIGN_MODEL_EN = None
 METADATA_EN = None
 DEVICE = "cpu"
+WHISPERX_MODEL_SIZE = "small"
+
+# Window length used by `transcribe_video_stream` to hand words downstream before the whole video is transcribed.
+ASR_WINDOW_SECONDS = 60
+# How far around a window boundary to look for a quiet spot to cut at.
+ASR_CUT_SEARCH_SECONDS = 2.0
+ASR_SAMPLE_RATE = 16000
 
 def _load_models():
     global WHISPERX_MODEL, ALIGN_MODEL_EN, METADATA_EN, DEVICE
@@ -24,7 +36,7 @@ def _load_models():
             os.makedirs("src/models/whisperx", exist_ok=True)
         
         WHISPERX_MODEL = whisperx.load_model(
-            "small",
+            WHISPERX_MODEL_SIZE,
             device=DEVICE,
             download_root="src/models/whisperx",
             compute_type=compute_type,
@@ -72,7 +84,7 @@ def _whisperx_transcribe(audio_path: str, language: Optional[str]) -> Dict:
         audio_path: Path to audio file.
         language: Language code (e.g., 'en' for English).
     Returns:
-        Transcription result with word-level timestamps.
+        Transcription result with the word-level timestamps as a Timeline.
     """
     global WHISPERX_MODEL, ALIGN_MODEL_EN, METADATA_EN, DEVICE
     # Transcribe
@@ -82,26 +94,12 @@ def _whisperx_transcribe(audio_path: str, language: Optional[str]) -> Dict:
 
     # Align
     logger.info("Running alignment to produce word timestamps ...")
-    if language and language != "en":
-        align_model, metadata = whisperx.load_align_model(
-            language_code=language, device=DEVICE
-        )
-    else:
-        align_model, metadata = ALIGN_MODEL_EN, METADATA_EN
+    align_model, metadata = _get_align_model(language)
     result_aligned = whisperx.align(
         result["segments"], align_model, metadata, audio_path, DEVICE
     )
 
-    words = []
-    for seg in result_aligned["segments"]:
-        for w in seg.get("words", []):
-            words.append(
-                {
-                    "word": w.get("word"),
-                    "start": round(w.get("start", 0.0), 3),
-                    "end": round(w.get("end", 0.0), 3),
-                }
-            )
+    words = _collect_words(result_aligned["segments"])
 
     final_response = {
         "complete_transcript": " ".join([_.get("text", "") for _ in result["segments"]]),
@@ -110,19 +108,87 @@ def _whisperx_transcribe(audio_path: str, language: Optional[str]) -> Dict:
 
     return final_response
 
+def _get_align_model(language: Optional[str]):
+    """Return the (align_model, metadata) pair for a language, reusing the preloaded English model."""
+    global ALIGN_MODEL_EN, METADATA_EN, DEVICE
+    if language and language != "en":
+        return whisperx.load_align_model(language_code=language, device=DEVICE)
+    return ALIGN_MODEL_EN, METADATA_EN
+
+def _align_model_name(language: Optional[str]) -> str:
+    """Name of the alignment model `_get_align_model` uses for a language."""
+    language = language if language and language != "en" else "en"
+    return DEFAULT_ALIGN_MODELS_TORCH.get(language) or DEFAULT_ALIGN_MODELS_HF.get(language, language)
+
+def _transcript_cache_key(wav_path: str, language: Optional[str], window_seconds: Optional[float] = None) -> str:
+    """Transcript cache key of a whole-file transcription, or of a streaming one with `window_seconds` windows."""
+    mode = "full" if window_seconds is None else "stream"
+    return transcript_cache_key(wav_path, WHISPERX_MODEL_SIZE, language, _align_model_name(language),
+                                mode=mode, window_seconds=window_seconds)
+
+def _collect_words(aligned_segments, offset: float = 0.0) -> Timeline:
+    """
+    Flatten aligned whisperx segments into a word Timeline shifted by `offset` seconds.
+    Words whisperx could not align (typically numbers such as "2005") come without timestamps and are given
+    none here: `Timeline.from_words` places them between their aligned neighbours, from the segment start.
+    """
+    timelines, last_end = [], offset
+    for seg in aligned_segments:
+        words = [
+            {"word": w.get("word"),
+             **{key: round(w[key] + offset, 3) for key in ("start", "end") if w.get(key) is not None}}
+            for w in seg.get("words", [])
+        ]
+        if seg.get("start") is not None:
+            last_end = round(seg["start"] + offset, 3)
+        timeline = Timeline.from_words(words, last_end=last_end)
+        if len(timeline):
+            last_end = timeline.end
+        timelines.append(timeline)
+    return Timeline.concat(timelines)
+
+def _find_quiet_cut(audio: np.ndarray, target: int, search: int, frame: int = 320) -> int:
+    """Return the sample index of the quietest 20 ms frame within `search` samples of `target`."""
+    lo = max(0, target - search)
+    hi = min(len(audio), target + search)
+    n_frames = (hi - lo) // frame
+    if n_frames < 2:
+        return min(target, len(audio))
+    frames = audio[lo:lo + n_frames * frame].reshape(n_frames, frame)
+    energy = np.einsum("ij,ij->i", frames, frames)
+    return lo + int(np.argmin(energy)) * frame + frame // 2
+
+def _asr_windows(audio: np.ndarray, window_seconds: float = ASR_WINDOW_SECONDS):
+    """Split 16 kHz audio into roughly `window_seconds` long (start, end) sample ranges cut at quiet spots."""
+    window = int(window_seconds * ASR_SAMPLE_RATE)
+    search = int(ASR_CUT_SEARCH_SECONDS * ASR_SAMPLE_RATE)
+    start = 0
+    while start < len(audio):
+        end = start + window
+        if end + search >= len(audio):
+            end = len(audio)
+        else:
+            end = _find_quiet_cut(audio, end, search)
+        yield start, end
+        start = end
+
 async def transcribe_video(
     video_path: str,
     language: Optional[str] = None,
     tmp_dir: Optional[str] = None,
+    use_cache: bool = True,
 ) -> Dict:
     """
     Create a word-level transcript from a video.
+    Transcripts are cached by a hash of the extracted audio, model size, language and alignment model,
+    so re-dubbing the same source skips WhisperX entirely.
     Args:
         video_path: Path to the video file.
         language: Optional language code for transcription (e.g., 'en' for English).
         tmp_dir: Optional temporary directory for intermediate files.
+        use_cache: Look up and store the transcript in the transcript cache.
     Returns:
-        A list of {"word": str, "start": float, "end": float} entries with entire transcript.
+        {"complete_transcript": str, "word_level_timestamps": Timeline} for the entire video.
     """
     if not os.path.exists(video_path):
         raise FileNotFoundError(f"Video not found: {video_path}")
@@ -138,19 +204,111 @@ async def transcribe_video(
         raise RuntimeError("Failed to extract audio for transcription.")
     
     try:
-        logger.info("Attempting whisperx transcription ...")
-        return _whisperx_transcribe(wav_path, language)
+        return transcribe_audio(wav_path, language, use_cache=use_cache)
     except Exception as e_whx:
         logger.info(f"whisperx failed or not available: {e_whx}")
 
+def transcribe_audio(wav_path: str, language: Optional[str] = None, use_cache: bool = True) -> Dict:
+    """
+    Create a word-level transcript from an extracted 16 kHz mono WAV, going through the transcript cache.
+    Args:
+        wav_path: Path to the WAV produced by `_extract_audio_to_wav`.
+        language: Optional language code for transcription (e.g., 'en' for English).
+        use_cache: Look up and store the transcript in the transcript cache.
+    Returns:
+        {"complete_transcript": str, "word_level_timestamps": Timeline}
+    """
+    cache_key = _transcript_cache_key(wav_path, language) if use_cache else None
+    if cache_key:
+        cached = load_cached_transcript(cache_key)
+        if cached is not None:
+            logger.info(f"Transcript cache hit ({cache_key[:12]}), skipping ASR.")
+            return cached
+
+    logger.info("Attempting whisperx transcription ...")
+    transcription = _whisperx_transcribe(wav_path, language)
+    if cache_key:
+        store_transcript(cache_key, transcription)
+    return transcription
+
+
+async def transcribe_video_stream(
+    video_path: str,
+    language: Optional[str] = None,
+    tmp_dir: Optional[str] = None,
+    use_cache: bool = True,
+) -> AsyncIterator[Timeline]:
+    """
+    Create a word-level transcript from a video, yielding aligned words as soon as they are available.
+    The audio is transcribed in windows of ASR_WINDOW_SECONDS (cut at quiet spots) and every whisper segment
+    is aligned on its own, so downstream stages can start working while the rest of the video is transcribed.
+    Blocking model calls run in a worker thread to keep the event loop free for the other pipeline stages.
+    On a transcript cache hit all words are yielded at once.
+    Args:
+        video_path: Path to the video file.
+        language: Optional language code for transcription (e.g., 'en' for English).
+        tmp_dir: Optional temporary directory for intermediate files.
+        use_cache: Look up and store the transcript in the transcript cache.
+    Yields:
+        Word Timelines in time order, one per aligned whisper segment.
+    """
+    global WHISPERX_MODEL, DEVICE
+    if not os.path.exists(video_path):
+        raise FileNotFoundError(f"Video not found: {video_path}")
+
+    tmp_dir = tmp_dir or tempfile.mkdtemp(prefix="transcribe_video_")
+    if not os.path.exists(tmp_dir):
+        os.makedirs(tmp_dir, exist_ok=True)
+
+    wav_path = os.path.join(tmp_dir, "extracted_audio.wav")
+    logger.info("Extracting audio for ASR...")
+    if not await asyncio.to_thread(_extract_audio_to_wav, video_path, wav_path):
+        raise RuntimeError("Failed to extract audio for transcription.")
+
+    cache_key = await asyncio.to_thread(_transcript_cache_key, wav_path, language, ASR_WINDOW_SECONDS) if use_cache else None
+    if cache_key:
+        cached = load_cached_transcript(cache_key)
+        if cached is not None:
+            logger.info(f"Transcript cache hit ({cache_key[:12]}), skipping ASR.")
+            if cached["word_level_timestamps"]:
+                yield cached["word_level_timestamps"]
+            return
+
+    audio = await asyncio.to_thread(whisperx.load_audio, wav_path)
+    align_model, metadata = await asyncio.to_thread(_get_align_model, language)
+    asr_language = language
+    segment_texts, segment_words = [], []
+    for start, end in _asr_windows(audio):
+        offset = start / ASR_SAMPLE_RATE
+        window_audio = audio[start:end]
+        logger.info(f"Transcribing window {offset:.1f}s - {end / ASR_SAMPLE_RATE:.1f}s ...")
+        result = await asyncio.to_thread(WHISPERX_MODEL.transcribe, window_audio, language=asr_language)
+        # Keep the language detected on the first window so later windows do not flip languages.
+        asr_language = asr_language or result.get("language")
+        for seg in result["segments"]:
+            result_aligned = await asyncio.to_thread(
+                whisperx.align, [seg], align_model, metadata, window_audio, DEVICE
+            )
+            words = _collect_words(result_aligned["segments"], offset=offset)
+            segment_texts.append(seg.get("text", ""))
+            segment_words.append(words)
+            if words:
+                yield words
+
+    if cache_key:
+        store_transcript(cache_key, {
+            "complete_transcript": " ".join(segment_texts),
+            "word_level_timestamps": Timeline.concat(segment_words),
+        })
+
 
 if __name__ == "__main__":
     import asyncio
     video = "input/Steve Jobs' 2005 Stanford Commencement Address.mp4"
     lang = "en"
     _load_models()
-    words = asyncio.run(transcribe_video(video, language=lang, tmp_dir="./output"))
-    print(json.dumps(words, indent=2))
+    transcription = asyncio.run(transcribe_video(video, language=lang, tmp_dir="./output"))
+    print(json.dumps(transcript_to_json(transcription), indent=2))
 
     # Command to test __main__ block
     # uv run python -m src.services.transcribe_video
@@ -0,0 +1,104 @@
+import hashlib
+import json
+import os
+import struct
+import tempfile
+import wave
+from typing import Dict, Optional
+
+from src.services.timeline import Timeline, as_timeline
+from src.config.settings import settings
+from src.config.logger_config import logger
+
+# Bump when the stored payload layout changes so old entries are ignored.
+TRANSCRIPT_CACHE_VERSION = 2
+# Entry layout: length of the UTF-8 complete transcript, the transcript, then the binary word Timeline.
+_ENTRY_HEADER = struct.Struct("<I")
+
+
+def _hash_wav_pcm(wav_path: str, block_frames: int = 1 << 20) -> str:
+    """
+    sha256 of the PCM samples of a WAV file. Only the sample data is hashed, so header differences
+    between ffmpeg builds (encoder tags etc.) do not change the fingerprint.
+    """
+    digest = hashlib.sha256()
+    with wave.open(wav_path, "rb") as wav:
+        digest.update(f"{wav.getframerate()}:{wav.getnchannels()}:{wav.getsampwidth()}".encode("utf-8"))
+        while frames := wav.readframes(block_frames):
+            digest.update(frames)
+    return digest.hexdigest()
+
+
+def transcript_cache_key(wav_path: str, model_size: str, language: Optional[str], align_model: str,
+                         mode: str = "full", window_seconds: Optional[float] = None) -> str:
+    """
+    Content address of a transcript: hash of the extracted 16 kHz PCM plus everything that changes the
+    ASR output (whisper model size, requested language, alignment model, whole-file or windowed transcription).
+    Args:
+        wav_path: Path to the extracted 16 kHz mono WAV.
+        model_size: Whisper model size (e.g. 'small').
+        language: Requested language code, None for auto-detection.
+        align_model: Name of the alignment model used for word timestamps.
+        mode: 'full' for one whole-file ASR pass, 'stream' for windowed ASR with per-segment alignment.
+        window_seconds: ASR window length of the 'stream' mode.
+    Returns:
+        Hex digest used as the cache entry name.
+    """
+    digest = hashlib.sha256()
+    digest.update(_hash_wav_pcm(wav_path).encode("utf-8"))
+    digest.update(json.dumps([TRANSCRIPT_CACHE_VERSION, model_size, language or "", align_model,
+                              mode, window_seconds]).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def _entry_path(key: str, cache_dir: Optional[str] = None) -> str:
+    cache_dir = cache_dir or settings.TRANSCRIPT_CACHE_DIR
+    return os.path.join(cache_dir, key[:2], f"{key}.tln")
+
+
+def load_cached_transcript(key: str, cache_dir: Optional[str] = None) -> Optional[Dict]:
+    """Return the cached {"complete_transcript", "word_level_timestamps": Timeline} payload for key, or None."""
+    path = _entry_path(key, cache_dir)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, "rb") as fh:
+            data = fh.read()
+        (text_len,) = _ENTRY_HEADER.unpack_from(data, 0)
+        text_end = _ENTRY_HEADER.size + text_len
+        return {
+            "complete_transcript": data[_ENTRY_HEADER.size:text_end].decode("utf-8"),
+            "word_level_timestamps": Timeline.from_bytes(data[text_end:]),
+        }
+    except (OSError, ValueError, struct.error) as e:
+        logger.warning(f"Ignoring unreadable transcript cache entry {path}: {e}")
+        return None
+
+
+def store_transcript(key: str, transcript: Dict, cache_dir: Optional[str] = None) -> str:
+    """Persist a transcript under key. The file is written atomically so concurrent readers never see partial entries."""
+    path = _entry_path(key, cache_dir)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        text = transcript.get("complete_transcript", "").encode("utf-8")
+        words = as_timeline(transcript.get("word_level_timestamps", []))
+        with os.fdopen(fd, "wb") as fh:
+            fh.write(_ENTRY_HEADER.pack(len(text)))
+            fh.write(text)
+            fh.write(words.to_bytes())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return path
+
+
+def transcript_to_json(transcript: Dict) -> Dict:
+    """JSON-serializable form of a transcript, with the word Timeline as {"word", "start", "end"} dicts."""
+    words = transcript.get("word_level_timestamps", [])
+    return {
+        "complete_transcript": transcript.get("complete_transcript", ""),
+        "word_level_timestamps": words.to_words() if isinstance(words, Timeline) else words,
+    }